@@ -4,20 +4,27 @@ Run:   python app.py
 Open:  http://localhost:8000
 """
 
-import os, sys, json, uuid, shutil, asyncio, subprocess, logging, time
+import os, re, sys, json, math, uuid, shutil, asyncio, subprocess, logging, time, itertools, contextvars, hashlib
+import sqlite3, threading, mimetypes, socket, signal, importlib, importlib.util
+from contextlib import contextmanager, asynccontextmanager, nullcontext
+from collections import deque, OrderedDict, Counter
 from pathlib import Path
 from typing import Optional, List
 from datetime import datetime
 
+IMPORT_STARTED = time.perf_counter()  # startup timings, see `startup`
+
 try:
     from fastapi import (
         FastAPI, UploadFile, File, Form, Request,
         HTTPException, WebSocket, WebSocketDisconnect
     )
-    from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response
+    from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response, StreamingResponse
     from fastapi.staticfiles import StaticFiles
     from fastapi.templating import Jinja2Templates
     from fastapi.middleware.cors import CORSMiddleware
+    from starlette.requests import ClientDisconnect
+    from starlette.background import BackgroundTask
 except ImportError:
     print("\n" + "="*60)
     print("  MISSING DEPENDENCIES — Run:")
@@ -29,28 +36,408 @@ except ImportError:
 BASE_DIR = Path(__file__).parent
 UPLOAD_DIR = BASE_DIR / "static" / "uploads"
 OUTPUT_DIR = BASE_DIR / "static" / "outputs"
+CACHE_DIR = BASE_DIR / "cache"
+DATA_DIR = BASE_DIR / "data"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger("vibe-studio")
 
-def check_ffmpeg():
+# ── FFmpeg capabilities ──────────────────────────────────────────────────────
+# Version, encoders and filters of the ffmpeg on PATH. Listing them takes a
+# few ffmpeg runs, so the result is kept in CACHE_DIR keyed by the binary's
+# path, size and mtime, and a restart only re-probes after ffmpeg changes.
+# Render code picks filters and the video encoder from it (pick_filter,
+# VIDEO_ENCODER) instead of failing mid-render on a build without them.
+# A listing that fails or times out is left empty (unknown: everything is
+# assumed present) and not cached; retry_ffmpeg_probe() tries again later.
+FFMPEG_CAPS_FILE = CACHE_DIR / "ffmpeg-capabilities.json"
+FFMPEG_CAPS_VERSION = 1  # bump when the probe's output format changes
+FFMPEG_CAPS_RETRY_S = 60
+
+def _ffmpeg_names(out, pattern):
+    return sorted(m.group(1) for m in re.finditer(pattern, out, re.M))
+
+def probe_ffmpeg():
+    """{"path", "version", "encoders", "filters", "complete", ...} for the
+    ffmpeg on PATH, from the on-disk cache when the binary hasn't changed;
+    None without a runnable ffmpeg."""
+    path = shutil.which("ffmpeg")
+    if not path: return None
+    st = os.stat(path)
+    key = [FFMPEG_CAPS_VERSION, os.path.realpath(path), st.st_size, st.st_mtime_ns]
     try:
-        r = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
-        logger.info(f"FFmpeg: {r.stdout.split(chr(10))[0]}")
-        return True
-    except FileNotFoundError:
-        logger.warning("FFmpeg NOT found — video export disabled")
-        return False
+        caps = json.loads(FFMPEG_CAPS_FILE.read_text())
+        if caps.get("key") == key: return dict(caps, source="cache")
+    except (OSError, ValueError): pass
+    t0 = time.perf_counter()
+    try:
+        procs = [subprocess.Popen([path, "-hide_banner", flag], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                  text=True) for flag in ("-version", "-encoders", "-filters")]
+    except OSError as e:
+        logger.warning(f"FFmpeg won't run: {e}")
+        return None
+    outs = []
+    for flag, p in zip(("-version", "-encoders", "-filters"), procs):
+        try:
+            outs.append(p.communicate(timeout=30)[0])
+        except subprocess.TimeoutExpired:
+            p.kill(); p.communicate()
+            logger.warning(f"FFmpeg capability probe: ffmpeg {flag} timed out")
+            outs.append(None)
+    version, encoders, filters = outs
+    caps = {"key": key, "path": path, "version": version.split("\n")[0] if version else "ffmpeg (version unknown)",
+            # " V....D libx264   libx264 H.264 ..." and " TSC gblur   V->V   Apply Gaussian Blur filter."
+            "encoders": _ffmpeg_names(encoders or "", r"^ [VAS][.F][.S][.X][.B][.D] (\S+)"),
+            "filters": _ffmpeg_names(filters or "", r"^ [.T][.S][.C] (\S+)\s+\S*->\S*"),
+            "complete": None not in outs, "probe_s": round(time.perf_counter() - t0, 3)}
+    if not caps["complete"]: return dict(caps, source="probe")
+    try:
+        FFMPEG_CAPS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp = FFMPEG_CAPS_FILE.with_name(f".{FFMPEG_CAPS_FILE.name}.{os.getpid()}")
+        tmp.write_text(json.dumps(caps))
+        os.replace(tmp, FFMPEG_CAPS_FILE)
+    except OSError as e:
+        logger.warning(f"Could not cache FFmpeg capabilities: {e}")
+    return dict(caps, source="probe")
+
+FFMPEG_CAPS = probe_ffmpeg()
+HAS_FFMPEG = FFMPEG_CAPS is not None
+if HAS_FFMPEG:
+    logger.info(f"FFmpeg: {FFMPEG_CAPS['version']} ({len(FFMPEG_CAPS['encoders'])} encoders, "
+                f"{len(FFMPEG_CAPS['filters'])} filters, {FFMPEG_CAPS['source']})")
+else:
+    logger.warning("FFmpeg NOT found — video export disabled")
+_caps_retried_at = float("-inf")
+
+async def retry_ffmpeg_probe():
+    """Probe again if the last probe was incomplete (at once the first time,
+    then at most every FFMPEG_CAPS_RETRY_S); on success re-pick the encoder, blurs and Ken Burns
+    engine. Called from warm_up() and at the start of each render."""
+    global FFMPEG_CAPS, VIDEO_ENCODER, KENBURNS_ENGINE, _caps_retried_at
+    if not FFMPEG_CAPS or FFMPEG_CAPS.get("complete", True): return
+    if time.monotonic() - _caps_retried_at < FFMPEG_CAPS_RETRY_S: return
+    _caps_retried_at = float("-inf")
+    caps = await asyncio.to_thread(probe_ffmpeg)
+    if not caps or not caps["complete"]: return
+    FFMPEG_CAPS = caps
+    logger.info(f"FFmpeg re-probed: {len(caps['encoders'])} encoders, {len(caps['filters'])} filters")
+    VIDEO_ENCODER = pick_encoder()
+    pick_blurs()
+    KENBURNS_ENGINE = pick_kenburns_engine(KENBURNS_ENGINE)
+
+# An empty list means the probe couldn't parse that listing: assume it's there.
+def has_filter(name):
+    filters = (FFMPEG_CAPS or {}).get("filters")
+    return not filters or name in filters
+
+def has_encoder(name):
+    encoders = (FFMPEG_CAPS or {}).get("encoders")
+    return not encoders or name in encoders
+
+def pick_filter(*choices):
+    """First of `choices` (filter strings like "gblur=sigma=30") this ffmpeg has."""
+    for f in choices:
+        if has_filter(f.split("=", 1)[0]): return f
+    logger.warning(f"FFmpeg has none of {', '.join(choices)}; skipping that step")
+    return "null"
 
-HAS_FFMPEG = check_ffmpeg()
+# Software encoders only, in order of preference: libx264, then the other
+# H.264 encoder, then MPEG-4 part 2 as a last resort.
+VIDEO_ENCODERS = ("libx264", "libopenh264", "mpeg4")
+
+def pick_encoder():
+    encoder = next((e for e in VIDEO_ENCODERS if has_encoder(e)), "libx264")
+    if encoder != "libx264":
+        logger.warning(f"FFmpeg has no libx264; encoding with {encoder}")
+    return encoder
+
+VIDEO_ENCODER = pick_encoder()
 
 # ── App ──────────────────────────────────────────────────────────────────────
-app = FastAPI(title="Vibe Studio", version="2.1.0")
+# Heavy optional modules (the Anthropic SDK alone takes about a second) are
+# imported where they are used, so startup doesn't wait for them. Once the
+# server is up, warm_up() imports them on a worker thread, so the first chat
+# or search request usually finds them loaded. VIBE_WARMUP="" turns it off.
+WARMUP_MODULES = [m for m in os.environ.get("VIBE_WARMUP", "httpx,anthropic,numpy,PIL.Image").split(",") if m]
+startup = {}  # seconds from import: "imported", "ready" (serving), "warm"; see /api/status
+
+async def warm_up():
+    for name in WARMUP_MODULES:
+        try: await asyncio.to_thread(importlib.import_module, name)
+        except ImportError: pass
+    await retry_ffmpeg_probe()
+    if os.environ.get("ANTHROPIC_API_KEY", "") and "anthropic" in sys.modules:
+        chat_client()  # open the SDK's connection pool before the first question
+    startup["warm"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+    logger.info(f"Warmed up {', '.join(WARMUP_MODULES) or 'nothing'} in {startup['warm'] - startup['ready']:.2f}s")
+
+@asynccontextmanager
+async def lifespan(app):
+    warm = asyncio.create_task(warm_up())
+    gc = asyncio.create_task(_gc_loop()) if GC_INTERVAL > 0 else None
+    startup["ready"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+    logger.info(f"Ready in {startup['ready']:.2f}s")
+    yield
+    warm.cancel()
+    if gc: gc.cancel()
+    await close_http_client()
+    await close_chat_client()
+
+app = FastAPI(title="Vibe Studio", version="2.1.0", lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
-projects = {}
+
+# ── Project store ────────────────────────────────────────────────────────────
+class SQLiteProjectStore:
+    """Projects persisted in SQLite with an in-process write-through cache.
+
+    Project settings, media items and audio tracks live in separate tables
+    keyed by (project_id, id), so single-item edits touch one indexed row.
+    The file runs in WAL mode so several uvicorn workers can share it; every
+    write bumps the project's version, and a cached project is reloaded
+    when the version on disk has moved on (another process wrote it).
+
+    Project dicts handed out are the cached copies: treat them as read-only
+    and change state through the methods below (`edit()` for changes that
+    span several rows).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS projects (
+            id TEXT PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS media (
+            project_id TEXT NOT NULL, id TEXT NOT NULL, ord REAL NOT NULL, data TEXT NOT NULL,
+            PRIMARY KEY (project_id, id)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS media_by_order ON media (project_id, ord);
+        CREATE INDEX IF NOT EXISTS media_by_audio ON media (project_id, json_extract(data, '$.meta.has_audio'));
+        CREATE TABLE IF NOT EXISTS audio_tracks (
+            project_id TEXT NOT NULL, id TEXT NOT NULL, pos INTEGER NOT NULL, data TEXT NOT NULL,
+            PRIMARY KEY (project_id, id)) WITHOUT ROWID;
+    """
+
+    def __init__(self, path):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA busy_timeout=5000")
+        self.db.executescript(self.SCHEMA)
+        self.lock = threading.RLock()
+        self.cache = {}  # pid -> (version, project, {mid: media item})
+
+    # ── transactions / loading ──
+    @contextmanager
+    def _tx(self):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.db
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def _version(self, pid):
+        row = self.db.execute("SELECT version FROM projects WHERE id=?", (pid,)).fetchone()
+        return row[0] if row else None
+
+    def _load(self, pid):
+        row = self.db.execute("SELECT version, data FROM projects WHERE id=?", (pid,)).fetchone()
+        if not row:
+            self.cache.pop(pid, None)
+            return None
+        project = json.loads(row[1])
+        project["media"] = [json.loads(d) for (d,) in self.db.execute(
+            "SELECT data FROM media WHERE project_id=? ORDER BY ord", (pid,))]
+        project["audio_tracks"] = [json.loads(d) for (d,) in self.db.execute(
+            "SELECT data FROM audio_tracks WHERE project_id=? ORDER BY pos", (pid,))]
+        self.cache[pid] = (row[0], project, {m["id"]: m for m in project["media"]})
+        return self.cache[pid]
+
+    def _entry(self, pid):
+        with self.lock:
+            version = self._version(pid)
+            if version is None:
+                self.cache.pop(pid, None)
+                return None
+            entry = self.cache.get(pid)
+            return entry if entry and entry[0] == version else self._load(pid)
+
+    def _bump(self, pid):
+        """Bump the row version inside a write transaction; keeps the cache
+        entry only if it was current before this write."""
+        old = self._version(pid)
+        self.db.execute("UPDATE projects SET version=version+1 WHERE id=?", (pid,))
+        entry = self.cache.get(pid)
+        if entry and entry[0] == old:
+            self.cache[pid] = (old + 1,) + entry[1:]
+            return self.cache[pid]
+        self.cache.pop(pid, None)
+        return None
+
+    # ── reads ──
+    def __contains__(self, pid):
+        with self.lock:
+            return self._version(pid) is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+
+    def get(self, pid, default=None):
+        entry = self._entry(pid)
+        return entry[1] if entry else default
+
+    def __getitem__(self, pid):
+        entry = self._entry(pid)
+        if entry is None: raise KeyError(pid)
+        return entry[1]
+
+    def get_media(self, pid, mid):
+        entry = self._entry(pid)
+        return entry[2].get(mid) if entry else None
+
+    def audible_media(self, pid):
+        """Ids of the project's media items probed as having an audio stream."""
+        with self.lock:
+            return {mid for (mid,) in self.db.execute(
+                "SELECT id FROM media WHERE project_id=? AND json_extract(data, '$.meta.has_audio') = 1", (pid,))}
+
+    # ── writes ──
+    def create(self, project):
+        project = dict(project)
+        media, tracks = project.pop("media", []), project.pop("audio_tracks", [])
+        with self._tx() as db:
+            db.execute("INSERT INTO projects (id, version, data) VALUES (?, 1, ?)",
+                       (project["id"], json.dumps(project)))
+            self._write_items(project["id"], media, tracks)
+        return self[project["id"]]
+
+    def _write_items(self, pid, media, tracks):
+        self.db.execute("DELETE FROM media WHERE project_id=?", (pid,))
+        self.db.execute("DELETE FROM audio_tracks WHERE project_id=?", (pid,))
+        self.db.executemany("INSERT INTO media (project_id, id, ord, data) VALUES (?, ?, ?, ?)",
+                            [(pid, m["id"], m.get("order", i), json.dumps(m)) for i, m in enumerate(media)])
+        self.db.executemany("INSERT INTO audio_tracks (project_id, id, pos, data) VALUES (?, ?, ?, ?)",
+                            [(pid, t["id"], i, json.dumps(t)) for i, t in enumerate(tracks)])
+
+    @contextmanager
+    def edit(self, pid):
+        """Transaction over a fresh copy of the project; written back on exit.
+        If the body (or the write) fails, the rollback covers the database and
+        the half-edited copy is dropped from the cache."""
+        with self.lock:
+            try:
+                with self._tx():
+                    entry = self._load(pid)
+                    if entry is None: raise KeyError(pid)
+                    project = entry[1]
+                    yield project
+                    settings = {k: v for k, v in project.items() if k not in ("media", "audio_tracks")}
+                    self.db.execute("UPDATE projects SET data=? WHERE id=?", (json.dumps(settings), pid))
+                    self._write_items(pid, project["media"], project["audio_tracks"])
+                    self._bump(pid)
+                    self.cache[pid] = self.cache[pid][:2] + ({m["id"]: m for m in project["media"]},)
+            except BaseException:
+                self.cache.pop(pid, None)
+                raise
+
+    def update(self, pid, **fields):
+        """Set project-level fields; False if the project doesn't exist."""
+        with self._tx() as db:
+            row = db.execute("SELECT data FROM projects WHERE id=?", (pid,)).fetchone()
+            if not row: return False
+            settings = dict(json.loads(row[0]), **fields)
+            db.execute("UPDATE projects SET data=? WHERE id=?", (json.dumps(settings), pid))
+            entry = self._bump(pid)
+            if entry: entry[1].update(fields)
+        return True
+
+    def add_media(self, pid, item):
+        """Append a media item at the end of the timeline (sets its order)."""
+        with self._tx() as db:
+            item["order"] = db.execute("SELECT COUNT(*) FROM media WHERE project_id=?", (pid,)).fetchone()[0]
+            db.execute("INSERT INTO media (project_id, id, ord, data) VALUES (?, ?, ?, ?)",
+                       (pid, item["id"], item["order"], json.dumps(item)))
+            entry = self._bump(pid)
+            if entry:
+                entry[1]["media"].append(item); entry[2][item["id"]] = item
+        return item
+
+    def update_media(self, pid, mid, fields):
+        """Merge fields into one media item; returns it, or None if missing."""
+        with self._tx() as db:
+            row = db.execute("SELECT data FROM media WHERE project_id=? AND id=?", (pid, mid)).fetchone()
+            if not row: return None
+            item = dict(json.loads(row[0]), **fields)
+            db.execute("UPDATE media SET data=?, ord=? WHERE project_id=? AND id=?",
+                       (json.dumps(item), item["order"], pid, mid))
+            entry = self._bump(pid)
+            if entry:
+                entry[2][mid].update(fields)
+                if "order" in fields: entry[1]["media"].sort(key=lambda m: m["order"])
+        return item
+
+    def delete_media(self, pid, mid):
+        with self._tx() as db:
+            db.execute("DELETE FROM media WHERE project_id=? AND id=?", (pid, mid))
+            entry = self._bump(pid)
+            if entry:
+                entry[1]["media"] = [m for m in entry[1]["media"] if m["id"] != mid]
+                entry[2].pop(mid, None)
+
+    def add_audio_track(self, pid, track):
+        with self._tx() as db:
+            pos = db.execute("SELECT COALESCE(MAX(pos) + 1, 0) FROM audio_tracks WHERE project_id=?",
+                             (pid,)).fetchone()[0]
+            db.execute("INSERT INTO audio_tracks (project_id, id, pos, data) VALUES (?, ?, ?, ?)",
+                       (pid, track["id"], pos, json.dumps(track)))
+            entry = self._bump(pid)
+            if entry: entry[1]["audio_tracks"].append(track)
+        return track
+
+    def update_audio_track(self, pid, aid, fields):
+        with self._tx() as db:
+            row = db.execute("SELECT data FROM audio_tracks WHERE project_id=? AND id=?", (pid, aid)).fetchone()
+            if not row: return None
+            track = dict(json.loads(row[0]), **fields)
+            db.execute("UPDATE audio_tracks SET data=? WHERE project_id=? AND id=?", (json.dumps(track), pid, aid))
+            entry = self._bump(pid)
+            if entry:
+                for t in entry[1]["audio_tracks"]:
+                    if t["id"] == aid: t.update(fields)
+        return track
+
+    def referenced_files(self):
+        """(upload paths, output URLs) that some project still points at."""
+        with self.lock:
+            paths = {p for (p,) in self.db.execute(
+                "SELECT json_extract(data, '$.path') FROM media UNION ALL "
+                "SELECT json_extract(data, '$.path') FROM audio_tracks") if p}
+            urls = set()
+            for output, draft, renditions in self.db.execute(
+                    "SELECT json_extract(data, '$.output'), json_extract(data, '$.draft_output'), "
+                    "json_extract(data, '$.renditions') FROM projects"):
+                urls.update(filter(None, [output, draft, *json.loads(renditions or "{}").values()]))
+        return paths, urls
+
+STORE_BACKENDS = {"sqlite": SQLiteProjectStore}
+
+def open_store(url):
+    """Open the project store named by a URL like sqlite:///data/vibe.db
+    (relative to BASE_DIR; sqlite:////abs/path for absolute, sqlite://:memory:
+    for a throwaway store)."""
+    scheme, _, path = url.partition("://")
+    if scheme not in STORE_BACKENDS: raise ValueError(f"Unknown project store: {url}")
+    path = path[1:] if path.startswith("/") else path
+    if path != ":memory:" and not os.path.isabs(path):
+        path = str(BASE_DIR / path)
+    return STORE_BACKENDS[scheme](path)
+
+projects = open_store(os.environ.get("VIBE_STORE", f"sqlite:///{(DATA_DIR / 'vibe.db').relative_to(BASE_DIR)}"))
 
 VIDEO_CATEGORIES = {
     "motivational": {"label": "💪 Motivational", "color_filter": "eq=brightness=0.06:saturation=1.3"},
@@ -73,17 +460,696 @@ AUDIO_VIBES = {
     "custom":     {"label": "🎵 Custom",     "desc": "Upload your own audio"},
 }
 
-async def run_ffmpeg(cmd, timeout=120):
-    logger.info(f"FFmpeg: {' '.join(cmd[:8])}...")
-    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+# ── Metrics ───────────────────────────────────────────────────────────────────
+# A few Prometheus-style collectors, exposed in text format on /metrics.
+# Values live in this process; with VIBE_WEB_WORKERS > 1 each worker
+# reports its own.
+METRICS = []
+SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+SPEED_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+
+def _label_str(names, values):
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+    pairs = [f'{n}="{escape(v)}"' for n, v in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class CounterMetric:
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        self.name, self.doc, self.labels = name, doc, tuple(labels)
+        self.values = {}
+        METRICS.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def inc(self, n=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + n
+
+    def set(self, v, **labels):
+        self.values[self._key(labels)] = v
+
+    def lines(self):
+        for key, v in self.values.items():
+            yield f"{self.name}{_label_str(self.labels, key)} {v}"
+
+class GaugeMetric(CounterMetric):
+    kind = "gauge"
+
+    def dec(self, n=1, **labels):
+        self.inc(-n, **labels)
+
+class HistogramMetric(CounterMetric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, v, **labels):
+        key = self._key(labels)
+        counts = self.values.setdefault(key, [0] * len(self.buckets) + [0, 0.0])  # buckets..., count, sum
+        for i, b in enumerate(self.buckets):
+            if v <= b: counts[i] += 1
+        counts[-2] += 1
+        counts[-1] += v
+
+    def lines(self):
+        for key, counts in self.values.items():
+            for b, c in zip(self.buckets + ("+Inf",), counts[:-1]):
+                yield f"{self.name}_bucket{_label_str(self.labels + ('le',), key + (b,))} {c}"
+            yield f"{self.name}_count{_label_str(self.labels, key)} {counts[-2]}"
+            yield f"{self.name}_sum{_label_str(self.labels, key)} {round(counts[-1], 6)}"
+
+def render_metrics():
+    out = []
+    for m in METRICS:
+        out += [f"# HELP {m.name} {m.doc}", f"# TYPE {m.name} {m.kind}", *m.lines()]
+    return "\n".join(out) + "\n"
+
+FFMPEG_SECONDS = HistogramMetric("vibe_ffmpeg_seconds", "Wall time of ffmpeg runs by pipeline stage",
+                           ("stage", "media_type", "resolution"))
+FFMPEG_SPEED = HistogramMetric("vibe_ffmpeg_speed_ratio", "Encode speed as a multiple of realtime", ("stage",), SPEED_BUCKETS)
+FFMPEG_RUNS = CounterMetric("vibe_ffmpeg_runs_total", "Finished ffmpeg runs by exit code (or timeout/cancelled/feed_error)",
+                      ("stage", "exit_code"))
+FFMPEG_IN_FLIGHT = GaugeMetric("vibe_ffmpeg_in_flight", "ffmpeg processes running now")
+CACHE_LOOKUPS = CounterMetric("vibe_cache_lookups_total", "Disk cache lookups", ("cache", "result"))
+CACHE_EVICTIONS = CounterMetric("vibe_cache_evictions_total", "Disk cache evictions", ("cache",))
+CACHE_BYTES = GaugeMetric("vibe_cache_bytes", "Bytes held by each disk cache", ("cache",))
+CACHE_HIT_RATIO = GaugeMetric("vibe_cache_hit_ratio", "Hits / lookups since start", ("cache",))
+UPLOAD_BYTES = CounterMetric("vibe_upload_bytes_total", "Upload bytes received")
+UPLOADS = CounterMetric("vibe_uploads_total", "Finished uploads by media type", ("media_type",))
+JOBS = GaugeMetric("vibe_jobs", "Render jobs by status (finished ones are kept for a while)", ("status",))
+JOB_SECONDS = HistogramMetric("vibe_job_seconds", "Render job run time", ("profile", "engine", "status"))
+JOB_QUEUE_SECONDS = HistogramMetric("vibe_job_queue_seconds", "Time render jobs waited in the queue")
+PROJECTS = GaugeMetric("vibe_projects", "Projects in the store")
+ADMISSION_REJECTED = CounterMetric("vibe_admission_rejected_total", "Requests refused with 429/503 by reason",
+                                   ("reason",))
+RESOURCE_SLOTS = GaugeMetric("vibe_resource_slots", "Governor slots in use and waiters, by class", ("class", "state"))
+GC_BYTES = CounterMetric("vibe_gc_reclaimed_bytes_total", "Bytes removed by the storage GC", ("kind",))
+STORAGE_BYTES = GaugeMetric("vibe_storage_bytes", "Bytes on disk per area, as of the last storage GC", ("area",))
+
+# Render job the current task works for; run_ffmpeg registers its children
+# there so cancelling the job can kill them.
+current_job_id = contextvars.ContextVar("current_job_id", default=None)
+
+def _parse_progress(stats, duration):
+    """Turn one ffmpeg -progress block into {out_time, frame, speed, fraction}."""
+    def num(key, cast=float):
+        try: return cast(stats.get(key, "").rstrip("x"))
+        except ValueError: return None
+    # out_time_ms is in microseconds too (long-standing ffmpeg quirk)
+    us = num("out_time_us", int) or num("out_time_ms", int) or 0
+    out_time = max(0.0, us / 1e6)
+    return {"out_time": round(out_time, 2), "frame": num("frame", int), "speed": num("speed"),
+            "fraction": min(1.0, out_time / duration) if duration else None}
+
+async def run_ffmpeg(cmd, timeout=120, stage=None, part=None, duration=None, feed=None, labels=None):
+    """Run ffmpeg with -progress on stdout. Progress goes to the current job
+    under (stage, part); only the tail of stderr is kept for error reports.
+    `feed`, if given, is an async callable that writes ffmpeg's stdin.
+    `labels` (stage, media_type, resolution) tag the run in the metrics
+    and in the job's trace; the stage also picks the governor slot class,
+    and `timeout` counts from when the slot and the threads are held."""
+    labels = {"stage": stage or "other", "media_type": "-", "resolution": "-", **(labels or {})}
+    async with governor.slot(FFMPEG_STAGE_CLASSES.get(labels["stage"], "segment")), ffmpeg_threads.lease(cmd) as cmd:
+        return await _run_ffmpeg(cmd, timeout, stage, part, duration, feed, labels)
+
+async def _run_ffmpeg(cmd, timeout, stage, part, duration, feed, labels):
+    logger.info(f"FFmpeg [{labels['stage']}]: {' '.join(cmd[:8])}...")
+    logger.debug(f"FFmpeg argv: {cmd}")
+    cmd = [cmd[0], "-progress", "pipe:1", "-nostats"] + list(cmd[1:])
+    t0 = time.time()
+    proc = await asyncio.create_subprocess_exec(*limited(cmd), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                stdin=asyncio.subprocess.PIPE if feed else asyncio.subprocess.DEVNULL)
+    FFMPEG_IN_FLIGHT.inc()
+    rt = _job_runtime.get(current_job_id.get(), {})
+    job_procs = rt.get("procs")
+    if job_procs is not None: job_procs.add(proc)
+    stderr_tail = deque(maxlen=40)
+    last, feed_error = {}, []
+
+    async def read_progress():
+        stats = {}
+        async for raw in proc.stdout:
+            key, _, val = raw.decode(errors="replace").strip().partition("=")
+            if key != "progress":
+                stats[key] = val
+            else:
+                last.update(_parse_progress(stats, duration))
+                if stage: report_progress(stage, part, last)
+
+    async def read_stderr():
+        async for raw in proc.stderr:
+            stderr_tail.append(raw.decode(errors="replace"))
+
+    async def write_stdin():
+        try:
+            await feed(proc.stdin)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # ffmpeg quit early; its exit code and stderr say why
+        except Exception as e:  # the frames themselves failed: stop ffmpeg, so the reads and wait() end
+            feed_error.append(e)
+            if proc.returncode is None: proc.kill()
+        finally:
+            proc.stdin.close()
+
+    def record(exit_code):
+        seconds = time.time() - t0
+        speed = last.get("speed") or (duration / seconds if duration and exit_code == 0 and seconds > 0 else None)
+        FFMPEG_IN_FLIGHT.dec()
+        FFMPEG_RUNS.inc(stage=labels["stage"], exit_code=exit_code)
+        FFMPEG_SECONDS.observe(seconds, **labels)
+        if speed: FFMPEG_SPEED.observe(speed, stage=labels["stage"])
+        if "trace" in rt:
+            rt["trace"].append({**labels, "part": part, "start_s": round(t0 - rt["started_at"], 3),
+                                "seconds": round(seconds, 3), "exit_code": exit_code,
+                                "speed": round(speed, 2) if speed else None})
+
+    tasks = asyncio.gather(read_progress(), read_stderr(), proc.wait(), *([write_stdin()] if feed else []))
+    tasks.add_done_callback(lambda f: f.cancelled() or f.exception())  # a cancelled read is expected, not an error
     try:
-        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        await asyncio.wait_for(tasks, timeout=timeout)
     except asyncio.TimeoutError:
-        proc.kill(); return {"success": False, "error": "Timed out"}
+        proc.kill(); record("timeout"); return {"success": False, "error": "Timed out"}
+    except asyncio.CancelledError:
+        if proc.returncode is None: proc.kill()
+        record("cancelled")
+        await asyncio.shield(proc.wait())  # reap it, so a worker shutting down leaves no orphan transport
+        raise
+    finally:
+        if job_procs is not None: job_procs.discard(proc)
+    if feed_error:
+        logger.warning(f"FFmpeg [{labels['stage']}] input feed failed: {feed_error[0]!r}")
+        record("feed_error"); return {"success": False, "error": f"Input feed failed: {feed_error[0]}"}
+    record(proc.returncode)
     if proc.returncode != 0:
-        return {"success": False, "error": stderr.decode()[-500:]}
-    return {"success": True}
+        return {"success": False, "error": "".join(stderr_tail)[-500:]}
+    if stage:
+        report_progress(stage, part, {"fraction": 1.0})
+    return {"success": True, "log": "".join(stderr_tail)}
+
+# ── Render engines ───────────────────────────────────────────────────────────
+# "segments": encode each item to its own file, concat, then mix audio.
+# "single_pass": one filter_complex graph and a single encode, no intermediates.
+RENDER_ENGINES = ("segments", "single_pass")
+RENDER_ENGINE = os.environ.get("VIBE_RENDER_ENGINE", "segments")
+
+# ── Render profiles ──────────────────────────────────────────────────────────
+# "final" is the full-quality export. "draft" is for checking order and
+# timing: a third of the resolution, at most 15 fps, ultrafast x264 and a
+# box blur for still backgrounds. Drafts use their own cache entries, so
+# re-running a draft after a small edit only re-encodes what changed.
+# Without libx264 the "fallback" options of the encoder in use apply, and
+# without gblur the final blur is a box blur too.
+RENDER_PROFILES = {
+    "final": {"scale": 1.0, "max_fps": None, "x264": ["-preset", "fast"], "blurs": ("gblur=sigma=30", "boxblur=20:2"),
+              "fallback": {"libopenh264": ["-b:v", "8M"], "mpeg4": ["-q:v", "3"]}},
+    "draft": {"scale": 1 / 3, "max_fps": 15, "x264": ["-preset", "ultrafast", "-crf", "30"], "blurs": ("boxblur=10:1",),
+              "fallback": {"libopenh264": ["-b:v", "1M"], "mpeg4": ["-q:v", "8"]}},
+}
+
+def pick_blurs():
+    """Set each profile's "blur" to the first of its "blurs" this ffmpeg has."""
+    for profile in RENDER_PROFILES.values():
+        profile["blur"] = pick_filter(*profile["blurs"])
+
+pick_blurs()
+
+def video_args(profile):
+    """-c:v and quality options for VIDEO_ENCODER under `profile`."""
+    if VIDEO_ENCODER == "libx264": return ["-c:v", "libx264", *profile["x264"]]
+    return ["-c:v", VIDEO_ENCODER, *profile["fallback"][VIDEO_ENCODER]]
+
+# ── Render pool ──────────────────────────────────────────────────────────────
+# Segment encodes run concurrently. RENDER_WORKERS caps in-flight encoders
+# across every project, JOB_SEGMENT_WORKERS caps a single render. Each
+# encoder asks for its render's share of the ffmpeg thread budget and gets
+# what the whole process has free, so concurrent renders share one budget.
+CPU_COUNT = os.cpu_count() or 2
+RENDER_WORKERS = max(1, int(os.environ.get("VIBE_RENDER_WORKERS", min(CPU_COUNT, 8))))
+JOB_SEGMENT_WORKERS = max(1, int(os.environ.get("VIBE_JOB_SEGMENT_WORKERS", RENDER_WORKERS)))
+FFMPEG_THREAD_BUDGET = max(1, int(os.environ.get("VIBE_FFMPEG_THREADS", CPU_COUNT)))
+
+def segment_threads(n_segments):
+    """ffmpeg -threads value for each encoder of a render with n_segments."""
+    parallel = max(1, min(n_segments, JOB_SEGMENT_WORKERS, RENDER_WORKERS))
+    return max(1, FFMPEG_THREAD_BUDGET // parallel)
+
+class ThreadBudget:
+    """FFMPEG_THREAD_BUDGET threads, shared by every ffmpeg in the process."""
+
+    def __init__(self, total):
+        self.total = self.free = total
+        self.freed = asyncio.Event()
+
+    @asynccontextmanager
+    async def lease(self, cmd):
+        """Hold threads for `cmd` while it runs. Its -threads values are what
+        it asks for; it gets cmd back with them cut down to what is free (at
+        least one each), waiting while nothing is."""
+        at = [i + 1 for i, a in enumerate(cmd[:-1]) if a == "-threads"]
+        if not at:
+            yield cmd
+            return
+        want = sum(int(cmd[i]) for i in at)
+        while self.free <= 0:
+            self.freed.clear()
+            await self.freed.wait()
+        n = min(want, self.free)
+        self.free -= n
+        try:
+            cmd = list(cmd)
+            for i in at: cmd[i] = str(max(1, int(cmd[i]) * n // want))
+            yield cmd
+        finally:
+            self.free += n
+            self.freed.set()
+
+ffmpeg_threads = ThreadBudget(FFMPEG_THREAD_BUDGET)
+
+# ── Resource governor ────────────────────────────────────────────────────────
+# Every ffmpeg/ffprobe child runs in a slot of its class, so a burst of
+# requests queues here instead of forking more encoders than the box has
+# cores (the ffmpeg timeout only starts once the slot is held). Work a
+# request waits on (trims) is refused with 503 + Retry-After once its class
+# already has (1 + GOVERNOR_QUEUE) x limit requests in flight or the load
+# average per core passes VIBE_MAX_LOAD; new renders get 429 once
+# VIBE_MAX_QUEUED_JOBS are queued.
+# Children run under nice/ionice and, with VIBE_FFMPEG_MEMORY_MB, an
+# address-space cap (via the nice, ionice and prlimit tools where installed).
+RESOURCE_LIMITS = {
+    "segment": RENDER_WORKERS,  # segment, still and single-pass encodes
+    "concat": max(1, int(os.environ.get("VIBE_CONCAT_WORKERS", 2))),  # joins and HLS packaging
+    "mix": max(1, int(os.environ.get("VIBE_MIX_WORKERS", 2))),  # audio beds and track leveling
+    "trim": max(1, int(os.environ.get("VIBE_TRIM_WORKERS", 2))),  # smart cuts
+    "probe": max(1, int(os.environ.get("VIBE_PROBE_WORKERS", 2))),  # ffprobe runs
+}
+FFMPEG_STAGE_CLASSES = {"segments": "segment", "still": "segment", "render": "segment", "concat": "concat",
+                        "package": "concat", "audio": "mix", "audio_prep": "mix", "cut": "trim"}
+GOVERNOR_QUEUE = max(1, int(os.environ.get("VIBE_GOVERNOR_QUEUE", 4)))  # waiters per slot before refusing
+MAX_LOAD = float(os.environ.get("VIBE_MAX_LOAD", 0))  # 1-minute load per core; 0 disables the check
+MAX_QUEUED_JOBS = max(1, int(os.environ.get("VIBE_MAX_QUEUED_JOBS", 32)))
+FFMPEG_NICE = int(os.environ.get("VIBE_FFMPEG_NICE", 10))
+FFMPEG_IONICE = os.environ.get("VIBE_FFMPEG_IONICE", "best-effort")  # "best-effort" (lowest level), "idle" or ""
+FFMPEG_MEMORY_BYTES = int(float(os.environ.get("VIBE_FFMPEG_MEMORY_MB", 0)) * 1024 * 1024)
+IONICE_CLASSES = {"best-effort": ["-c", "2", "-n", "7"], "idle": ["-c", "3"]}
+
+def _child_prefix():
+    prefix = []
+    if FFMPEG_MEMORY_BYTES:
+        if shutil.which("prlimit"): prefix += ["prlimit", f"--as={FFMPEG_MEMORY_BYTES}", "--"]
+        else: logger.warning("VIBE_FFMPEG_MEMORY_MB set but prlimit is not installed; no memory cap")
+    if FFMPEG_NICE and shutil.which("nice"): prefix += ["nice", "-n", str(FFMPEG_NICE)]
+    if FFMPEG_IONICE in IONICE_CLASSES and shutil.which("ionice"): prefix += ["ionice", *IONICE_CLASSES[FFMPEG_IONICE]]
+    return prefix
+
+CHILD_PREFIX = _child_prefix()
+_installed = {}  # executable -> found on PATH
+
+def limited(cmd):
+    """argv that runs `cmd` under the child limits. A program that isn't
+    installed keeps its plain argv, so spawning it still raises FileNotFoundError."""
+    if cmd[0] not in _installed: _installed[cmd[0]] = shutil.which(cmd[0]) is not None
+    return CHILD_PREFIX + list(cmd) if CHILD_PREFIX and _installed[cmd[0]] else list(cmd)
+
+def retry_later(detail, retry_after, status=503):
+    return HTTPException(status, detail, headers={"Retry-After": str(max(1, min(600, math.ceil(retry_after))))})
+
+class ResourceGovernor:
+    """Per-class slots for child processes, with the bookkeeping admit()
+    needs to turn work away before it queues behind what can't finish."""
+
+    def __init__(self, limits):
+        self.limits = dict(limits)
+        self.slots = {c: asyncio.Semaphore(n) for c, n in self.limits.items()}
+        self.running, self.waiting, self.admitted, self.rejected = Counter(), Counter(), Counter(), Counter()
+        self.hold = dict.fromkeys(self.limits, 5.0)  # moving averages: seconds a slot is held,
+        self.served = dict.fromkeys(self.limits, 10.0)  # and seconds an admitted request takes
+
+    @asynccontextmanager
+    async def slot(self, cls):
+        self.waiting[cls] += 1
+        try:
+            await self.slots[cls].acquire()
+        finally:
+            self.waiting[cls] -= 1
+        self.running[cls] += 1
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.running[cls] -= 1
+            self.slots[cls].release()
+            self.hold[cls] += 0.2 * (time.time() - t0 - self.hold[cls])
+
+    def load(self):
+        try: return os.getloadavg()[0] / CPU_COUNT
+        except OSError: return None
+
+    def check_load(self):
+        load = self.load()
+        if MAX_LOAD and load is not None and load > MAX_LOAD:
+            self.rejected["load"] += 1
+            ADMISSION_REJECTED.inc(reason="load")
+            raise retry_later(f"Server busy (load {load:.2f} per core)", 15)
+
+    @contextmanager
+    def admit(self, cls):
+        """Admit a request that will run `cls` work, or raise 503 when enough
+        are in flight to keep the class busy for a while."""
+        self.check_load()
+        limit = self.limits[cls]
+        if self.admitted[cls] >= (1 + GOVERNOR_QUEUE) * limit:
+            self.rejected[cls] += 1
+            ADMISSION_REJECTED.inc(reason=cls)
+            raise retry_later(f"Too many {cls} requests in flight",
+                              self.served[cls] * (self.admitted[cls] - limit + 1) / limit)
+        self.admitted[cls] += 1
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.admitted[cls] -= 1
+            self.served[cls] += 0.2 * (time.time() - t0 - self.served[cls])
+
+    def stats(self):
+        load = self.load()
+        return {"limits": self.limits, "running": {c: self.running[c] for c in self.limits},
+                "waiting": {c: self.waiting[c] for c in self.limits},
+                "admitted": {c: self.admitted[c] for c in self.limits}, "queue_per_slot": GOVERNOR_QUEUE,
+                "rejected": dict(self.rejected), "load_per_core": round(load, 2) if load is not None else None,
+                "max_load": MAX_LOAD or None, "max_queued_jobs": MAX_QUEUED_JOBS,
+                "child": {"nice": FFMPEG_NICE, "ionice": FFMPEG_IONICE or None,
+                          "memory_bytes": FFMPEG_MEMORY_BYTES or None, "prefix": CHILD_PREFIX}}
 
+governor = ResourceGovernor(RESOURCE_LIMITS)
+
+# ── Scratch space ────────────────────────────────────────────────────────────
+# Every render (and smart cut) writes its intermediates into a directory of
+# its own, SCRATCH_DIR/vibe-scratch/<host>/<pid>-<tag>-<rand>, removed when
+# it finishes; the storage GC clears directories whose process is gone. With
+# VIBE_SCRATCH_TMPFS set (e.g. /dev/shm) renders use that RAM-backed
+# directory instead while it has VIBE_SCRATCH_TMPFS_MIN_MB free. Both may be
+# shared directories like /tmp: the GC only looks inside vibe-scratch/ and
+# only at names new_scratch() makes.
+SCRATCH_DIR = Path(os.environ.get("VIBE_SCRATCH_DIR", BASE_DIR / "scratch"))
+SCRATCH_TMPFS = Path(os.environ["VIBE_SCRATCH_TMPFS"]) if os.environ.get("VIBE_SCRATCH_TMPFS") else None
+SCRATCH_TMPFS_MIN_BYTES = int(float(os.environ.get("VIBE_SCRATCH_TMPFS_MIN_MB", 1024)) * 1024 * 1024)
+SCRATCH_HOST = socket.gethostname()
+SCRATCH_NAME = re.compile(r"(\d+)-\w+-[0-9a-f]{6}")  # <pid>-<tag>-<rand>
+current_scratch = contextvars.ContextVar("current_scratch", default=None)
+_live_scratch = set()
+_loose_scratch = None  # this process's directory for scratch files written outside a render
+
+def scratch_bases():
+    return [d / "vibe-scratch" for d in (SCRATCH_DIR, SCRATCH_TMPFS) if d]
+
+def scratch_roots():
+    return [b / SCRATCH_HOST for b in scratch_bases()]
+
+def new_scratch(tag):
+    root = SCRATCH_DIR
+    if SCRATCH_TMPFS:
+        try:
+            SCRATCH_TMPFS.mkdir(parents=True, exist_ok=True)
+            if shutil.disk_usage(SCRATCH_TMPFS).free >= SCRATCH_TMPFS_MIN_BYTES: root = SCRATCH_TMPFS
+        except OSError as e:
+            logger.warning(f"tmpfs scratch {SCRATCH_TMPFS} unusable: {e}")
+    d = root / "vibe-scratch" / SCRATCH_HOST / f"{os.getpid()}-{tag}-{uuid.uuid4().hex[:6]}"
+    d.mkdir(parents=True)
+    _live_scratch.add(d)
+    return d
+
+def drop_scratch(d):
+    _live_scratch.discard(d)
+    shutil.rmtree(d, ignore_errors=True)
+
+@contextmanager
+def render_scratch(tag):
+    """Scratch directory for the render running in this context; scratch_path() resolves into it."""
+    d = new_scratch(tag)
+    token = current_scratch.set(d)
+    try:
+        yield d
+    finally:
+        current_scratch.reset(token)
+        drop_scratch(d)
+
+def scratch_path(name):
+    global _loose_scratch
+    d = current_scratch.get()
+    if d is None:  # outside a render (benchmarks, one-off calls): collected once this process exits
+        if _loose_scratch is None:
+            _loose_scratch = SCRATCH_DIR / "vibe-scratch" / SCRATCH_HOST / f"{os.getpid()}-loose-{uuid.uuid4().hex[:6]}"
+            _live_scratch.add(_loose_scratch)
+        d = _loose_scratch
+        d.mkdir(parents=True, exist_ok=True)
+    return d / name
+
+
+# ── Disk caches ──────────────────────────────────────────────────────────────
+try: import fcntl
+except ImportError: fcntl = None  # Windows: pins only hold within one process
+
+class DiskCache:
+    """Size-bounded LRU cache of files under `root`, keyed by hex digest.
+
+    The directory is the index, so processes sharing `root` (uvicorn and
+    render workers) see each other's entries and one size limit: file mtimes
+    give the LRU order and eviction rescans the directory. Entries a running
+    render still needs are pinned. A pin also holds a shared flock on the
+    file, and eviction only removes files it can lock exclusively, so it
+    never takes an entry another process has pinned.
+    """
+
+    def __init__(self, name, root, max_bytes, suffix=""):
+        self.name, self.root, self.max_bytes, self.suffix = name, Path(root), max_bytes, suffix
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.pins = Counter()
+        self.locks = {}  # key -> fd holding a shared lock on a pinned entry
+        self.hits = self.misses = self.evictions = 0
+        self.rescan()
+
+    def rescan(self):
+        """Rebuild the index from the directory, least recently used first."""
+        found = []
+        for e in os.scandir(self.root):
+            if e.name.startswith(".") or not e.name.endswith(self.suffix): continue
+            try: st = e.stat()
+            except OSError: continue  # evicted by another process meanwhile
+            found.append((st.st_mtime, e.name[:len(e.name) - len(self.suffix)] if self.suffix else e.name, st.st_size))
+        self.entries = OrderedDict((key, size) for _, key, size in sorted(found))  # key -> size
+        self.total = sum(self.entries.values())
+
+    def path(self, key):
+        return self.root / f"{key}{self.suffix}"
+
+    def owns(self, path):
+        return Path(path).parent == self.root
+
+    def _lock(self, key, path=None):
+        """Hold a shared lock on the file for `key` (or `path`, about to become
+        it); False if there is no such file."""
+        if fcntl is None: return True
+        if key in self.locks and path is None:
+            try:  # still the file at that path, not one another process has put since
+                if os.stat(self.path(key)).st_ino == os.fstat(self.locks[key]).st_ino: return True
+            except OSError: pass
+        path = path or self.path(key)
+        try: fd = os.open(path, os.O_RDONLY)
+        except OSError: return False
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        try:  # an evictor may have unlinked it between the open and the lock
+            stale = path == self.path(key) and os.stat(path).st_ino != os.fstat(fd).st_ino
+        except OSError:
+            stale = True
+        if stale:
+            os.close(fd)
+            return False
+        if key in self.locks: os.close(self.locks.pop(key))
+        self.locks[key] = fd
+        return True
+
+    def get(self, key):
+        """Path of a cached entry (marked most recently used) or None."""
+        if self.max_bytes <= 0:
+            return None
+        p = self.path(key)
+        try:
+            if self.pins[key] and not self._lock(key): raise FileNotFoundError(p)
+            os.utime(p)
+            size = p.stat().st_size
+        except OSError:
+            self.total -= self.entries.pop(key, 0)
+            self.misses += 1
+            return None
+        self.total += size - self.entries.pop(key, 0)
+        self.entries[key] = size
+        self.hits += 1
+        return str(p)
+
+    def put(self, key, src):
+        """Move `src` into the cache; returns the path to use from now on."""
+        if self.max_bytes <= 0:
+            return str(src)
+        p = self.path(key)
+        # src may be on another filesystem (tmpfs scratch), where a move is a
+        # copy: land it under a dot name first so a partial copy is never an entry
+        tmp = self.root / f".{key}.{uuid.uuid4().hex[:6]}"
+        try:
+            shutil.move(str(src), str(tmp))
+            if self.pins[key]: self._lock(key, tmp)  # locked before it is visible to evict()
+            os.replace(tmp, p)
+        except BaseException:
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
+        self.total -= self.entries.pop(key, 0)
+        self.entries[key] = p.stat().st_size
+        self.total += self.entries[key]
+        self.evict()
+        return str(p)
+
+    def pin(self, key):
+        self.pins[key] += 1
+        if self.pins[key] == 1: self._lock(key)
+
+    def unpin(self, key):
+        self.pins[key] -= 1
+        if self.pins[key] <= 0:
+            del self.pins[key]
+            if key in self.locks: os.close(self.locks.pop(key))
+
+    def _remove(self, key):
+        """Delete an entry unless some process holds it pinned."""
+        p = self.path(key)
+        if fcntl is None:
+            try: os.remove(p)
+            except OSError: pass
+            return True
+        try: fd = os.open(p, os.O_RDONLY)
+        except OSError: return True  # already gone
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.stat(p).st_ino == os.fstat(fd).st_ino: os.remove(p)
+            return True
+        except OSError:
+            return False  # pinned (or replaced) by another process
+        finally:
+            os.close(fd)
+
+    def evict(self):
+        self.rescan()  # entries other processes added count against the limit too
+        for key in list(self.entries):
+            if self.total <= self.max_bytes: break
+            if self.pins[key] or not self._remove(key): continue
+            self.total -= self.entries.pop(key)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "bytes": self.total, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None}
+
+SEGMENT_CACHE_VERSION = 1  # bump when segment output changes in ways the command line doesn't show
+segment_cache = DiskCache("segments", CACHE_DIR / "segments",
+                          int(float(os.environ.get("VIBE_SEGMENT_CACHE_MB", 2048)) * 1024 * 1024), ".mp4")
+_file_digests = {}  # (path, size, mtime_ns) -> sha256
+
+def _sha256_of(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h
+
+def _sha256_file(path):
+    return _sha256_of(path).hexdigest()
+
+def remember_digest(path, digest):
+    """Seed the digest memo for a file whose hash is already known (uploads)."""
+    st = os.stat(path)
+    _file_digests[(str(path), st.st_size, st.st_mtime_ns)] = digest
+
+async def file_digest(path):
+    """sha256 of a file's contents, memoised on (path, size, mtime)."""
+    st = os.stat(path)
+    memo = (str(path), st.st_size, st.st_mtime_ns)
+    if memo not in _file_digests:
+        _file_digests[memo] = await asyncio.to_thread(_sha256_file, path)
+    return _file_digests[memo]
+
+async def segment_cache_key(cmd, source, source_id, generator=None):
+    """Key a segment by its source content and the exact ffmpeg recipe.
+
+    The command already spells out trim, duration, size, fps, color filter
+    and encoder settings; the input path is swapped for `source_id` (a
+    content hash) and the per-run -threads/output arguments are dropped.
+    Segments whose frames are piped in name their `generator` instead,
+    which is keyed together with `source_id`.
+    """
+    recipe = [source_id if a == source else a for a in cmd[:-3]]
+    if generator: recipe += [source_id, generator]
+    blob = json.dumps([SEGMENT_CACHE_VERSION, recipe])
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+# Image segments start from a prepared still: blurred, cover-cropped
+# background with the whole image fitted on top, rendered once per
+# (image, w, h) so segment encodes only run zoompan + color on it.
+still_cache = DiskCache("stills", CACHE_DIR / "stills",
+                        int(float(os.environ.get("VIBE_STILL_CACHE_MB", 1024)) * 1024 * 1024), ".png")
+_still_renders = {}  # key -> task rendering that still
+
+def still_filter(w, h, profile=RENDER_PROFILES["final"]):
+    return (
+        # Background: scale to fill, crop to frame, blur
+        f"[0:v]split=2[bg][fg];"
+        f"[bg]scale={w}:{h}:force_original_aspect_ratio=increase,"
+        f"crop={w}:{h}:(iw-{w})/2:(ih-{h})/2,{profile['blur']}[bgb];"
+        # Foreground: fit entire image (no crop)
+        f"[fg]scale={w}:{h}:force_original_aspect_ratio=decrease[fgs];"
+        # Overlay foreground centered on blurred bg
+        f"[bgb][fgs]overlay=(W-w)/2:(H-h)/2"
+    )
+
+async def still_key(item, w, h, profile=RENDER_PROFILES["final"]):
+    digest = await file_digest(item["path"])
+    return hashlib.sha256(json.dumps([digest, w, h, still_filter(w, h, profile)]).encode()).hexdigest()
+
+async def prepare_still(item, key, w, h, profile=RENDER_PROFILES["final"]):
+    """Path of the prepared still for `key`, rendering it if it isn't cached.
+    Concurrent requests for the same still share one ffmpeg run."""
+    cached = still_cache.get(key)
+    if cached: return cached
+    # without the cache the still lives in the render's scratch, so only that render may share it
+    shared = still_cache.max_bytes > 0
+    memo = key if shared else (key, current_scratch.get())
+    task = _still_renders.get(memo)
+    if task is None:
+        task = _still_renders[memo] = asyncio.create_task(_render_still(item["path"], key, w, h, profile))
+        task.add_done_callback(lambda _: _still_renders.pop(memo, None))
+    # a shared still outlives a cancelled render (others may be waiting for it);
+    # one in scratch is cancelled with its render, before the scratch is dropped
+    return await (asyncio.shield(task) if shared else task)
+
+async def _render_still(src, key, w, h, profile):
+    if still_cache.max_bytes > 0:
+        tmp = still_cache.root / f".{key}.{uuid.uuid4().hex[:6]}.png"
+    else:
+        tmp = scratch_path(f"still_{key[:12]}_{uuid.uuid4().hex[:6]}.png")
+    r = await run_ffmpeg(["ffmpeg", "-y", "-filter_complex_threads", "1", "-i", src,
+                          "-filter_complex", still_filter(w, h, profile), "-frames:v", "1", "-threads", "1", str(tmp)], 60,
+                         labels={"stage": "still", "media_type": "image", "resolution": f"{w}x{h}"})
+    if not r["success"]:
+        logger.error(f"Still for {src} failed: {r.get('error','')[:200]}")
+        try: os.remove(tmp)
+        except OSError: pass
+        return None
+    return still_cache.put(key, tmp)
 
 # ══════════════════════════════════════════════════════════════════════════════
 # ALL API ROUTES (defined BEFORE static mount)
@@ -117,7 +1183,43 @@ async def list_audio_vibes():
 
 @app.get("/api/status")
 async def get_status():
-    return {"ffmpeg": HAS_FFMPEG, "projects": len(projects), "version": "2.1.0"}
+    refresh_jobs()
+    return {"ffmpeg": HAS_FFMPEG, "projects": len(projects), "version": "2.1.0",
+            "jobs": {st: sum(1 for j in jobs.values() if j["status"] == st) for st in JOB_ACTIVE},
+            "segment_cache": segment_cache.stats(), "still_cache": still_cache.stats(),
+            "bed_cache": bed_cache.stats(), "download_cache": download_cache.stats(), "job_queue": JOB_QUEUE,
+            "resources": governor.stats(),
+            "storage": last_gc and {k: last_gc[k] for k in ("finished", "bytes", "usage")},
+            "encoder": VIDEO_ENCODER, "kenburns": KENBURNS_ENGINE, "startup": startup,
+            **({"workers": job_queue.workers()} if job_queue else {})}
+
+@app.get("/api/admin/ffmpeg")
+async def ffmpeg_capabilities():
+    """The probed ffmpeg build and what the renderer picked from it."""
+    if not FFMPEG_CAPS: raise HTTPException(404, "FFmpeg not installed")
+    return {**{k: v for k, v in FFMPEG_CAPS.items() if k != "key"}, "encoder": VIDEO_ENCODER,
+            "kenburns": KENBURNS_ENGINE, "zoompan": has_filter("zoompan"),
+            "blur": {name: p["blur"] for name, p in RENDER_PROFILES.items()}}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition. Gauges for jobs, projects and caches are
+    sampled here; ffmpeg, upload and job timings accumulate as they happen."""
+    refresh_jobs()
+    for st in ("queued", "running", "complete", "failed", "cancelled"):
+        JOBS.set(sum(1 for j in jobs.values() if j["status"] == st), status=st)
+    PROJECTS.set(len(projects))
+    for cls in governor.limits:
+        RESOURCE_SLOTS.set(governor.running[cls], **{"class": cls, "state": "running"})
+        RESOURCE_SLOTS.set(governor.waiting[cls], **{"class": cls, "state": "waiting"})
+    for c in (segment_cache, still_cache, bed_cache, download_cache):
+        st = c.stats()
+        CACHE_LOOKUPS.set(st["hits"], cache=c.name, result="hit")
+        CACHE_LOOKUPS.set(st["misses"], cache=c.name, result="miss")
+        CACHE_EVICTIONS.set(st["evictions"], cache=c.name)
+        CACHE_BYTES.set(st["bytes"], cache=c.name)
+        CACHE_HIT_RATIO.set(st["hit_rate"] or 0, cache=c.name)
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # ── Audio Search ──────────────────────────────────────────────────────────────
 CURATED_AUDIO = [
@@ -135,6 +1237,31 @@ CURATED_AUDIO = [
     {"id": "12", "title": "Romantic Piano", "user": "Royalty-Free", "duration": 130, "genre": "romantic,piano,love,wedding,soft,emotional", "preview_url": ""},
 ]
 
+# One pooled client for outbound HTTP, so keep-alive connections and TLS
+# sessions are reused. It is bound to the event loop that created it.
+_http = None  # (loop, httpx.AsyncClient)
+
+def http_client():
+    global _http
+    import httpx
+    loop = asyncio.get_running_loop()
+    if _http is None or _http[0] is not loop:
+        _http = (loop, httpx.AsyncClient(follow_redirects=True, timeout=httpx.Timeout(30, connect=10),
+                                         limits=httpx.Limits(max_connections=32, max_keepalive_connections=8)))
+    return _http[1]
+
+async def close_http_client():
+    """Close the pool at shutdown (lifespan), if this loop opened it."""
+    global _http
+    if _http and _http[0] is asyncio.get_running_loop():
+        client, _http = _http[1], None
+        await client.aclose()
+
+# Pixabay asks API users to cache search results for 24 hours.
+AUDIO_SEARCH_TTL = float(os.environ.get("VIBE_AUDIO_SEARCH_TTL", 86400))
+AUDIO_SEARCH_CACHE_SIZE = 256
+_audio_searches = OrderedDict()  # (query, per_page) -> (expires, response), least recently used first
+
 @app.get("/api/audio/search")
 async def search_audio(q: str, per_page: int = 12, api_key: str = ""):
     """Search royalty-free music. Uses Pixabay API if key provided, else curated list."""
@@ -142,30 +1269,37 @@ async def search_audio(q: str, per_page: int = 12, api_key: str = ""):
     key = api_key or os.environ.get("PIXABAY_API_KEY", "")
 
     if key:
+        ck = (" ".join(q.lower().split()), per_page)
+        hit = _audio_searches.get(ck)
+        if hit and hit[0] > time.time():
+            _audio_searches.move_to_end(ck)
+            return hit[1]
         try:
-            import httpx
-            async with httpx.AsyncClient() as client:
-                r = await client.get(
-                    "https://pixabay.com/api/",
-                    params={"key": key, "q": q, "media_type": "music", "per_page": per_page},
-                    timeout=10,
-                )
-                logger.info(f"Pixabay response: {r.status_code}")
-                if r.status_code == 200:
-                    data = r.json()
-                    results = []
-                    for h in data.get("hits", []):
-                        results.append({
-                            "id": h.get("id"),
-                            "title": h.get("tags", "Untitled"),
-                            "user": h.get("user", "Unknown"),
-                            "duration": h.get("duration", 0),
-                            "preview_url": h.get("previewURL", ""),
-                            "download_url": h.get("audio", h.get("previewURL", "")),
-                        })
-                    return {"results": results, "total": data.get("totalHits", 0), "source": "pixabay"}
-                else:
-                    logger.error(f"Pixabay error {r.status_code}: {r.text[:200]}")
+            r = await http_client().get(
+                "https://pixabay.com/api/",
+                params={"key": key, "q": q, "media_type": "music", "per_page": per_page},
+                timeout=10,
+            )
+            logger.info(f"Pixabay response: {r.status_code}")
+            if r.status_code == 200:
+                data = r.json()
+                results = []
+                for h in data.get("hits", []):
+                    results.append({
+                        "id": h.get("id"),
+                        "title": h.get("tags", "Untitled"),
+                        "user": h.get("user", "Unknown"),
+                        "duration": h.get("duration", 0),
+                        "preview_url": h.get("previewURL", ""),
+                        "download_url": h.get("audio", h.get("previewURL", "")),
+                    })
+                found = {"results": results, "total": data.get("totalHits", 0), "source": "pixabay"}
+                _audio_searches[ck] = (time.time() + AUDIO_SEARCH_TTL, found)
+                _audio_searches.move_to_end(ck)
+                while len(_audio_searches) > AUDIO_SEARCH_CACHE_SIZE: _audio_searches.popitem(last=False)
+                return found
+            else:
+                logger.error(f"Pixabay error {r.status_code}: {r.text[:200]}")
         except Exception as e:
             logger.error(f"Audio search error: {e}")
 
@@ -179,179 +1313,1085 @@ async def search_audio(q: str, per_page: int = 12, api_key: str = ""):
         "note": "Add your Pixabay API key in Settings for real music search with audio previews. Free key at pixabay.com/api/docs/"
     }
 
+# Proxied downloads are kept on disk by URL: a repeat download of the same
+# track is served locally (with Range/ETag) instead of fetched again.
+download_cache = DiskCache("audio-downloads", CACHE_DIR / "audio-downloads",
+                           int(float(os.environ.get("VIBE_AUDIO_DOWNLOAD_CACHE_MB", 512)) * 1024 * 1024), ".mp3")
+
 @app.get("/api/audio/download")
-async def download_audio_proxy(url: str):
-    """Proxy download of audio to avoid CORS."""
+async def download_audio_proxy(url: str, request: Request):
+    """Proxy download of audio to avoid CORS. Bytes are passed on as they
+    arrive, and written to download_cache on the way through."""
+    if not url.startswith(("http://", "https://")): raise HTTPException(400, "Only http(s) URLs can be proxied")
+    key = hashlib.sha256(url.encode()).hexdigest()
+    cached = download_cache.get(key)
+    if cached:
+        return deliver_file(request, cached, "audio.mp3", "audio/mpeg")
+    client = http_client()
     try:
-        import httpx
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            r = await client.get(url, timeout=30)
-            if r.status_code == 200:
-                return Response(content=r.content, media_type="audio/mpeg",
-                                headers={"Content-Disposition": "attachment; filename=audio.mp3"})
+        r = await client.send(client.build_request("GET", url), stream=True)
     except Exception as e:
-        raise HTTPException(500, str(e))
+        raise HTTPException(502, f"Audio download failed: {e}")
+    if r.status_code != 200:
+        await r.aclose()
+        raise HTTPException(502, f"Audio download failed: upstream returned {r.status_code}")
+    tmp = download_cache.root / f".{key}.{uuid.uuid4().hex[:6]}.part" if download_cache.max_bytes > 0 else None
+
+    async def body():
+        complete = False
+        try:
+            with open(tmp, "wb") if tmp else nullcontext() as out:
+                async for chunk in r.aiter_bytes(UPLOAD_CHUNK):
+                    if out: await asyncio.to_thread(out.write, chunk)
+                    yield chunk
+            complete = True
+        finally:
+            await r.aclose()
+            if tmp and complete: download_cache.put(key, tmp)
+            elif tmp:  # upstream or client dropped mid-file
+                try: os.remove(tmp)
+                except OSError: pass
+
+    headers = {"Content-Disposition": "attachment; filename=audio.mp3"}
+    # aiter_bytes() undoes any gzip/deflate, so the upstream length only holds for an unencoded body
+    if "content-length" in r.headers and r.headers.get("content-encoding", "identity").lower() == "identity":
+        headers["Content-Length"] = r.headers["content-length"]
+    return StreamingResponse(body(), media_type="audio/mpeg", headers=headers)
 
 # ── Project API ───────────────────────────────────────────────────────────────
 @app.post("/api/project/create")
 async def create_project(category: str = Form("motivational"), audio_vibe: str = Form("energetic"), duration: int = Form(30)):
     pid = str(uuid.uuid4())[:8]
     (UPLOAD_DIR / pid).mkdir(parents=True, exist_ok=True)
-    projects[pid] = {
+    projects.create({
         "id": pid, "category": category, "audio_vibe": audio_vibe,
         "target_duration": duration, "media": [],
         "audio_tracks": [],  # list of {id, filename, path, url, role, volume}
         "audio_file": None,  # legacy compat
         "video_volume": 100,  # 0-100 for original video audio
         "status": "draft", "created": datetime.now().isoformat(),
-    }
+    })
     return {"project_id": pid}
 
 @app.get("/api/project/{pid}")
 async def get_project(pid: str):
-    if pid not in projects: raise HTTPException(404)
-    return projects[pid]
+    project = projects.get(pid)
+    if project is None: raise HTTPException(404)
+    return project
 
 @app.put("/api/project/{pid}")
 async def update_project(pid: str, request: Request):
     if pid not in projects: raise HTTPException(404)
     data = await request.json()
-    for k in ["category", "audio_vibe", "target_duration", "video_volume"]:
-        if k in data: projects[pid][k] = data[k]
+    projects.update(pid, **{k: data[k] for k in ["category", "audio_vibe", "target_duration", "video_volume"] if k in data})
     return {"status": "updated"}
 
+# ── Media Probing ─────────────────────────────────────────────────────────────
+# Every upload is probed once, in the background, and the result stored on
+# the item as "meta"; the render planner reads it instead of re-probing.
+_probes = {}  # sha256 or path -> shared probe task
+_probe_tasks = set()
+
+def _meta_from_ffprobe(info):
+    streams, fmt = info.get("streams") or [], info.get("format") or {}
+    v = next((s for s in streams if s.get("codec_type") == "video"
+              and not s.get("disposition", {}).get("attached_pic")), None)
+    a = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    rotation, fps = 0, None
+    if v:
+        rotation = int(float(v.get("tags", {}).get("rotate", 0)))
+        for sd in v.get("side_data_list", []):
+            if "rotation" in sd: rotation = int(sd["rotation"])
+        num, _, den = v.get("avg_frame_rate", "0/0").partition("/")
+        fps = round(int(num) / int(den), 3) if den and int(den) else None
+    duration = fmt.get("duration") or (v or a or {}).get("duration")
+    return {"duration": float(duration) if duration else None,
+            "width": v and v.get("width"), "height": v and v.get("height"),
+            "vcodec": v and v.get("codec_name"), "acodec": a and a.get("codec_name"),
+            "fps": fps, "rotation": rotation % 360, "has_audio": a is not None}
+
+def _meta_from_ffmpeg(err):
+    """Same fields, read from the stream listing ffmpeg prints for -i."""
+    dur = re.search(r"Duration: (\d+):(\d+):([\d.]+)", err)
+    v = re.search(r"Stream #\S+.*?: Video: (\w+).*?, (\d{2,5})x(\d{2,5})\b", err)
+    fps = re.search(r"Video: .*?, ([\d.]+) (?:fps|tbr)", err)
+    a = re.search(r"Stream #\S+.*?: Audio: (\w+)", err)
+    rot = re.search(r"rotation of (-?[\d.]+) degrees", err) or re.search(r"rotate\s*: (-?\d+)", err)
+    return {"duration": int(dur[1]) * 3600 + int(dur[2]) * 60 + float(dur[3]) if dur else None,
+            "width": int(v[2]) if v else None, "height": int(v[3]) if v else None,
+            "vcodec": v[1] if v else None, "acodec": a[1] if a else None,
+            "fps": float(fps[1]) if v and fps else None,
+            "rotation": int(float(rot[1])) % 360 if rot else 0, "has_audio": a is not None}
+
+async def probe_media(path):
+    """Duration, size, codecs, fps, rotation and audio presence of a file."""
+    async with governor.slot("probe"):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *limited(["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", path]),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+            out, _ = await asyncio.wait_for(proc.communicate(), 30)
+            return _meta_from_ffprobe(json.loads(out or b"{}"))
+        except FileNotFoundError:
+            # No ffprobe on this box: fall back to ffmpeg's own listing
+            proc = await asyncio.create_subprocess_exec(
+                *limited(["ffmpeg", "-hide_banner", "-i", path]), stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+            _, err = await asyncio.wait_for(proc.communicate(), 30)
+            return _meta_from_ffmpeg(err.decode(errors="replace"))
+
+async def media_meta(item):
+    """The item's stored metadata, probing now (once per content) if it has none yet."""
+    if item.get("meta"): return item["meta"]
+    key = item.get("sha256") or item["path"]
+    task = _probes.get(key)
+    if task is None:  # concurrent callers for the same content share one ffprobe
+        task = _probes[key] = asyncio.ensure_future(probe_media(item["path"]))
+        task.add_done_callback(lambda _: _probes.pop(key, None))
+    try:
+        meta = dict(await asyncio.shield(task))
+    except Exception as e:
+        logger.warning(f"Probe failed for {item['path']}: {e}")
+        return None
+    if item["type"] == "image": meta["duration"] = None  # stills have no running time
+    return meta
+
+def schedule_probe(pid, item):
+    """Probe a new upload in the background and store the result on the item.
+    Audio tracks are also transcoded and measured for the mixer."""
+    async def run():
+        meta = await media_meta(item)
+        if meta is None: return
+        if item["type"] == "audio":
+            projects.update_audio_track(pid, item["id"], {"meta": meta})
+            await prepare_audio(pid, item)
+        else: projects.update_media(pid, item["id"], {"meta": meta})
+    task = asyncio.create_task(run())
+    _probe_tasks.add(task)
+    task.add_done_callback(_probe_tasks.discard)
+
+# ── Audio Normalization ───────────────────────────────────────────────────────
+# Audio tracks are transcoded once, after upload, to 48 kHz stereo PCM next
+# to the original and measured (EBU R128) in the same ffmpeg run. Renders
+# loop the WAV instead of decoding the upload again (PCM also loops without
+# the AAC priming gap), and level every track to AUDIO_TARGET_LUFS before
+# its volume slider applies.
+AUDIO_RATE = 48000
+AUDIO_TARGET_LUFS = float(os.environ.get("VIBE_AUDIO_TARGET_LUFS", -16))
+AUDIO_MAX_GAIN_DB = 20.0
+AUDIO_PEAK_CEILING_DB = -1.0
+_audio_preps = {}  # PCM path -> shared transcode task
+
+def _loudness_from_ebur128(log):
+    """Integrated loudness (LUFS), loudness range (LU) and true peak (dBFS)
+    from the summary ebur128 prints at the end of a run."""
+    summary = log.rsplit("Summary:", 1)[-1]
+    num = r"(-?inf|-?[\d.]+)"
+    i, lra, tp = (re.search(rf"{label}:\s+{num}", summary) for label in ("I", "LRA", "Peak"))
+    if not i: return None
+    return {"i": float(i[1]), "lra": float(lra[1]) if lra else None, "tp": float(tp[1]) if tp else None}
+
+async def _transcode_audio(src, pcm):
+    tmp = f"{pcm}.{uuid.uuid4().hex[:6]}.tmp"
+    r = await run_ffmpeg(["ffmpeg", "-y", "-i", src, "-vn",
+                          "-af", f"ebur128=peak=true:framelog=quiet,aresample={AUDIO_RATE}",
+                          "-ac", "2", "-c:a", "pcm_s16le", "-f", "wav", tmp], 300,
+                         labels={"stage": "audio_prep", "media_type": "audio"})
+    loudness = _loudness_from_ebur128(r.get("log", "")) if r["success"] else None
+    if loudness is None:
+        logger.error(f"Audio prep for {src} failed: {r.get('error', 'no loudness summary')[:200]}")
+        try: os.remove(tmp)
+        except OSError: pass
+        return None
+    os.replace(tmp, pcm)
+    return loudness
+
+async def prepare_audio(pid, track):
+    """(PCM path, loudness) for an audio track, transcoding it on first use;
+    (None, None) if the source can't be decoded."""
+    pcm = str(Path(track["path"]).with_suffix(".pcm.wav"))
+    if track.get("loudness") and os.path.exists(pcm): return pcm, track["loudness"]
+    task = _audio_preps.get(pcm)
+    if task is None:  # duplicate uploads share one file, so one transcode
+        task = _audio_preps[pcm] = asyncio.ensure_future(_transcode_audio(track["path"], pcm))
+        task.add_done_callback(lambda _: _audio_preps.pop(pcm, None))
+    loudness = await asyncio.shield(task)
+    if loudness is None: return None, None
+    projects.update_audio_track(pid, track["id"], {"loudness": loudness})
+    return pcm, loudness
+
+def track_gain(track, loudness):
+    """Linear gain for a track: leveled to AUDIO_TARGET_LUFS (never boosted
+    past the peak ceiling), then its volume slider."""
+    db = 0.0
+    if loudness and loudness["i"] > -70:  # -70 LUFS is ebur128's floor for silence
+        ceiling = max(0.0, AUDIO_PEAK_CEILING_DB - loudness["tp"]) if loudness["tp"] is not None else 0.0
+        db = min(AUDIO_TARGET_LUFS - loudness["i"], AUDIO_MAX_GAIN_DB, ceiling)
+    return round(track.get("volume", 50) / 100.0 * 10 ** (db / 20), 4)
+
 # ── Upload API ────────────────────────────────────────────────────────────────
+UPLOAD_CHUNK = 1 << 20
+MAX_UPLOAD_BYTES = int(os.environ.get("VIBE_MAX_UPLOAD_MB", 4096)) << 20   # per file
+MAX_REQUEST_BYTES = int(os.environ.get("VIBE_MAX_REQUEST_MB", 8192)) << 20  # per upload request
+RESUMABLE_CHUNK = 8 << 20  # suggested PUT size for resumable uploads
+PARTIAL_UPLOAD_DIR = CACHE_DIR / "partial-uploads"
+_upload_hashes = {}  # upload id -> (offset, running sha256)
+_upload_locks = {}
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Refuse oversized upload requests from Content-Length, before the body is read."""
+    if request.method in ("POST", "PUT") and "/upload" in request.url.path:
+        n = request.headers.get("content-length", "")
+        if n.isdigit() and int(n) > MAX_REQUEST_BYTES:
+            return JSONResponse(status_code=413, content={"detail": f"Request exceeds {MAX_REQUEST_BYTES >> 20} MB"})
+    return await call_next(request)
+
+async def iter_upload(f):
+    while chunk := await f.read(UPLOAD_CHUNK):
+        yield chunk
+
+def _write_chunk(out, h, chunk):
+    out.write(chunk)
+    h.update(chunk)
+
+async def stream_to_file(chunks, dest, limit, h=None, append=False):
+    """Write an async iterable of byte chunks to `dest`, hashing as it goes.
+
+    Returns (bytes written, sha256 object). More than `limit` bytes is a 413.
+    A fresh file is removed on any failure; an appended one is truncated
+    back on a 413 but keeps what arrived before a client dropped, so a
+    resumable upload can carry on from there.
+    """
+    h = h or hashlib.sha256()
+    n = 0
+    try:
+        with open(dest, "ab" if append else "wb") as out:
+            start = out.tell()
+            async for chunk in chunks:
+                n += len(chunk)
+                UPLOAD_BYTES.inc(len(chunk))
+                if n > limit:
+                    out.truncate(start)
+                    raise HTTPException(413, f"Upload exceeds {limit >> 20} MB")
+                await asyncio.to_thread(_write_chunk, out, h, chunk)
+    except BaseException:
+        if not append: os.remove(dest)
+        raise
+    return n, h
+
+def add_upload(pid, fid, filename, fp, digest):
+    """Attach a finished upload to the project as an audio track or media item.
+    Content already in the project is reused instead of being stored twice."""
+    project = projects[pid]
+    ext = Path(filename).suffix.lower()
+    url = f"/static/uploads/{pid}/{Path(fp).name}"
+    dup = next((m for m in project["media"] + project["audio_tracks"]
+                if m.get("sha256") == digest and os.path.exists(m["path"])), None)
+    if dup:
+        os.remove(fp)
+        fp, url = dup["path"], dup["url"]
+        logger.info(f"Upload {filename} duplicates {dup['filename']} in project {pid}")
+    else:
+        remember_digest(fp, digest)
+    UPLOADS.inc(media_type="audio" if ext in [".mp3",".wav",".aac",".ogg",".m4a"]
+                else "video" if ext in [".mp4",".mov",".avi",".mkv",".webm"] else "image")
+    if ext in [".mp3",".wav",".aac",".ogg",".m4a"]:
+        audio_item = {
+            "id": fid, "type": "audio", "filename": filename,
+            "path": str(fp), "url": url, "sha256": digest,
+            "role": f"Audio {len(project['audio_tracks'])+1}",
+            "volume": 50, "loudness": dup and dup.get("loudness")
+        }
+        projects.add_audio_track(pid, audio_item)
+        projects.update(pid, audio_file=str(fp))  # legacy compat: last uploaded
+        schedule_probe(pid, audio_item)
+        return {"id": fid, "type": "audio", "filename": filename, "url": url}
+    mtype = "video" if ext in [".mp4",".mov",".avi",".mkv",".webm"] else "image"
+    item = {"id": fid, "type": mtype, "filename": filename, "path": str(fp), "url": url, "sha256": digest,
+            "trim_start": 0, "trim_end": None, "caption": "", "custom_duration": None, "meta": None}
+    schedule_probe(pid, item)
+    return projects.add_media(pid, item)
+
 @app.post("/api/project/{pid}/upload")
 async def upload_media(pid: str, files: List[UploadFile] = File(...)):
     if pid not in projects: raise HTTPException(404)
-    project = projects[pid]
-    results = []
+    results, budget = [], MAX_REQUEST_BYTES
     for f in files:
         fid = str(uuid.uuid4())[:8]
-        ext = Path(f.filename).suffix.lower()
-        safe = f"{fid}{ext}"
-        fp = UPLOAD_DIR / pid / safe
-        with open(fp, "wb") as out:
-            out.write(await f.read())
-        if ext in [".mp3",".wav",".aac",".ogg",".m4a"]:
-            audio_item = {
-                "id": fid, "type": "audio", "filename": f.filename,
-                "path": str(fp), "url": f"/static/uploads/{pid}/{safe}",
-                "role": f"Audio {len(project['audio_tracks'])+1}",
-                "volume": 50
-            }
-            project["audio_tracks"].append(audio_item)
-            project["audio_file"] = str(fp)  # legacy compat: last uploaded
-            results.append({"id": fid, "type": "audio", "filename": f.filename, "url": f"/static/uploads/{pid}/{safe}"})
-            continue
-        mtype = "video" if ext in [".mp4",".mov",".avi",".mkv",".webm"] else "image"
-        item = {"id": fid, "type": mtype, "filename": f.filename, "path": str(fp),
-                "url": f"/static/uploads/{pid}/{safe}", "order": len(project["media"]),
-                "trim_start": 0, "trim_end": None, "caption": "", "custom_duration": None}
-        project["media"].append(item)
-        results.append(item)
-    return {"uploaded": results, "total": len(project["media"])}
+        fp = UPLOAD_DIR / pid / f"{fid}{Path(f.filename).suffix.lower()}"
+        n, h = await stream_to_file(iter_upload(f), fp, min(MAX_UPLOAD_BYTES, budget))
+        budget -= n
+        results.append(add_upload(pid, fid, f.filename, fp, h.hexdigest()))
+    return {"uploaded": results, "total": len(projects[pid]["media"])}
+
+# Resumable uploads: POST to open a session, PUT byte ranges
+# (Content-Range: bytes start-end/total) in order, GET to find where to
+# resume. The last range finishes the upload like a regular one.
+def _partial_paths(pid, uid):
+    if not re.fullmatch(r"[0-9a-f]{8}", uid): raise HTTPException(404, "Unknown upload")
+    d = PARTIAL_UPLOAD_DIR / pid
+    return d / f"{uid}.part", d / f"{uid}.json"
+
+def _upload_session(pid, uid):
+    part, meta = _partial_paths(pid, uid)
+    if not meta.exists(): raise HTTPException(404, "Unknown upload")
+    return part, json.loads(meta.read_text())
+
+@app.post("/api/project/{pid}/uploads")
+async def start_upload(pid: str, request: Request):
+    if pid not in projects: raise HTTPException(404)
+    data = await request.json()
+    size = int(data.get("size", -1))
+    if size <= 0 or not data.get("filename"): raise HTTPException(400, "filename and size are required")
+    if size > MAX_UPLOAD_BYTES: raise HTTPException(413, f"Upload exceeds {MAX_UPLOAD_BYTES >> 20} MB")
+    uid = uuid.uuid4().hex[:8]
+    part, meta = _partial_paths(pid, uid)
+    part.parent.mkdir(parents=True, exist_ok=True)
+    part.touch()
+    meta.write_text(json.dumps({"filename": data["filename"], "size": size}))
+    return {"upload_id": uid, "offset": 0, "size": size, "chunk_size": RESUMABLE_CHUNK}
+
+@app.get("/api/project/{pid}/uploads/{uid}")
+async def upload_status(pid: str, uid: str):
+    part, meta = _upload_session(pid, uid)
+    return {"upload_id": uid, "offset": part.stat().st_size, "size": meta["size"]}
+
+@app.put("/api/project/{pid}/uploads/{uid}")
+async def upload_chunk(pid: str, uid: str, request: Request):
+    if pid not in projects: raise HTTPException(404)
+    part, meta = _upload_session(pid, uid)
+    m = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", request.headers.get("content-range", ""))
+    if not m: raise HTTPException(400, "Content-Range: bytes start-end/total required")
+    start, end, total = map(int, m.groups())
+    if total != meta["size"] or end < start or end >= total: raise HTTPException(416, "Bad range")
+    lock = _upload_locks.setdefault(uid, asyncio.Lock())
+    if lock.locked(): raise HTTPException(409, "Upload busy")
+    async with lock:
+        offset = part.stat().st_size
+        if start != offset:
+            return JSONResponse(status_code=409, content={"detail": "Range does not start at the upload offset", "offset": offset})
+        known, h = _upload_hashes.get(uid, (None, None))
+        if known != offset:  # restarted or resumed on another worker: rehash what is on disk
+            h = await asyncio.to_thread(_sha256_of, part)
+        h = h.copy()  # the stored hash only moves on once this chunk is on disk (a 413 truncates it away)
+        try:
+            n, h = await stream_to_file(request.stream(), part, end - start + 1, h, append=True)
+        except ClientDisconnect:  # what arrived before the drop was written and hashed: resume from there
+            _upload_hashes[uid] = (part.stat().st_size, h)
+            raise
+        offset += n
+        _upload_hashes[uid] = (offset, h)
+        if offset < total:
+            return {"upload_id": uid, "offset": offset, "size": total}
+        _upload_hashes.pop(uid, None)
+        _upload_locks.pop(uid, None)
+        fp = UPLOAD_DIR / pid / f"{uid}{Path(meta['filename']).suffix.lower()}"
+        os.replace(part, fp)
+        _partial_paths(pid, uid)[1].unlink()  # session metadata
+        item = add_upload(pid, uid, meta["filename"], fp, h.hexdigest())
+        return {"upload_id": uid, "offset": offset, "size": total, "complete": True,
+                "uploaded": [item], "total": len(projects[pid]["media"])}
 
 @app.delete("/api/project/{pid}/media/{mid}")
 async def delete_media(pid: str, mid: str):
     if pid not in projects: raise HTTPException(404)
-    projects[pid]["media"] = [m for m in projects[pid]["media"] if m["id"] != mid]
+    projects.delete_media(pid, mid)
     return {"status": "deleted"}
 
 @app.put("/api/project/{pid}/media/{mid}")
 async def update_media(pid: str, mid: str, request: Request):
     if pid not in projects: raise HTTPException(404)
     data = await request.json()
-    for m in projects[pid]["media"]:
-        if m["id"] == mid:
-            for k in ["trim_start","trim_end","caption","order","custom_duration"]:
-                if k in data: m[k] = data[k]
-            return {"status": "updated", "media": m}
-    raise HTTPException(404)
+    m = projects.update_media(pid, mid, {k: data[k] for k in ["trim_start","trim_end","caption","order","custom_duration"] if k in data})
+    if m is None: raise HTTPException(404)
+    return {"status": "updated", "media": m}
 
 @app.put("/api/project/{pid}/reorder")
 async def reorder_media(pid: str, request: Request):
     if pid not in projects: raise HTTPException(404)
     data = await request.json()
     om = {mid: i for i, mid in enumerate(data["order"])}
-    for m in projects[pid]["media"]:
-        if m["id"] in om: m["order"] = om[m["id"]]
-    projects[pid]["media"].sort(key=lambda x: x["order"])
+    with projects.edit(pid) as project:
+        for m in project["media"]:
+            if m["id"] in om: m["order"] = om[m["id"]]
+        project["media"].sort(key=lambda x: x["order"])
     return {"status": "reordered"}
 
 # ── Audio Track Management ────────────────────────────────────────────────────
 @app.get("/api/project/{pid}/audio")
 async def get_audio_tracks(pid: str):
-    if pid not in projects: raise HTTPException(404)
-    return {"audio_tracks": projects[pid].get("audio_tracks", []),
-            "video_volume": projects[pid].get("video_volume", 100)}
+    project = projects.get(pid)
+    if project is None: raise HTTPException(404)
+    return {"audio_tracks": project.get("audio_tracks", []),
+            "video_volume": project.get("video_volume", 100)}
 
 @app.put("/api/project/{pid}/audio/{aid}")
 async def update_audio_track(pid: str, aid: str, request: Request):
     """Update audio track volume or role."""
     if pid not in projects: raise HTTPException(404)
     data = await request.json()
-    for t in projects[pid].get("audio_tracks", []):
-        if t["id"] == aid:
-            if "volume" in data: t["volume"] = data["volume"]
-            if "role" in data: t["role"] = data["role"]
-            return {"status": "updated", "track": t}
-    raise HTTPException(404, "Audio track not found")
+    t = projects.update_audio_track(pid, aid, {k: data[k] for k in ["volume", "role"] if k in data})
+    if t is None: raise HTTPException(404, "Audio track not found")
+    return {"status": "updated", "track": t}
 
 @app.delete("/api/project/{pid}/audio/{aid}")
 async def delete_audio_track(pid: str, aid: str):
     if pid not in projects: raise HTTPException(404)
-    project = projects[pid]
-    project["audio_tracks"] = [t for t in project.get("audio_tracks", []) if t["id"] != aid]
-    # Update legacy field
-    if project["audio_tracks"]:
-        project["audio_file"] = project["audio_tracks"][-1]["path"]
-    else:
-        project["audio_file"] = None
+    with projects.edit(pid) as project:
+        project["audio_tracks"] = [t for t in project.get("audio_tracks", []) if t["id"] != aid]
+        # Update legacy field
+        if project["audio_tracks"]:
+            project["audio_file"] = project["audio_tracks"][-1]["path"]
+        else:
+            project["audio_file"] = None
     return {"status": "deleted"}
 
 @app.put("/api/project/{pid}/video-volume")
 async def set_video_volume(pid: str, request: Request):
     if pid not in projects: raise HTTPException(404)
     data = await request.json()
-    projects[pid]["video_volume"] = data.get("volume", 100)
+    projects.update(pid, video_volume=data.get("volume", 100))
     return {"status": "updated"}
 
 # ── Trim API ──────────────────────────────────────────────────────────────────
+# Trims only record trim_start/trim_end on the item; the original upload is
+# kept. Renders apply them lazily (input-side -ss seeks to the keyframe
+# before the cut and decodes just that partial GOP), and a trimmed copy of
+# the clip itself is smart-cut on request: the whole GOPs between the cuts
+# are stream-copied and only the partial GOPs at each end are re-encoded.
+_keyframes = {}  # (path, size, mtime_ns) -> keyframe times of the first video stream
+CUT_LABELS = {"stage": "cut", "media_type": "video"}
+CUT_PROFILE = {"x264": ["-preset", "fast", "-crf", "18"], "fallback": {"libopenh264": ["-b:v", "12M"], "mpeg4": ["-q:v", "2"]}}
+
 @app.post("/api/project/{pid}/trim/{mid}")
 async def trim_video(pid: str, mid: str, request: Request):
-    if not HAS_FFMPEG: raise HTTPException(400, "FFmpeg not installed")
     if pid not in projects: raise HTTPException(404)
     data = await request.json()
-    media = next((m for m in projects[pid]["media"] if m["id"] == mid), None)
+    media = projects.get_media(pid, mid)
     if not media or media["type"] != "video": raise HTTPException(400)
-    out_name = f"{mid}_trimmed.mp4"
-    out_path = str(UPLOAD_DIR / pid / out_name)
-    cmd = ["ffmpeg", "-y", "-ss", str(data.get("start",0)), "-i", media["path"]]
-    if data.get("end"): cmd += ["-to", str(data["end"])]
-    cmd += ["-c:v", "libx264", "-c:a", "aac", "-preset", "fast", out_path]
-    r = await run_ffmpeg(cmd)
-    if not r["success"]: raise HTTPException(500, r["error"])
-    media["path"] = out_path
-    media["url"] = f"/static/uploads/{pid}/{out_name}"
+    start, end = float(data.get("start") or 0), data.get("end")
+    end = float(end) if end else None
+    dur = (media.get("meta") or {}).get("duration")
+    if dur and end and end >= dur: end = None  # trimmed to the end is untrimmed
+    if start < 0 or (end is not None and end <= start) or (dur and start >= dur):
+        raise HTTPException(400, "Bad trim range")
+    media = projects.update_media(pid, mid, {"trim_start": start, "trim_end": end})
+    if media is None: raise HTTPException(404)
     return {"status": "trimmed", "media": media}
 
+async def keyframe_times(path):
+    """Sorted pts (seconds) of the keyframes in a file's first video stream."""
+    st = os.stat(path)
+    memo = (str(path), st.st_size, st.st_mtime_ns)
+    if memo in _keyframes: return _keyframes[memo]
+    async with governor.slot("probe"):
+        try:  # packet flags: no decoding at all
+            proc = await asyncio.create_subprocess_exec(
+                *limited(["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+                          "-of", "csv=p=0", path]), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+            out, _ = await asyncio.wait_for(proc.communicate(), 60)
+            times = [float(t) for t, _, flags in (l.partition(",") for l in out.decode().splitlines())
+                     if "K" in flags and t not in ("", "N/A")]
+        except FileNotFoundError:
+            # No ffprobe: decode only the keyframes and read their pts from showinfo
+            proc = await asyncio.create_subprocess_exec(
+                *limited(["ffmpeg", "-hide_banner", "-skip_frame", "nokey", "-i", path, "-map", "0:v:0", "-vf", "showinfo",
+                          "-f", "null", "-"]), stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+            _, err = await asyncio.wait_for(proc.communicate(), 120)
+            times = [float(t) for t in re.findall(r"pts_time:\s*(-?[\d.]+)", err.decode(errors="replace"))]
+    _keyframes[memo] = sorted(times)
+    return _keyframes[memo]
+
+async def smart_cut(src, start, end, out, vcodec=None, timeout=300):
+    """Write [start, end) of `src` to `out` (end=None: to the end of the file).
+
+    H.264 sources stream-copy the keyframe-aligned middle and re-encode only
+    the head and tail partial GOPs; anything else (or a range inside one
+    GOP) is re-encoded whole (always, when the encoder isn't libx264).
+    Audio is always re-encoded for the range.
+    """
+    keys = await keyframe_times(src) if vcodec == "h264" and VIDEO_ENCODER == "libx264" else []
+    k_in = next((k for k in keys if k >= start - 0.001), None)
+    k_out = next((k for k in reversed(keys) if k <= end + 0.001), None) if end else None
+    dur_args = ["-t", str(end - start)] if end else []
+    x264 = [*video_args(CUT_PROFILE), "-pix_fmt", "yuv420p"]
+    if k_in is None or (end and (k_out is None or k_out <= k_in)):
+        return await run_ffmpeg(["ffmpeg", "-y", "-ss", str(start), "-i", src, *dur_args, "-map", "0:v:0", "-map", "0:a?",
+                                 *x264, "-c:a", "aac", "-b:a", "192k", "-movflags", "+faststart", out], timeout, labels=CUT_LABELS)
+    tmp = f"{out}.{uuid.uuid4().hex[:6]}"
+    # copying seeks to the keyframe itself, so nudge past float rounding
+    mid = ["-ss", str(k_in + 0.0005), "-i", src, "-map", "0:v:0", "-c:v", "copy", "-an"]
+    if end:
+        # -t on a copy cuts in decode order and drags reordered frames along;
+        # the segment muxer splits exactly on the first keyframe past the
+        # split time (set a hair early, since copied timestamps don't start at 0)
+        mid = mid[:4] + ["-t", str(k_out - k_in + 2)] + mid[4:] + [
+            "-f", "segment", "-segment_times", str(k_out - k_in - 0.01), "-reset_timestamps", "1", f"{tmp}.mid%d.mp4"]
+    else:
+        # without an edit list, so the concat demuxer keeps the B-frame delay
+        mid += ["-use_editlist", "0", f"{tmp}.mid0.mp4"]
+    steps = [(f"{tmp}.head.mp4", ["-ss", str(start), "-i", src, "-t", str(k_in - start), "-map", "0:v:0", *x264, "-an"])
+             if k_in - start >= 0.001 else None,
+             (f"{tmp}.mid0.mp4", mid),
+             (f"{tmp}.tail.mp4", ["-ss", str(k_out), "-i", src, "-t", str(end - k_out), "-map", "0:v:0", *x264, "-an"])
+             if end and end - k_out >= 0.001 else None]
+    parts = [part for part, _ in filter(None, steps)]
+    try:
+        for part, args in filter(None, steps):
+            r = await run_ffmpeg(["ffmpeg", "-y", *args] + ([] if args is mid else [part]), timeout, labels=CUT_LABELS)
+            if not r["success"]: return r
+        with open(f"{tmp}.txt", "w") as f:
+            for p in parts: f.write(f"file '{p}'\n")
+        return await run_ffmpeg(["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", f"{tmp}.txt",
+                                 "-ss", str(start), *dur_args, "-i", src,
+                                 "-map", "0:v:0", "-map", "1:a?", "-c:v", "copy", "-c:a", "aac", "-b:a", "192k",
+                                 "-movflags", "+faststart", out],
+                                timeout, labels=CUT_LABELS)
+    finally:
+        for p in parts + [f"{tmp}.mid1.mp4", f"{tmp}.txt"]:
+            try: os.remove(p)
+            except OSError: pass
+
+@app.get("/api/project/{pid}/media/{mid}/clip")
+async def download_trimmed_clip(pid: str, mid: str, request: Request):
+    """The clip as trimmed, smart-cut on first request and kept in the segment cache."""
+    if pid not in projects: raise HTTPException(404)
+    media = projects.get_media(pid, mid)
+    if not media or media["type"] != "video": raise HTTPException(404)
+    name = f"{Path(media['filename']).stem}_trimmed.mp4"
+    start, end = media.get("trim_start") or 0, media.get("trim_end")
+    if not start and not end:
+        return deliver_file(request, media["path"], media["filename"])
+    if not HAS_FFMPEG: raise HTTPException(400, "FFmpeg not installed")
+    blob = json.dumps(["smart_cut", SEGMENT_CACHE_VERSION, await file_digest(media["path"]), start, end])
+    key = hashlib.sha256(blob.encode()).hexdigest()
+    cached = segment_cache.get(key)
+    if not cached:
+        with governor.admit("trim"):
+            scratch = new_scratch("cut")
+            try:
+                meta = await media_meta(media) or {}
+                r = await smart_cut(media["path"], start, end, str(scratch / "cut.mp4"), meta.get("vcodec"))
+                if not r["success"]: raise HTTPException(500, r["error"])
+                cached = segment_cache.put(key, scratch / "cut.mp4")
+            except BaseException:
+                drop_scratch(scratch)
+                raise
+        if not segment_cache.owns(cached):  # cache disabled: hand the file over and drop it afterwards
+            return FileResponse(cached, filename=name, media_type="video/mp4", background=BackgroundTask(drop_scratch, scratch))
+        drop_scratch(scratch)
+    return deliver_file(request, cached, name, "video/mp4")
+
 # ── Generate Video API ────────────────────────────────────────────────────────
 @app.post("/api/project/{pid}/generate")
 async def generate_video(pid: str, request: Request):
+    """Queue a render job. Returns 202 with the job at once; pass
+    {"wait": true} to block until the render finishes (old behaviour)."""
     if not HAS_FFMPEG: raise HTTPException(400, "FFmpeg not installed")
     if pid not in projects: raise HTTPException(404)
+    try: body = await request.json()
+    except: body = {}
+    if not projects[pid]["media"]: raise HTTPException(400, "No media")
+    parse_renditions(body)  # reject bad renditions before queueing
+    admit_render(pid)
+    wait = bool(body.pop("wait", False))
+    job, joined = submit_render_job(pid, body, body.pop("priority", "normal"))
+    if not wait:
+        return JSONResponse(status_code=202, content={**job_view(job), "deduplicated": joined})
+    await _job_runtime[job["id"]]["done"].wait()
+    if job["status"] != "complete":
+        raise HTTPException(500 if job["status"] == "failed" else 409, job["error"] or job["status"])
+    return job["result"]
+
+# ── Ken Burns frames ─────────────────────────────────────────────────────────
+# Image segments zoom slowly into the centre of the still. "zoompan" does it
+# inside ffmpeg; "numpy" computes the frames here and pipes them to the
+# encoder as rawvideo, which moves the work off ffmpeg's single filter
+# thread and samples the crop window at subpixel offsets (zoompan rounds
+# them to whole pixels, which is where its jitter comes from).
+KB_ZOOM_STEP, KB_ZOOM_MAX = 0.0005, 1.06
+KENBURNS_ENGINES = ("zoompan", "numpy")
+KENBURNS_ENGINE = os.environ.get("VIBE_KENBURNS_ENGINE", "zoompan")
+KENBURNS_VERSION = 1  # bump when KenBurnsFrames output changes
+
+# numpy and Pillow are imported on first use (or by warm_up())
+np = Image = None
+HAS_NUMPY = all(importlib.util.find_spec(m) for m in ("numpy", "PIL"))
+if KENBURNS_ENGINE == "numpy" and not HAS_NUMPY:
+    logger.warning("VIBE_KENBURNS_ENGINE=numpy needs numpy and Pillow; using zoompan")
+    KENBURNS_ENGINE = "zoompan"
+
+def pick_kenburns_engine(engine):
+    if engine == "zoompan" and not has_filter("zoompan"):
+        logger.warning(f"FFmpeg has no zoompan filter; "
+                       f"{'generating frames with numpy' if HAS_NUMPY else 'images will not zoom'}")
+        return "numpy" if HAS_NUMPY else "zoompan"
+    return engine
+
+KENBURNS_ENGINE = pick_kenburns_engine(KENBURNS_ENGINE)
+
+def load_numpy():
+    global np, Image
+    if np is None:
+        import numpy
+        from PIL import Image as pil_image
+        Image, np = pil_image, numpy
+    return np
+
+def zoompan_filter(frames, w, h, fps):
+    # one input frame yields exactly `frames` output frames
+    if not has_filter("zoompan"):  # hold the still instead
+        return f"scale={w}:{h},loop=loop={frames - 1}:size=1,setpts=N/({fps}*TB)"
+    return (f"zoompan=z='min(zoom+{KB_ZOOM_STEP},{KB_ZOOM_MAX})':x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':"
+            f"d={frames}:s={w}x{h}:fps={fps}")
+
+class KenBurnsFrames:
+    """yuv420p frames of one still zooming into its centre, as NumPy does them.
+
+    The still is converted to limited-range BT.601 planes once (what
+    ffmpeg's own rgb->yuv conversion produces). Sample rows/columns and
+    7-bit bilinear weights for every frame are computed up front as
+    arrays; each frame is then two row gathers, two column gathers and a
+    few in-place int16 ops per plane, written into one reused buffer.
+    """
+
+    def __init__(self, still, w, h, n_frames):
+        load_numpy()
+        rgb = Image.open(still).convert("RGB")
+        if rgb.size != (w, h): rgb = rgb.resize((w, h), Image.BILINEAR)
+        r, g, b = np.moveaxis(np.asarray(rgb, dtype=np.float32), 2, 0)
+        y = 16 + (65.481 * r + 128.553 * g + 24.966 * b) / 255
+        cb = 128 + (-37.797 * r - 74.203 * g + 112.0 * b) / 255
+        cr = 128 + (112.0 * r - 93.786 * g - 18.214 * b) / 255
+        half = lambda p: p.reshape(h // 2, 2, w // 2, 2).mean(axis=(1, 3))
+        zoom = np.minimum(1 + KB_ZOOM_STEP * np.arange(1, n_frames + 1), KB_ZOOM_MAX)[:, None]
+        self.buf = np.empty(w * h * 3 // 2, np.uint8)
+        cuts = [0, w * h, w * h * 5 // 4, w * h * 3 // 2]
+        self.planes = []
+        for plane, (a, b) in zip((y, half(cb), half(cr)), zip(cuts, cuts[1:])):
+            ph, pw = plane.shape
+            rows, cols = self._axis(ph, zoom), self._axis(pw, zoom)
+            self.planes.append({
+                "src": np.rint(plane).clip(0, 255).astype(np.int16), "out": self.buf[a:b].reshape(ph, pw),
+                "r0": rows[0], "r1": rows[1], "fr": rows[2][:, :, None], "c0": cols[0], "c1": cols[1], "fc": cols[2],
+                "tmp": [np.empty((ph, pw), np.int16) for _ in range(4)],
+            })
+
+    @staticmethod
+    def _axis(n, zoom):
+        """Per-frame source index pairs and weights along one axis of length n."""
+        pos = (np.arange(n) + 0.5) / zoom + n * (1 - 1 / zoom) / 2 - 0.5
+        pos = np.clip(pos, 0, n - 1)
+        i0 = np.minimum(pos.astype(np.intp), n - 2)
+        return i0, i0 + 1, np.rint((pos - i0) * 128).astype(np.int16)
+
+    def frame(self, i):
+        """Frame `i` as a memoryview of the shared buffer (valid until the next call)."""
+        for p in self.planes:
+            a, b, c, d = p["tmp"]
+            # vertical: blend the two nearest source rows
+            np.take(p["src"], p["r0"][i], axis=0, out=a, mode="clip")
+            np.take(p["src"], p["r1"][i], axis=0, out=b, mode="clip")
+            np.subtract(b, a, out=b); np.multiply(b, p["fr"][i], out=b)
+            np.right_shift(b, 7, out=b); np.add(a, b, out=a)
+            # horizontal: blend the two nearest columns of that
+            np.take(a, p["c0"][i], axis=1, out=c, mode="clip")
+            np.take(a, p["c1"][i], axis=1, out=d, mode="clip")
+            np.subtract(d, c, out=d); np.multiply(d, p["fc"][i], out=d)
+            np.right_shift(d, 7, out=d); np.add(c, d, out=c)
+            np.copyto(p["out"], c, casting="unsafe")
+        return memoryview(self.buf)
+
+def kenburns_feed(still, w, h, n_frames):
+    """run_ffmpeg feed that writes the Ken Burns frames of `still` to stdin."""
+    async def feed(stdin):
+        kb = await asyncio.to_thread(KenBurnsFrames, still, w, h, n_frames)
+        for i in range(n_frames):
+            stdin.write(await asyncio.to_thread(kb.frame, i))
+            await stdin.drain()
+    return feed
+
+def build_kenburns_cmd(seg, dur_per, w, h, fps, cf, threads, profile=RENDER_PROFILES["final"]):
+    """Encoder for an image segment whose frames come from kenburns_feed()."""
+    return ["ffmpeg","-y","-f","rawvideo","-pix_fmt","yuv420p","-s",f"{w}x{h}","-r",str(fps),"-i","pipe:0",
+            "-vf", f"{cf},setsar=1",
+            "-t",str(dur_per),
+            *video_args(profile),"-pix_fmt","yuv420p","-an",
+            "-threads",str(threads),seg]
+
+def available_duration(item):
+    """Seconds of a video clip left after trimming, or None if unknown."""
+    ss, te = item.get("trim_start", 0), item.get("trim_end")
+    if te: return te - ss
+    dur = (item.get("meta") or {}).get("duration")
+    return max(0.1, dur - ss) if dur else None
+
+def item_duration(item, auto_dur):
+    """Seconds the item occupies on the timeline (clips can't outrun their source)."""
+    dur = item.get("custom_duration") or auto_dur
+    avail = available_duration(item) if item["type"] == "video" else None
+    return min(dur, avail) if avail else dur
+
+def slot_duration(item, auto_dur, fps):
+    """Seconds the item's segment actually runs: stills are cut to whole frames."""
+    dur = item_duration(item, auto_dur)
+    return int(dur * fps) / fps if item["type"] == "image" else dur
+
+def build_segment_cmd(item, seg, dur_per, w, h, fps, cf, threads, still=None, profile=RENDER_PROFILES["final"]):
+    """ffmpeg command that renders one media item into video-only segment
+    file `seg` (clip audio goes into the audio bed). Images render from
+    `still`, the prepared frame from prepare_still()."""
+    if item["type"] == "image":
+        # Gentle Ken Burns zoom over dur_per * fps frames
+        vf = f"{zoompan_filter(int(dur_per * fps), w, h, fps)},{cf},setsar=1"
+        return ["ffmpeg","-y","-i",still,
+                "-vf", vf,
+                "-t",str(dur_per),
+                *video_args(profile),"-pix_fmt","yuv420p","-an",
+                "-threads",str(threads),seg]
+    ss = item.get("trim_start", 0)
+    cmd = ["ffmpeg","-y"]
+    if ss: cmd += ["-ss", str(ss)]
+    cmd += ["-i", item["path"]]
+    seg_dur = min(dur_per, available_duration(item) or dur_per)
+    cmd += ["-t", str(seg_dur)]
+    # Same fps/SAR as image segments so the concat step can stream-copy
+    vf = f"scale={w}:{h}:force_original_aspect_ratio=increase,crop={w}:{h},{cf},fps={fps},setsar=1"
+    cmd += ["-vf", vf,
+            *video_args(profile),"-pix_fmt","yuv420p","-an"]
+    return cmd + ["-threads", str(threads), seg]
+
+async def render_segments(pid, media_items, auto_dur, w, h, fps, cf, seg_timeout, pinned,
+                          profile=RENDER_PROFILES["final"]):
+    """Encode every media item concurrently, reusing cached segments.
+
+    Returns one path (or None if that item failed) per media item, in
+    timeline order. Cache keys used are appended to `pinned`; the caller
+    unpins them once the segments have been consumed.
+    """
+    threads = segment_threads(len(media_items))
+    job_slots = asyncio.Semaphore(JOB_SEGMENT_WORKERS)
+
+    async def render_one(i, item):
+        # Per-clip duration
+        dur_per = item_duration(item, auto_dur)
+        seg = str(scratch_path(f"seg_{i:03d}.mp4"))
+        feed = generator = None
+        if item["type"] == "image":
+            skey = await still_key(item, w, h, profile)
+            source, source_id = str(still_cache.path(skey)), f"still:{skey}"
+            if KENBURNS_ENGINE == "numpy":
+                cmd = build_kenburns_cmd(seg, dur_per, w, h, fps, cf, threads, profile)
+                generator = f"kenburns-numpy:{KENBURNS_VERSION}:{KB_ZOOM_STEP}:{KB_ZOOM_MAX}"
+            else:
+                cmd = build_segment_cmd(item, seg, dur_per, w, h, fps, cf, threads, still=source, profile=profile)
+        else:
+            source, source_id = item["path"], await file_digest(item["path"])
+            cmd = build_segment_cmd(item, seg, dur_per, w, h, fps, cf, threads, profile=profile)
+        key = await segment_cache_key(cmd, source, source_id, generator)
+        segment_cache.pin(key); pinned.append(key)
+        cached = segment_cache.get(key)
+        if cached:
+            report_progress("segments", i, {"fraction": 1.0})
+            return cached
+        if item["type"] == "image":
+            still_cache.pin(skey)
+        try:
+            async with job_slots:  # the still's ffmpeg counts against the render's encoders too
+                if item["type"] == "image":
+                    still = await prepare_still(item, skey, w, h, profile)
+                    if not still: return None
+                    if generator: feed = kenburns_feed(still, w, h, int(dur_per * fps))
+                    elif still != source:  # still cache disabled: the frame stays where it was rendered
+                        cmd = build_segment_cmd(item, seg, dur_per, w, h, fps, cf, threads, still=still, profile=profile)
+                r = await run_ffmpeg(cmd, seg_timeout, stage="segments", part=i, duration=dur_per, feed=feed,
+                                     labels={"media_type": item["type"], "resolution": f"{w}x{h}"})
+        finally:
+            if item["type"] == "image": still_cache.unpin(skey)
+        if r["success"]:
+            return segment_cache.put(key, seg)
+        logger.error(f"Segment {i} failed: {r.get('error','')[:200]}")
+        return None
+
+    return await asyncio.gather(*(render_one(i, item) for i, item in enumerate(media_items)))
+
+_stream_signatures = {}  # (path, mtime_ns) -> signature
+
+async def stream_signature(path):
+    """Video stream parameters that must match for a -c copy concat.
+
+    None when the file can't be probed or doesn't open on a keyframe.
+    """
+    memo = (path, os.stat(path).st_mtime_ns)
+    if memo in _stream_signatures:
+        return _stream_signatures[memo]
+    async with governor.slot("probe"):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *limited(["ffprobe", "-v", "error", "-select_streams", "v:0", "-read_intervals", "%+#1",
+                          "-show_entries", "stream=codec_name,profile,level,width,height,pix_fmt,r_frame_rate,"
+                                           "time_base,sample_aspect_ratio:packet=flags",
+                          "-show_packets", "-of", "json", path]),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+            out, _ = await proc.communicate()
+            info = json.loads(out or b"{}")
+            streams, packets = info.get("streams") or [], info.get("packets") or [{}]
+            sig = json.dumps(streams[0], sort_keys=True) if streams and packets[0].get("flags", "").startswith("K") else None
+        except FileNotFoundError:
+            # No ffprobe: compare the video stream line ffmpeg prints, minus bitrate
+            proc = await asyncio.create_subprocess_exec(
+                *limited(["ffmpeg", "-hide_banner", "-i", path]), stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+            _, err = await proc.communicate()
+            m = re.search(r"Stream #0:\d.*?: Video: (.*)", err.decode(errors="replace"))
+            sig = re.sub(r", \d+ kb/s| \(default\)", "", m.group(1)).strip() if m else None
+    _stream_signatures[memo] = sig
+    return sig
+
+async def can_stream_copy(segments):
+    """True if every segment has identical video stream parameters."""
+    sigs = await asyncio.gather(*(stream_signature(s) for s in segments))
+    return None not in sigs and len(set(sigs)) == 1
+
+# ── Audio bed ────────────────────────────────────────────────────────────────
+# All of a render's audio is mixed in one pass into an AAC "bed" as long as
+# the video: looped tracks, plus each clip's own sound placed at its offset
+# on the timeline (silence under stills). Both engines mux it with -c copy.
+# Beds are cached by recipe, so re-renders that only change visuals skip it.
+BED_CACHE_VERSION = 1
+bed_cache = DiskCache("beds", CACHE_DIR / "beds",
+                      int(float(os.environ.get("VIBE_AUDIO_CACHE_MB", 512)) * 1024 * 1024), ".m4a")
+
+def build_audio_bed_cmd(tracks, clips, duration, out):
+    """`tracks` is [(pcm, gain)], looped under the whole bed; `clips` is
+    [(path, trim_start, seconds, offset, gain)] for clip audio."""
+    inputs, graph, labels = [], [], []
+    for k, (pcm, gain) in enumerate(tracks):
+        inputs += ["-stream_loop", "-1", "-i", pcm]
+        graph.append(f"[{k}:a]volume={gain}[t{k}]")
+        labels.append(f"[t{k}]")
+    for k, (path, ss, secs, offset, gain) in enumerate(clips, len(tracks)):
+        inputs += [*(["-ss", str(ss)] if ss else []), "-t", str(secs), "-i", path]
+        graph.append(f"[{k}:a]aresample={AUDIO_RATE},aformat=channel_layouts=stereo,volume={gain},"
+                     f"adelay={round(offset * AUDIO_RATE)}S:all=1[c{k}]")
+        labels.append(f"[c{k}]")
+    mix = f"amix=inputs={len(labels)}:duration=longest:dropout_transition=0:normalize=0," if len(labels) > 1 else ""
+    graph.append("".join(labels) + f"{mix}apad,atrim=duration={duration}[bed]")
+    return (["ffmpeg", "-y"] + inputs +
+            ["-filter_complex", ";".join(graph), "-map", "[bed]",
+             "-c:a", "aac", "-b:a", "192k", "-ar", str(AUDIO_RATE), "-t", str(duration), out])
+
+async def audio_bed(pid, slots, tracks, video_vol, duration):
+    """(path, cache key) of the bed for a timeline of `slots` [(item, seconds)],
+    or (None, None) if the video is silent. The caller pins the key while
+    it uses the file, and removes the file afterwards unless bed_cache owns it."""
+    clips, ids, offset = [], {}, 0.0
+    for item, secs in slots:
+        if item["type"] == "video" and video_vol > 0 and (item.get("meta") or {}).get("has_audio"):
+            clips.append((item["path"], item.get("trim_start", 0), secs, offset, video_vol))
+            ids[item["path"]] = await file_digest(item["path"])
+        offset += secs
+    prepared = []
+    for t in tracks:
+        pcm, loudness = await prepare_audio(pid, t)
+        if pcm is None: continue
+        prepared.append((pcm, track_gain(t, loudness)))
+        ids[pcm] = await file_digest(t["path"])
+    if not prepared and not clips: return None, None
+    out = str(scratch_path(f"bed_{uuid.uuid4().hex[:6]}.m4a"))
+    cmd = build_audio_bed_cmd(prepared, clips, duration, out)
+    blob = json.dumps([BED_CACHE_VERSION, [ids.get(a, a) for a in cmd[:-1]]])
+    key = hashlib.sha256(blob.encode()).hexdigest()
+    cached = bed_cache.get(key)
+    if cached:
+        logger.info(f"Audio bed cache hit ({len(prepared)} tracks, {len(clips)} clips)")
+        report_progress("audio", "audio", {"fraction": 1.0})
+        return cached, key
+    r = await run_ffmpeg(cmd, max(60, int(duration * 2)), stage="audio", part="audio", duration=duration,
+                         labels={"media_type": "audio"})
+    if not r["success"]:
+        logger.error(f"Audio bed failed: {r.get('error','')[:300]}")
+        try: os.remove(out)
+        except OSError: pass
+        return None, None
+    return bed_cache.put(key, out), key
+
+async def render_single_pass(media_items, auto_dur, target_dur, outputs, fps, cf, bed, timeout,
+                             profile=RENDER_PROFILES["final"]):
+    """Render the whole timeline with one ffmpeg filter graph and one encode
+    per output; `outputs` is a list of (width, height, path) renditions.
+
+    Per-item scale/crop/zoompan/color chains feed a concat filter, the audio
+    bed (if any) is copied in, and only the final files are written — no
+    intermediate segments, concat pass or remux. Images come in as prepared
+    stills (one per output size), like in the segments engine.
+    """
+    images = [m for m in media_items if m["type"] == "image"]
+    still_keys = [[await still_key(m, w, h, profile) for m in images] for w, h, _ in outputs]
+    for keys in still_keys:
+        for key in keys: still_cache.pin(key)
+    job_slots = asyncio.Semaphore(JOB_SEGMENT_WORKERS)
+
+    async def still(m, key, w, h):
+        async with job_slots:
+            return await prepare_still(m, key, w, h, profile)
+    try:
+        stills = [await asyncio.gather(*(still(m, key, w, h) for m, key in zip(images, keys)))
+                  for (w, h, _), keys in zip(outputs, still_keys)]
+        if any(None in s for s in stills):
+            return {"success": False, "error": "Image preprocessing failed"}
+        return await _render_single_pass(media_items, [iter(s) for s in stills], auto_dur, target_dur, outputs, fps,
+                                         cf, bed, timeout, profile)
+    finally:
+        for keys in still_keys:
+            for key in keys: still_cache.unpin(key)
+
+async def _render_single_pass(media_items, stills, auto_dur, target_dur, outputs, fps, cf, bed, timeout, profile):
+    inputs, graph = [], []
+    vlabels = [[] for _ in outputs]
+
+    def add_input(*args):
+        inputs.extend(args)
+        return inputs.count("-i") - 1
+    for k, item in enumerate(media_items):
+        dur_per = item.get("custom_duration") or auto_dur
+        if item["type"] == "image":
+            zpframes = int(dur_per * fps)
+            for r, (w, h, _) in enumerate(outputs):
+                idx = add_input("-i", next(stills[r]))
+                graph.append(
+                    f"[{idx}:v]{zoompan_filter(zpframes, w, h, fps)},{cf},setsar=1,format=yuv420p[v{k}_{r}]")
+        else:
+            ss = item.get("trim_start", 0)
+            seg_dur = min(dur_per, available_duration(item) or dur_per)
+            idx = add_input(*(["-ss", str(ss)] if ss else []), "-t", str(seg_dur), "-i", item["path"])
+            # decode once, fan out to every output size
+            src = [f"[{idx}:v]"]
+            if len(outputs) > 1:
+                src = [f"[d{k}_{r}]" for r in range(len(outputs))]
+                graph.append(f"[{idx}:v]split={len(outputs)}" + "".join(src))
+            for r, (w, h, _) in enumerate(outputs):
+                graph.append(f"{src[r]}scale={w}:{h}:force_original_aspect_ratio=increase,crop={w}:{h},"
+                             f"{cf},fps={fps},setsar=1,format=yuv420p[v{k}_{r}]")
+        for r in range(len(outputs)):
+            vlabels[r].append(f"[v{k}_{r}]")
+
+    n = len(media_items)
+    for r in range(len(outputs)):
+        graph.append("".join(vlabels[r]) + f"concat=n={n}:v=1:a=0[vout{r}]")
+    if bed: bed_idx = add_input("-i", bed)
+
+    threads = max(1, FFMPEG_THREAD_BUDGET // len(outputs))
+    cmd = ["ffmpeg", "-y"] + inputs + ["-filter_complex", ";".join(graph)]
+    for r, (_, _, path) in enumerate(outputs):
+        cmd += ["-map", f"[vout{r}]"]
+        if bed:
+            cmd += ["-map", f"{bed_idx}:a:0", "-c:a", "copy"]
+        cmd += [*video_args(profile), "-pix_fmt", "yuv420p",
+                "-threads", str(threads), "-t", str(target_dur), "-movflags", "+faststart", path]
+    return await run_ffmpeg(cmd, timeout, stage="render", part="render", duration=target_dur,
+                            labels={"resolution": ",".join(f"{w}x{h}" for w, h, _ in outputs)})
+
+OUTPUT_PREFIX = {"final": "vibe", "draft": "draft"}
+RENDITIONS = {"portrait": (1080, 1920), "landscape": (1920, 1080), "square": (1080, 1080)}
+
+def parse_renditions(body):
+    """[(name, width, height)] for a generate body. `renditions` lists preset
+    names and/or {name, width, height}; without it there is one unnamed
+    output of `width` x `height`."""
+    if not body.get("renditions"):
+        return [(None, body.get("width", 1080), body.get("height", 1920))]
+    out = []
+    for r in body["renditions"]:
+        if isinstance(r, str):
+            if r not in RENDITIONS: raise HTTPException(400, f"Unknown rendition: {r}")
+            out.append((r, *RENDITIONS[r]))
+        else:
+            try: out.append((r.get("name") or f"{r['width']}x{r['height']}", int(r["width"]), int(r["height"])))
+            except (KeyError, TypeError, ValueError): raise HTTPException(400, f"Bad rendition: {r}")
+    if len({name for name, _, _ in out}) < len(out): raise HTTPException(400, "Duplicate rendition names")
+    return out
+
+def render_stamp():
+    """Unique part of a render's output names. Outputs are served as immutable,
+    so two renders in the same second must still get different names."""
+    return f"{int(time.time())}_{uuid.uuid4().hex[:8]}"
+
+def output_name(profile_name, pid, stamp, rendition=None):
+    return f"{OUTPUT_PREFIX[profile_name]}_{pid}_{stamp}{'_' + rendition if rendition else ''}.mp4"
+
+# Optional HLS packaging: each finished MP4 is remuxed (no re-encode) into
+# fMP4 segments and a VOD playlist under outputs/hls/<name>/. Segments cut
+# on the video's own keyframes, so they run about HLS_SEGMENT_SECONDS or
+# one GOP, whichever is longer.
+HLS_BY_DEFAULT = os.environ.get("VIBE_HLS", "0") == "1"
+HLS_SEGMENT_SECONDS = 4
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")  # older Pythons know neither
+mimetypes.add_type("video/iso.segment", ".m4s")
+
+async def package_hls(filename, part=None):
+    """HLS playlist URL for an output file, or None if packaging failed."""
+    stem = Path(filename).stem
+    d = OUTPUT_DIR / "hls" / stem
+    d.mkdir(parents=True, exist_ok=True)
+    r = await run_ffmpeg(["ffmpeg", "-y", "-i", str(OUTPUT_DIR / filename), "-map", "0", "-c", "copy",
+                          "-f", "hls", "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+                          "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init.mp4",
+                          "-hls_segment_filename", str(d / "seg_%04d.m4s"), str(d / "index.m3u8")],
+                         120, stage="package", part=part or stem)
+    if not r["success"]:
+        logger.error(f"HLS packaging of {filename} failed: {r.get('error','')[:200]}")
+        shutil.rmtree(d, ignore_errors=True)
+        return None
+    return f"/static/outputs/hls/{stem}/index.m3u8"
+
+def finish_render(pid, outputs, profile_name, hls=None):
+    """Record a finished render on the project; returns the generate API payload.
+    `outputs` is [(rendition name, filename)], the first being the main video;
+    `hls` maps filenames to their playlist URLs.
+    Drafts don't replace the project's exported video."""
+    hls = hls or {}
+    files = [{"name": name, "video_url": f"/static/outputs/{fn}", "download_url": f"/api/download/{fn}",
+              "filename": fn, **({"hls_url": hls[fn]} if hls.get(fn) else {})} for name, fn in outputs]
+    url = files[0]["video_url"]
+    if profile_name == "final":
+        projects.update(pid, status="complete", output=url,
+                        renditions={f["name"]: f["video_url"] for f in files if f["name"]})
+    else:
+        projects.update(pid, status="complete" if projects[pid].get("output") else "draft", draft_output=url)
+    result = {"status": "complete", "profile": profile_name,
+              **{k: files[0][k] for k in ("video_url", "download_url", "filename", "hls_url") if k in files[0]}}
+    if outputs[0][0]: result["renditions"] = files
+    return result
+
+async def render_project(pid, body):
+    """Render a project to MP4 in OUTPUT_DIR; returns the generate API payload.
+    Intermediate files go to a scratch directory of this render's own."""
+    await retry_ffmpeg_probe()
+    with render_scratch(current_job_id.get() or pid):
+        return await _render_project(pid, body)
+
+async def _render_project(pid, body):
     project = projects[pid]
     media_items = sorted(project["media"], key=lambda x: x["order"])
     if not media_items: raise HTTPException(400, "No media")
-    try: body = await request.json()
-    except: body = {}
+    # Probe results from upload time; anything not probed yet is probed (and stored) now
+    metas = await asyncio.gather(*(media_meta(m) for m in media_items))
+    for m, meta in zip(media_items, metas):
+        if meta and not m.get("meta"): projects.update_media(pid, m["id"], {"meta": meta})
+    media_items = [dict(m, meta=meta or {"has_audio": False}) for m, meta in zip(media_items, metas)]
     target_dur = body.get("duration", project["target_duration"])
-    w, h, fps = body.get("width", 1080), body.get("height", 1920), body.get("fps", 30)
+    fps = body.get("fps", 30)
+    profile_name = "draft" if body.get("draft") else body.get("profile", "final")
+    if profile_name not in RENDER_PROFILES: raise HTTPException(400, f"Unknown profile: {profile_name}")
+    profile = RENDER_PROFILES[profile_name]
+    renditions = [(name, int(w * profile["scale"]) // 2 * 2, int(h * profile["scale"]) // 2 * 2)  # x264 wants even sizes
+                  for name, w, h in parse_renditions(body)]
+    _, w, h = renditions[0]
+    if profile["max_fps"]: fps = min(fps, profile["max_fps"])
     cat = VIDEO_CATEGORIES.get(project["category"], VIDEO_CATEGORIES["motivational"])
     cf = cat["color_filter"]
     video_vol = project.get("video_volume", 100) / 100.0
-    audio_tracks = project.get("audio_tracks", [])
+    tracks = [t for t in project.get("audio_tracks", []) if os.path.exists(t["path"])]
 
     # Calculate per-segment duration: use custom_duration if set, else split evenly
     default_dur = max(2, target_dur / len(media_items))
@@ -364,230 +2404,995 @@ async def generate_video(pid: str, request: Request):
     else:
         auto_dur = default_dur
 
-    logger.info(f"Generating: {len(media_items)} items, {target_dur}s target, auto_dur={auto_dur:.1f}s, {w}x{h}")
+    sizes = ", ".join(f"{w}x{h}" for _, w, h in renditions)
+    logger.info(f"Generating: {len(media_items)} items, {target_dur}s target, auto_dur={auto_dur:.1f}s, {sizes}")
 
     # Longer timeout for longer videos
     seg_timeout = max(90, int(target_dur * 4))
 
-    # Step 1: Create each segment
-    segments = []
-    for i, item in enumerate(media_items):
-        # Per-clip duration
-        dur_per = item.get("custom_duration") or auto_dur
-        seg = str(UPLOAD_DIR / pid / f"seg_{i:03d}.mp4")
-        if item["type"] == "image":
-            # zoompan frames = dur_per * fps
-            zpframes = int(dur_per * fps)
-            # Show FULL image with blurred background (no black bars, no crop)
-            # Input 0 = blurred background, Input 1 = sharp foreground
-            vf = (
-                # Background: scale to fill, crop to frame, blur
-                f"[0:v]scale={w}:{h}:force_original_aspect_ratio=increase,"
-                f"crop={w}:{h}:(iw-{w})/2:(ih-{h})/2,"
-                f"gblur=sigma=30[bg];"
-                # Foreground: fit entire image (no crop), make transparent padding
-                f"[1:v]scale={w}:{h}:force_original_aspect_ratio=decrease[fg];"
-                # Overlay foreground centered on blurred bg
-                f"[bg][fg]overlay=(W-w)/2:(H-h)/2,"
-                # Gentle Ken Burns zoom
-                f"zoompan=z='min(zoom+0.0005,1.06)':x='iw/2-(iw/zoom/2)':y='ih/2-(ih/zoom/2)':d={zpframes}:s={w}x{h}:fps={fps},"
-                f"{cf}"
-            )
-            cmd = ["ffmpeg","-y","-loop","1","-i",item["path"],
-                   "-loop","1","-i",item["path"],
-                   "-filter_complex", vf,
-                   "-t",str(dur_per),
-                   "-c:v","libx264","-preset","fast","-pix_fmt","yuv420p","-an",seg]
-        else:
-            # Video: keep original audio if video_vol > 0, apply volume
-            ss = item.get("trim_start", 0)
-            cmd = ["ffmpeg","-y"]
-            if ss: cmd += ["-ss", str(ss)]
-            cmd += ["-i", item["path"]]
-            te = item.get("trim_end")
-            avail_dur = (te - ss) if te else dur_per
-            seg_dur = min(dur_per, avail_dur) if te else dur_per
-            cmd += ["-t", str(seg_dur)]
-            vf = f"scale={w}:{h}:force_original_aspect_ratio=increase,crop={w}:{h},{cf}"
-            if video_vol > 0:
-                # Keep audio with volume control
-                cmd += ["-vf", vf,
-                        "-af", f"volume={video_vol}",
-                        "-c:v","libx264","-preset","fast","-pix_fmt","yuv420p",
-                        "-c:a","aac","-b:a","128k", seg]
-            else:
-                cmd += ["-vf", vf,
-                        "-c:v","libx264","-preset","fast","-pix_fmt","yuv420p","-an", seg]
-        r = await run_ffmpeg(cmd, seg_timeout)
-        if r["success"]:
-            segments.append(seg)
-        else:
-            logger.error(f"Segment {i} failed: {r.get('error','')[:200]}")
-
-    if not segments: raise HTTPException(500, "All segments failed")
-
-    # Step 2: Concatenate segments (video-only to avoid stream mismatch)
-    concat_f = str(UPLOAD_DIR / pid / "concat.txt")
-    with open(concat_f, "w") as f:
-        for s in segments: f.write(f"file '{s}'\n")
-
-    out_name = f"vibe_{pid}_{int(time.time())}.mp4"
-    concat_out = str(OUTPUT_DIR / f"concat_{out_name}")
-    final = str(OUTPUT_DIR / out_name)
-
-    concat_timeout = max(180, int(target_dur * 3))
-    r = await run_ffmpeg([
-        "ffmpeg","-y","-f","concat","-safe","0","-i",concat_f,
-        "-c:v","libx264","-preset","fast","-pix_fmt","yuv420p",
-        "-an",  # always strip audio — we mix separately below
-        concat_out
-    ], concat_timeout)
-    if not r["success"]: raise HTTPException(500, "Concat failed")
-
-    # Step 3: Mix all audio sources into the video
-    # Strategy: concat video is always silent. We build all audio inputs
-    # separately and amix them, then merge with the silent video.
-
-    valid_tracks = [t for t in audio_tracks if os.path.exists(t["path"])]
-    has_vid_segments_audio = video_vol > 0 and any(m["type"] == "video" for m in media_items)
-
-    # Extract video audio if needed (from original video segments before concat stripped it)
-    vid_audio_file = None
-    if has_vid_segments_audio:
-        # Re-concat only video segments that had audio to extract their audio
-        va_concat = str(UPLOAD_DIR / pid / "va_concat.txt")
-        va_segs = []
-        for i, item in enumerate(media_items):
-            seg_path = str(UPLOAD_DIR / pid / f"seg_{i:03d}.mp4")
-            if item["type"] == "video" and os.path.exists(seg_path):
-                va_segs.append(seg_path)
-        if va_segs:
-            with open(va_concat, "w") as f:
-                for s in va_segs: f.write(f"file '{s}'\n")
-            vid_audio_file = str(UPLOAD_DIR / pid / "vid_audio.aac")
-            va_r = await run_ffmpeg([
-                "ffmpeg","-y","-f","concat","-safe","0","-i",va_concat,
-                "-vn","-c:a","aac","-b:a","128k", vid_audio_file
-            ], 60)
-            if not va_r["success"]:
-                logger.warning("Could not extract video audio, skipping")
-                vid_audio_file = None
-
-    if valid_tracks or vid_audio_file:
-        # Build ffmpeg command: video + looped audio inputs
-        inputs = ["-i", concat_out]
-        filter_parts = []
-        mix_labels = []
-        inp_idx = 1
-
-        # Add each uploaded/searched audio track (looped to fill video length)
-        for idx, track in enumerate(valid_tracks):
-            inputs += ["-stream_loop", "-1", "-i", track["path"]]
-            vol = track.get("volume", 50) / 100.0
-            label = f"a{idx}"
-            filter_parts.append(f"[{inp_idx}:a]volume={vol}[{label}]")
-            mix_labels.append(f"[{label}]")
-            inp_idx += 1
-
-        # Add video original audio if extracted
-        if vid_audio_file:
-            inputs += ["-i", vid_audio_file]
-            filter_parts.append(f"[{inp_idx}:a]volume={video_vol}[va]")
-            mix_labels.append("[va]")
-            inp_idx += 1
-
-        # Build the mix
-        n = len(mix_labels)
-        if n == 1:
-            # Single source — rename directly to [aout]
-            filter_str = filter_parts[0]
-            # Replace last label with [aout]
-            last_bracket = filter_str.rfind("[")
-            filter_str = filter_str[:last_bracket] + "[aout]"
-        else:
-            # Multiple sources — amix
-            all_labels = "".join(mix_labels)
-            filter_str = ";".join(filter_parts) + f";{all_labels}amix=inputs={n}:duration=first:dropout_transition=0:normalize=0[aout]"
-
-        logger.info(f"Audio mix: {n} sources, filter={filter_str}")
-
-        mix_cmd = ["ffmpeg","-y"] + inputs + [
-            "-filter_complex", filter_str,
-            "-map", "0:v:0", "-map", "[aout]",
-            "-c:v", "copy", "-c:a", "aac", "-b:a", "192k",
-            "-t", str(target_dur),
-            final
-        ]
-        r2 = await run_ffmpeg(mix_cmd, concat_timeout)
-        if r2["success"]:
-            try: os.remove(concat_out)
+    engine = body.get("engine", RENDER_ENGINE)
+    if engine not in RENDER_ENGINES: raise HTTPException(400, f"Unknown engine: {engine}")
+    hls = bool(body.get("hls", HLS_BY_DEFAULT))
+    if hls:  # a keyframe at least every HLS segment, so the packager has somewhere to cut
+        profile = dict(profile, x264=profile["x264"] + ["-g", str(int(fps * HLS_SEGMENT_SECONDS))])
+    audible = projects.audible_media(pid) if video_vol > 0 else set()
+    with_audio = bool(tracks) or any(m["type"] == "video" and m["id"] in audible for m in media_items)
+    if engine == "single_pass" or len(renditions) > 1:
+        # Several renditions always share one decode: the single-pass graph splits each source per size
+        stamp = render_stamp()
+        out_names = [(name, output_name(profile_name, pid, stamp, name)) for name, _, _ in renditions]
+        plan_progress({"render": {"render": 1}, **({"audio": {"audio": 1}} if with_audio else {}),
+                       **({"package": {Path(fn).stem: 1 for _, fn in out_names}} if hls else {})})
+        outputs = [(w, h, str(OUTPUT_DIR / fn)) for (_, w, h), (_, fn) in zip(renditions, out_names)]
+        bed, bed_key = await audio_bed(pid, [(m, slot_duration(m, auto_dur, fps)) for m in media_items],
+                                       tracks, video_vol, target_dur)
+        if bed_key: bed_cache.pin(bed_key)
+        try:
+            r = await render_single_pass(media_items, auto_dur, target_dur, outputs, fps, cf, bed,
+                                         max(180, int(target_dur * 6 * len(outputs))), profile)
+        finally:
+            if bed_key: bed_cache.unpin(bed_key)
+            if bed and not bed_cache.owns(bed): os.remove(bed)
+        if not r["success"]:
+            logger.error(f"Single-pass render failed: {r.get('error','')[:300]}")
+            raise HTTPException(500, "Render failed")
+        playlists = await asyncio.gather(*(package_hls(fn) for _, fn in out_names)) if hls else []
+        return finish_render(pid, out_names, profile_name, dict(zip((fn for _, fn in out_names), playlists)))
+
+    timeline_dur = sum(item_duration(m, auto_dur) for m in media_items)
+    stages = {"segments": {i: item_duration(m, auto_dur) for i, m in enumerate(media_items)},
+              "concat": {"concat": 1}}
+    if with_audio: stages["audio"] = {"audio": 1}
+    if hls: stages["package"] = {"package": 1}
+    plan_progress(stages)
+
+    pinned = []  # segment cache entries this render relies on
+    bed = bed_key = None
+    try:
+        # Step 1: Create each segment (concurrently, bounded by the render pool)
+        seg_paths = await render_segments(pid, media_items, auto_dur, w, h, fps, cf, seg_timeout, pinned, profile)
+        segments = [seg for seg in seg_paths if seg]
+
+        if not segments: raise HTTPException(500, "All segments failed")
+
+        # Step 2: One audio bed for the segments that made it, laid out on their timeline
+        if with_audio:
+            slots = [(m, slot_duration(m, auto_dur, fps)) for m, seg in zip(media_items, seg_paths) if seg]
+            bed, bed_key = await audio_bed(pid, slots, tracks, video_vol, target_dur)
+            if bed_key: bed_cache.pin(bed_key)
+
+        # Step 3: Concatenate the video-only segments and mux the bed in the same pass
+        concat_f = str(scratch_path("concat.txt"))
+        with open(concat_f, "w") as f:
+            for s in segments: f.write(f"file '{s}'\n")
+
+        out_name = output_name(profile_name, pid, render_stamp(), renditions[0][0])
+        final = str(OUTPUT_DIR / out_name)
+        audio_args = ["-i", bed, "-map", "0:v:0", "-map", "1:a:0", "-c:a", "copy", "-t", str(target_dur)] if bed else \
+                     ["-map", "0:v:0", "-an"]
+
+        concat_timeout = max(180, int(target_dur * 3))
+        r = {"success": False}
+        if await can_stream_copy(segments):
+            # Segments share codec/size/fps/SAR and open on keyframes: join without re-encoding
+            r = await run_ffmpeg([
+                "ffmpeg","-y","-f","concat","-safe","0","-i",concat_f, *audio_args,
+                "-c:v","copy","-movflags","+faststart", final
+            ], concat_timeout, stage="concat", part="concat", duration=timeline_dur, labels={"resolution": f"{w}x{h}"})
+            if not r["success"]:
+                logger.warning(f"Stream-copy concat failed, re-encoding: {r.get('error','')[:200]}")
+        if not r["success"]:
+            r = await run_ffmpeg([
+                "ffmpeg","-y","-f","concat","-safe","0","-i",concat_f, *audio_args,
+                *video_args(profile),"-pix_fmt","yuv420p","-movflags","+faststart", final
+            ], concat_timeout, stage="concat", part="concat", duration=timeline_dur, labels={"resolution": f"{w}x{h}"})
+        if not r["success"]: raise HTTPException(500, "Concat failed")
+
+        # Cleanup (cached segments stay for the next render)
+        for s in segments:
+            if segment_cache.owns(s): continue
+            try: os.remove(s)
             except: pass
-        else:
-            logger.error(f"Audio mix failed: {r2.get('error','')[:300]}")
-            # Fallback: overlay first audio simply
-            fb_track = valid_tracks[0]["path"] if valid_tracks else vid_audio_file
-            if fb_track:
-                r3 = await run_ffmpeg([
-                    "ffmpeg","-y","-i",concat_out,
-                    "-stream_loop","-1","-i",fb_track,
-                    "-c:v","copy","-c:a","aac","-b:a","192k",
-                    "-map","0:v:0","-map","1:a:0",
-                    "-t",str(target_dur),final
-                ])
-                if r3["success"]:
-                    try: os.remove(concat_out)
-                    except: pass
-                else:
-                    shutil.move(concat_out, final)
-            else:
-                shutil.move(concat_out, final)
+        try: os.remove(concat_f)
+        except: pass
+
+        playlist = await package_hls(out_name, "package") if hls else None
+        return finish_render(pid, [(renditions[0][0], out_name)], profile_name, {out_name: playlist})
+    finally:
+        for key in pinned: segment_cache.unpin(key)
+        if bed_key: bed_cache.unpin(bed_key)
+        if bed and not bed_cache.owns(bed):
+            try: os.remove(bed)
+            except OSError: pass
+
+# ── Render Jobs ───────────────────────────────────────────────────────────────
+# Renders run as jobs on an in-process priority queue, or on the shared queue
+# below with VIBE_JOB_QUEUE=shared. A project has at most one queued/running
+# job; submitting again joins it. `jobs` holds the public (JSON) record,
+# `_job_runtime` the task, ffmpeg children and done event.
+JOB_CONCURRENCY = max(1, int(os.environ.get("VIBE_JOB_CONCURRENCY", 2)))
+MAX_FINISHED_JOBS = 500
+JOB_PRIORITIES = {"high": 0, "normal": 5, "low": 9}
+JOB_ACTIVE = ("queued", "running")
+JOB_QUEUE = os.environ.get("VIBE_JOB_QUEUE", "local")  # "local" or "shared"
+if JOB_QUEUE not in ("local", "shared"): raise ValueError(f"Unknown VIBE_JOB_QUEUE: {JOB_QUEUE}")
+
+jobs = {}
+_job_runtime = {}
+_project_jobs = {}  # pid -> id of its queued/running job
+_job_queue = asyncio.PriorityQueue()
+_job_seq = itertools.count()
+_job_workers = []
+
+def job_view(job):
+    view = dict(job)
+    if job["status"] == "queued":
+        rt = _job_runtime[job["id"]]
+        view["queue_position"] = 1 + sum(
+            1 for j in jobs.values() if j["status"] == "queued"
+            and (j["priority"], _job_runtime[j["id"]]["seq"]) < (job["priority"], rt["seq"]))
+    return view
+
+def _track_job(job, seq):
+    """Register a job record in this process; returns the record kept in `jobs`."""
+    jid = job["id"]
+    jobs[jid] = job
+    _job_runtime[jid] = {"seq": seq, "task": None, "procs": set(), "done": asyncio.Event(),
+                         "subscribers": set(), "parts": {}, "started_at": None,
+                         "queued_at": job.get("queued_at") or time.time(), "trace": []}
+    if job["status"] in JOB_ACTIVE: _project_jobs[job["project_id"]] = jid
+    return job
+
+def admit_render(pid):
+    """Raise 429 (or 503 under load) instead of queueing a render the
+    workers can't get to soon. Joining the project's active job always works."""
+    refresh_jobs()
+    active = [j for j in jobs.values() if j["status"] in JOB_ACTIVE]
+    if any(j["project_id"] == pid for j in active): return
+    governor.check_load()
+    queued = sum(1 for j in active if j["status"] == "queued")
+    if queued < MAX_QUEUED_JOBS: return
+    took = sorted((datetime.fromisoformat(j["finished"]) - datetime.fromisoformat(j["started"])).total_seconds()
+                  for j in jobs.values() if j["status"] == "complete" and j["started"] and j["finished"])
+    per_job = took[len(took) // 2] if took else 60
+    slots = sum(w["slots"] for w in job_queue.workers()) if job_queue else JOB_CONCURRENCY
+    governor.rejected["jobs"] += 1
+    ADMISSION_REJECTED.inc(reason="jobs")
+    raise retry_later(f"Render queue is full ({queued} queued)", per_job * (queued - MAX_QUEUED_JOBS + 1) / max(1, slots), 429)
+
+def submit_render_job(pid, params, priority="normal"):
+    """Queue a render for `pid`; returns (job, joined_existing)."""
+    _ensure_job_workers()
+    if JOB_QUEUE == "local":
+        existing = jobs.get(_project_jobs.get(pid))
+        if existing and existing["status"] in JOB_ACTIVE:
+            return existing, True
+    if isinstance(priority, str):
+        priority = JOB_PRIORITIES.get(priority, JOB_PRIORITIES["normal"])
+    jid = uuid.uuid4().hex[:12]
+    job = {"id": jid, "project_id": pid, "status": "queued", "priority": int(priority),
+           "params": params, "created": datetime.now().isoformat(), "queued_at": time.time(),
+           "started": None, "finished": None, "result": None, "error": None, "worker": None,
+           "progress": {"stage": None, "percent": 0.0, "eta_s": None, "speed": None, "frame": None}}
+    if JOB_QUEUE == "shared":
+        seq, job, joined = job_queue.submit(job)
+        if joined:
+            poll_jobs()
+            return jobs.get(job["id"]) or _track_job(job, seq), True
+        _track_job(job, seq)
     else:
-        shutil.move(concat_out, final)
+        seq = next(_job_seq)
+        _track_job(job, seq)
+        _job_queue.put_nowait((job["priority"], seq, jid))
+    projects.update(pid, status="queued", job_id=jid)
+    logger.info(f"Job {jid} queued for project {pid} (priority {job['priority']})")
+    return job, False
 
-    # Cleanup
-    for s in segments:
-        try: os.remove(s)
-        except: pass
-    for tmp in ["concat.txt", "va_concat.txt", "vid_audio.aac"]:
-        try: os.remove(str(UPLOAD_DIR / pid / tmp))
-        except: pass
+def _ensure_job_workers():
+    # Started lazily so the queue works under any server/test harness. With
+    # the shared queue this process only mirrors jobs; workers render them.
+    if _job_workers or IS_WORKER: return
+    if JOB_QUEUE == "shared":
+        _job_workers.append(asyncio.create_task(_job_watcher()))
+        return
+    for n in range(JOB_CONCURRENCY):
+        _job_workers.append(asyncio.create_task(_job_worker(n)))
 
-    project["status"] = "complete"
-    project["output"] = f"/static/outputs/{out_name}"
-    return {"status": "complete", "video_url": f"/static/outputs/{out_name}",
-            "download_url": f"/api/download/{out_name}", "filename": out_name}
+async def _job_worker(n):
+    while True:
+        _, _, jid = await _job_queue.get()
+        job = jobs.get(jid)
+        if not job or job["status"] != "queued":
+            continue  # cancelled while waiting
+        await _execute_job(job)
 
-@app.get("/api/download/{filename}")
-async def download_video(filename: str):
+async def _execute_job(job):
+    rt = _job_runtime[job["id"]]
+    rt["task"] = asyncio.create_task(_run_job(job))
+    try:
+        await rt["task"]
+    except asyncio.CancelledError:
+        if not rt["task"].cancelled(): raise  # worker itself is shutting down
+    except Exception as e:
+        logger.error(f"Job {job['id']} crashed: {e}")
+
+async def _run_job(job):
+    jid, pid = job["id"], job["project_id"]
+    current_job_id.set(jid)
+    job["status"] = "running"
+    job["started"] = datetime.now().isoformat()
+    rt = _job_runtime[jid]
+    rt["started_at"] = time.time()
+    JOB_QUEUE_SECONDS.observe(rt["started_at"] - rt["queued_at"])
+    projects.update(pid, status="rendering")
+    publish_job(job)
+    try:
+        if pid not in projects: raise HTTPException(404, "Project deleted")
+        job["result"] = await render_project(pid, dict(job["params"]))
+        job["status"] = "complete"
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+        raise
+    except HTTPException as e:
+        job["status"], job["error"] = "failed", str(e.detail)
+    except Exception as e:
+        logger.exception(f"Job {jid} failed")
+        job["status"], job["error"] = "failed", str(e)
+    finally:
+        _finish_job(job)
+
+def _finish_job(job):
+    jid, pid = job["id"], job["project_id"]
+    if IS_WORKER and not job_queue.owns(jid, WORKER_ID):
+        # Requeued on shutdown or reclaimed after a missed heartbeat: the
+        # job's row belongs to the queue or to another worker now.
+        logger.info(f"Job {jid} handed back to the queue")
+        _job_runtime[jid]["done"].set()
+        jobs.pop(jid, None); _job_runtime.pop(jid, None)
+        return
+    job["finished"] = datetime.now().isoformat()
+    if _project_jobs.get(pid) == jid:
+        del _project_jobs[pid]
+    if job["status"] != "complete":
+        projects.update(pid, status="failed" if job["status"] == "failed" else "draft")
+    if job["status"] == "complete":
+        job["progress"].update(percent=100.0, eta_s=0.0)
+    rt = _job_runtime[jid]
+    params = job["params"]
+    queued = (rt["started_at"] or time.time()) - rt["queued_at"]
+    seconds = time.time() - rt["started_at"] if rt["started_at"] else 0.0
+    if rt["started_at"]:
+        JOB_SECONDS.observe(seconds, profile="draft" if params.get("draft") else params.get("profile", "final"),
+                            engine=params.get("engine", RENDER_ENGINE), status=job["status"])
+    job["trace"] = rt["trace"]
+    if pid in projects:
+        projects.update(pid, last_render={"job_id": jid, "status": job["status"], "queued_s": round(queued, 3),
+                                          "seconds": round(seconds, 3), "trace": rt["trace"]})
+    rt["done"].set()
+    publish_job(job)
+    logger.info(f"Job {jid} {job['status']}" + (f": {job['error']}" if job["error"] else ""))
+    if IS_WORKER:
+        jobs.pop(jid, None); _job_runtime.pop(jid, None)
+        job_queue.prune(MAX_FINISHED_JOBS)
+    _prune_finished_jobs()
+
+def _prune_finished_jobs():
+    finished = [j for j in jobs.values() if j["status"] not in JOB_ACTIVE]
+    for old in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        jobs.pop(old["id"], None); _job_runtime.pop(old["id"], None)
+
+def cancel_job(jid):
+    job = jobs[jid]
+    if JOB_QUEUE == "shared" and not IS_WORKER:
+        row = job_queue.cancel(jid)
+        if row and row[1]["status"] == "cancelled":
+            projects.update(job["project_id"], status="draft")
+        poll_jobs()
+        return jobs.get(jid, job)
+    if job["status"] == "queued":
+        job["status"] = "cancelled"
+        _finish_job(job)
+    elif job["status"] == "running":
+        rt = _job_runtime[jid]
+        for proc in list(rt["procs"]):
+            if proc.returncode is None: proc.kill()
+        rt["task"].cancel()
+    return job
+
+def refresh_jobs():
+    """Make sure `jobs` is current before answering from it."""
+    _ensure_job_workers()
+    if JOB_QUEUE == "shared": poll_jobs()
+
+# ── Shared job queue ──────────────────────────────────────────────────────────
+# With VIBE_JOB_QUEUE=shared the API processes only record jobs and
+# `python app.py worker` processes render them: as many as wanted, on the
+# same machine. The store runs in WAL mode, whose shared-memory index only
+# works between processes of one host, so a store on a network filesystem
+# is refused rather than risking a corrupt queue. Jobs are rows next to
+# the projects. A worker claims one in a
+# BEGIN IMMEDIATE transaction, writes its progress back and refreshes its
+# lease; a worker that misses JOB_LEASE_SECONDS of heartbeats has its jobs
+# requeued (failed after JOB_MAX_ATTEMPTS). Cancelling a running job sets a
+# flag its worker picks up. API processes poll the rows that changed and
+# mirror them into `jobs`, so the job endpoints, WebSocket and SSE don't
+# care where a render runs.
+JOB_LEASE_SECONDS = float(os.environ.get("VIBE_JOB_LEASE", 30))
+JOB_HEARTBEAT_SECONDS = JOB_LEASE_SECONDS / 3
+JOB_MAX_ATTEMPTS = 3
+JOB_POLL_SECONDS = 0.25  # API mirror refresh; idle workers look for work this often
+JOB_SYNC_SECONDS = 0.5   # a running job's progress is written back at most this often
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+IS_WORKER = False  # set by `python app.py worker`
+
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "afs", "ceph", "lustre", "gpfs",
+                       "fuse.sshfs", "fuse.glusterfs", "fuse.s3fs", "davfs")
+
+def filesystem_type(path):
+    """Type of the filesystem holding `path`, from /proc/mounts ("" if unknown)."""
+    path, best = os.path.realpath(path), ("", "")
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                _, mnt, fstype = line.split()[:3]
+                mnt = mnt.replace("\\040", " ")
+                if (path == mnt or path.startswith(mnt.rstrip("/") + "/")) and len(mnt) >= len(best[0]):
+                    best = (mnt, fstype)
+    except OSError: pass
+    return best[1]
+
+class SQLiteJobQueue:
+    """Render jobs as rows in the project store's database. `version` is a
+    table-wide change counter, so pollers fetch only what moved."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE NOT NULL, project_id TEXT NOT NULL,
+            status TEXT NOT NULL, priority INTEGER NOT NULL, version INTEGER NOT NULL,
+            worker TEXT, heartbeat REAL, attempts INTEGER NOT NULL DEFAULT 0,
+            cancel INTEGER NOT NULL DEFAULT 0, data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, priority, seq);
+        CREATE INDEX IF NOT EXISTS jobs_by_version ON jobs (version);
+        CREATE INDEX IF NOT EXISTS jobs_by_project ON jobs (project_id, status);
+        CREATE TABLE IF NOT EXISTS job_workers (
+            id TEXT PRIMARY KEY, heartbeat REAL NOT NULL, slots INTEGER NOT NULL, running INTEGER NOT NULL);
+    """
+
+    def __init__(self, store):
+        db_file = store.db.execute("PRAGMA database_list").fetchone()[2]
+        if not db_file:
+            raise ValueError("VIBE_JOB_QUEUE=shared needs a file-backed VIBE_STORE")
+        fs = filesystem_type(db_file)
+        if fs in NETWORK_FILESYSTEMS:
+            raise ValueError(f"VIBE_JOB_QUEUE=shared needs VIBE_STORE on a local disk, not {fs}: "
+                             "SQLite's WAL only works between processes of one host")
+        self.store = store
+        store.db.executescript(self.SCHEMA)
+
+    def _write(self, db, job, holder=None, **cols):
+        """Store `job`'s record (only if worker `holder` still runs it, when given)."""
+        version = db.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM jobs").fetchone()[0]
+        cols = dict(status=job["status"], data=json.dumps(job), version=version, **cols)
+        sql = f"UPDATE jobs SET {', '.join(f'{k}=?' for k in cols)} WHERE id=?"
+        args = [*cols.values(), job["id"]]
+        if holder: sql, args = sql + " AND worker=? AND status='running'", args + [holder]
+        return db.execute(sql, args).rowcount > 0
+
+    def submit(self, job):
+        """Insert `job` unless its project already has an active one; returns
+        (seq, job, joined_existing)."""
+        with self.store._tx() as db:
+            row = db.execute("SELECT seq, data FROM jobs WHERE project_id=? AND status IN ('queued', 'running')",
+                             (job["project_id"],)).fetchone()
+            if row: return row[0], json.loads(row[1]), True
+            version = db.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM jobs").fetchone()[0]
+            cur = db.execute("INSERT INTO jobs (id, project_id, status, priority, version, data) VALUES (?, ?, ?, ?, ?, ?)",
+                             (job["id"], job["project_id"], job["status"], job["priority"], version, json.dumps(job)))
+            return cur.lastrowid, job, False
+
+    def claim(self, worker):
+        """Take the most urgent queued job for `worker`; (seq, job) or None."""
+        with self.store.lock:
+            if not self.store.db.execute("SELECT 1 FROM jobs WHERE status='queued' LIMIT 1").fetchone():
+                return None  # checked outside a write transaction so idle workers don't contend
+        with self.store._tx() as db:
+            row = db.execute("SELECT seq, data FROM jobs WHERE status='queued' ORDER BY priority, seq LIMIT 1").fetchone()
+            if not row: return None
+            job = dict(json.loads(row[1]), status="running", worker=worker)
+            self._write(db, job, worker=worker, heartbeat=time.time(), cancel=0)
+            db.execute("UPDATE jobs SET attempts=attempts+1 WHERE id=?", (job["id"],))
+            return row[0], job
+
+    def save(self, job, worker):
+        """Write a running job's record back; False if `worker` lost it."""
+        with self.store._tx() as db:
+            return self._write(db, job, worker, heartbeat=time.time())
+
+    def owns(self, jid, worker):
+        with self.store.lock:
+            return self.store.db.execute("SELECT 1 FROM jobs WHERE id=? AND worker=? AND status='running'",
+                                         (jid, worker)).fetchone() is not None
+
+    def heartbeat(self, worker, slots, running, dirty):
+        """Save `dirty` jobs and renew the lease on the `running` ids; returns
+        (ids flagged for cancelling, ids this worker no longer holds)."""
+        now, marks = time.time(), ",".join("?" * len(running))
+        with self.store._tx() as db:
+            for job in dirty: self._write(db, job, worker, heartbeat=now)
+            db.execute("INSERT OR REPLACE INTO job_workers (id, heartbeat, slots, running) VALUES (?, ?, ?, ?)",
+                       (worker, now, slots, len(running)))
+            if not running: return [], []
+            held = dict(db.execute(f"SELECT id, cancel FROM jobs WHERE worker=? AND status='running' AND id IN ({marks})",
+                                   (worker, *running)).fetchall())
+            db.execute(f"UPDATE jobs SET heartbeat=? WHERE worker=? AND status='running' AND id IN ({marks})",
+                       (now, worker, *running))
+        return [j for j, flag in held.items() if flag], [j for j in running if j not in held]
+
+    def reclaim(self, lease):
+        """Requeue running jobs whose worker stopped heartbeating; the ones out
+        of attempts fail instead and are returned."""
+        failed, cutoff = [], time.time() - lease
+        with self.store._tx() as db:
+            rows = db.execute("SELECT data, attempts FROM jobs WHERE status='running' AND heartbeat < ?",
+                              (cutoff,)).fetchall()
+            for data, attempts in rows:
+                job = json.loads(data)
+                logger.warning(f"Job {job['id']}: worker {job.get('worker')} stopped heartbeating")
+                if attempts >= JOB_MAX_ATTEMPTS:
+                    job.update(status="failed", error=f"Render worker lost {attempts} times",
+                               finished=datetime.now().isoformat())
+                    failed.append(job)
+                else:
+                    job.update(status="queued", worker=None)
+                self._write(db, job, worker=None)
+            db.execute("DELETE FROM job_workers WHERE heartbeat < ?", (cutoff,))
+        return failed
+
+    def release(self, worker):
+        """Put a stopping worker's jobs straight back on the queue."""
+        with self.store._tx() as db:
+            for (data,) in db.execute("SELECT data FROM jobs WHERE worker=? AND status='running'", (worker,)).fetchall():
+                self._write(db, dict(json.loads(data), status="queued", worker=None), worker=None)
+                db.execute("UPDATE jobs SET attempts=attempts-1 WHERE id=?", (json.loads(data)["id"],))
+            db.execute("DELETE FROM job_workers WHERE id=?", (worker,))
+
+    def cancel(self, jid):
+        """Cancel a queued job now or flag a running one for its worker;
+        returns (seq, job) or None."""
+        with self.store._tx() as db:
+            row = db.execute("SELECT seq, data FROM jobs WHERE id=?", (jid,)).fetchone()
+            if not row: return None
+            job = json.loads(row[1])
+            if job["status"] == "queued":
+                job.update(status="cancelled", finished=datetime.now().isoformat())
+                self._write(db, job)
+            elif job["status"] == "running":
+                db.execute("UPDATE jobs SET cancel=1 WHERE id=?", (jid,))
+            return row[0], job
+
+    def changes(self, since):
+        with self.store.lock:
+            return self.store.db.execute("SELECT version, seq, data FROM jobs WHERE version > ? ORDER BY version",
+                                         (since,)).fetchall()
+
+    def prune(self, keep):
+        with self.store._tx() as db:
+            db.execute("""DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND seq <= (
+                              SELECT seq FROM jobs WHERE status NOT IN ('queued', 'running')
+                              ORDER BY seq DESC LIMIT 1 OFFSET ?)""", (keep,))
+
+    def workers(self):
+        with self.store.lock:
+            rows = self.store.db.execute("SELECT id, heartbeat, slots, running FROM job_workers WHERE heartbeat >= ?",
+                                         (time.time() - JOB_LEASE_SECONDS,)).fetchall()
+        return [{"id": w, "seen_s": round(time.time() - hb, 1), "slots": slots, "running": n}
+                for w, hb, slots, n in rows]
+
+job_queue = SQLiteJobQueue(projects) if JOB_QUEUE == "shared" else None
+_jobs_version = 0  # last job-table version mirrored into `jobs`
+
+def poll_jobs():
+    """Mirror rows changed since the last poll into `jobs` and notify listeners."""
+    global _jobs_version
+    for version, seq, data in job_queue.changes(_jobs_version):
+        _jobs_version = version
+        data = json.loads(data)
+        job = jobs.get(data["id"])
+        if job is None: job = _track_job(data, seq)
+        else: job.update(data)
+        if job["status"] not in JOB_ACTIVE:
+            if _project_jobs.get(job["project_id"]) == job["id"]: del _project_jobs[job["project_id"]]
+            _job_runtime[job["id"]]["done"].set()
+        publish_job(job)
+    _prune_finished_jobs()
+
+async def _job_watcher():
+    while True:
+        try: poll_jobs()
+        except sqlite3.Error as e: logger.warning(f"Job poll failed: {e}")
+        await asyncio.sleep(JOB_POLL_SECONDS)
+
+def _sync_job(job):
+    """Worker side of publish_job: status changes are written at once,
+    progress by the next heartbeat."""
+    rt = _job_runtime.get(job["id"])
+    if rt is None: return
+    if rt.get("synced_status") == job["status"]:
+        rt["dirty"] = True
+        return
+    rt["synced_status"] = job["status"]
+    rt.pop("dirty", None)
+    if not job_queue.save(job, WORKER_ID) and job["status"] == "running":
+        logger.warning(f"Job {job['id']} is no longer held by this worker")
+        cancel_job(job["id"])
+
+async def _worker_heartbeat(running):
+    tick, every = 0, max(1, int(JOB_HEARTBEAT_SECONDS / JOB_SYNC_SECONDS))
+    while True:
+        await asyncio.sleep(JOB_SYNC_SECONDS)
+        dirty = [jobs[j] for j in running if j in jobs and _job_runtime[j].pop("dirty", False)]
+        try:
+            cancel, lost = job_queue.heartbeat(WORKER_ID, JOB_CONCURRENCY, list(running), dirty)
+            if tick % every == 0:
+                for job in job_queue.reclaim(JOB_LEASE_SECONDS):
+                    projects.update(job["project_id"], status="failed")
+        except sqlite3.Error as e:
+            logger.warning(f"Worker heartbeat failed: {e}")
+            continue
+        finally:
+            tick += 1
+        for jid in cancel + lost:
+            if jid in jobs and jobs[jid]["status"] == "running":
+                logger.info(f"Job {jid} {'cancelled' if jid in cancel else 'lost'}; stopping it")
+                cancel_job(jid)
+
+async def run_worker():
+    """`python app.py worker`: claim and render shared-queue jobs, JOB_CONCURRENCY
+    at a time, until stopped. Jobs still running at shutdown are requeued."""
+    slots, running = asyncio.Semaphore(JOB_CONCURRENCY), {}
+    main = asyncio.current_task()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main.cancel)
+    except (NotImplementedError, RuntimeError): pass  # Windows
+    heartbeat = asyncio.create_task(_worker_heartbeat(running))
+    logger.info(f"Render worker {WORKER_ID}: {JOB_CONCURRENCY} job slots, lease {JOB_LEASE_SECONDS:.0f}s")
+    try:
+        while True:
+            await slots.acquire()
+            claimed = job_queue.claim(WORKER_ID)
+            if claimed is None:
+                slots.release()
+                await asyncio.sleep(JOB_POLL_SECONDS)
+                continue
+            seq, job = claimed
+            _track_job(job, seq)
+            logger.info(f"Worker {WORKER_ID} took job {job['id']} (project {job['project_id']})")
+            task = running[job["id"]] = asyncio.create_task(_execute_job(job))
+            task.add_done_callback(lambda _, jid=job["id"]: (running.pop(jid, None), slots.release()))
+    finally:
+        heartbeat.cancel()
+        job_queue.release(WORKER_ID)
+        for jid in list(running): cancel_job(jid)
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        logger.info(f"Render worker {WORKER_ID} stopped")
+
+# ── Render Progress ───────────────────────────────────────────────────────────
+# A render is weighted across its stages; inside a stage each part (one per
+# segment) is weighted by its duration. run_ffmpeg feeds parsed -progress
+# blocks in, and every update is pushed to the job's WebSocket/SSE listeners.
+STAGE_WEIGHTS = {"segments": 0.75, "audio": 0.10, "concat": 0.15, "render": 1.0, "package": 0.05}
+
+def plan_progress(parts):
+    """Declare the parts of each stage up front: {stage: {part: weight}}."""
+    rt = _job_runtime.get(current_job_id.get())
+    if rt is None: return
+    rt["parts"] = {stage: {p: [w, 0.0] for p, w in ps.items()} for stage, ps in parts.items()}
+
+def report_progress(stage, part, info):
+    jid = current_job_id.get()
+    rt = _job_runtime.get(jid)
+    if rt is None: return
+    stage_parts = rt["parts"].setdefault(stage, {})
+    slot = stage_parts.setdefault(part, [1.0, 0.0])
+    if info.get("fraction") is not None:
+        slot[1] = max(slot[1], info["fraction"])
+    done = 0.0
+    for name, weight in STAGE_WEIGHTS.items():
+        ps = rt["parts"].get(name)
+        if ps:
+            total = sum(w for w, _ in ps.values()) or 1.0
+            done += weight * sum(w * f for w, f in ps.values()) / total
+    total_weight = sum(STAGE_WEIGHTS[n] for n in rt["parts"] if n in STAGE_WEIGHTS) or 1.0
+    job = jobs[jid]
+    elapsed = time.time() - rt["started_at"]
+    progress = job["progress"]
+    fraction = max(progress["percent"] / 100, min(1.0, done / total_weight))
+    progress.update(stage=stage, percent=round(fraction * 100, 1),
+                    eta_s=round(elapsed * (1 - fraction) / fraction, 1) if fraction > 0.01 else None)
+    if info.get("speed") is not None: progress["speed"] = info["speed"]
+    if info.get("frame") is not None: progress["frame"] = info["frame"]
+    publish_job(job)
+
+def publish_job(job):
+    if IS_WORKER: _sync_job(job)
+    event = {"type": "job", "job": job_view(job)}
+    for q in list(_job_runtime.get(job["id"], {}).get("subscribers", ())):
+        if q.full():
+            try: q.get_nowait()  # drop the oldest update for slow listeners
+            except asyncio.QueueEmpty: pass
+        q.put_nowait(event)
+
+async def job_events(jid):
+    """Yield the job's state now and after every change until it finishes."""
+    rt = _job_runtime[jid]
+    q = asyncio.Queue(maxsize=50)
+    rt["subscribers"].add(q)
+    try:
+        event = {"type": "job", "job": job_view(jobs[jid])}
+        while True:
+            yield event
+            if event["job"]["status"] not in JOB_ACTIVE:
+                return
+            event = await q.get()
+    finally:
+        rt["subscribers"].discard(q)
+
+def _stream_job_id(pid=None, jid=None):
+    refresh_jobs()
+    if pid is not None:
+        jid = _project_jobs.get(pid) or (projects.get(pid) or {}).get("job_id")
+    if jid not in jobs: raise HTTPException(404, "Job not found")
+    return jid
+
+@app.websocket("/ws/jobs/{jid}")
+async def job_progress_ws(websocket: WebSocket, jid: str):
+    await _serve_job_ws(websocket, jid=jid)
+
+@app.websocket("/ws/project/{pid}")
+async def project_progress_ws(websocket: WebSocket, pid: str):
+    await _serve_job_ws(websocket, pid=pid)
+
+async def _serve_job_ws(websocket, pid=None, jid=None):
+    await websocket.accept()
+    try:
+        jid = _stream_job_id(pid, jid)
+    except HTTPException:
+        await websocket.close(code=4404); return
+    try:
+        async for event in job_events(jid):
+            await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/api/jobs/{jid}/events")
+async def job_progress_sse(jid: str):
+    jid = _stream_job_id(jid=jid)
+    async def stream():
+        async for event in job_events(jid):
+            yield f"data: {json.dumps(event)}\n\n"
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/jobs")
+async def list_jobs(project_id: Optional[str] = None):
+    refresh_jobs()
+    return [job_view(j) for j in jobs.values() if project_id in (None, j["project_id"])]
+
+@app.get("/api/jobs/{jid}")
+async def get_job(jid: str):
+    refresh_jobs()
+    if jid not in jobs: raise HTTPException(404, "Job not found")
+    return job_view(jobs[jid])
+
+@app.post("/api/jobs/{jid}/cancel")
+async def cancel_job_api(jid: str):
+    refresh_jobs()
+    if jid not in jobs: raise HTTPException(404, "Job not found")
+    return job_view(cancel_job(jid))
+
+# ── Delivery ──────────────────────────────────────────────────────────────────
+# Finished files are served with Range (seeking, resumed downloads), ETag /
+# If-None-Match revalidation and, for outputs (render_stamp() makes every
+# name unique, so a file is never rewritten), an immutable Cache-Control.
+# Behind nginx or Apache, VIBE_SENDFILE hands the body to the proxy
+# (X-Accel-Redirect / X-Sendfile), which sends it with sendfile(2) so a
+# download never holds a worker.
+SENDFILE_MODE = os.environ.get("VIBE_SENDFILE", "")  # "", "x-accel" or "x-sendfile"
+SENDFILE_PREFIX = os.environ.get("VIBE_SENDFILE_PREFIX", "/_files/")  # nginx internal location aliased to BASE_DIR
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+def deliver_file(request, path, filename=None, media_type=None, cache_control=None):
+    """FileResponse (Range-capable) for `path`, a 304 if the client's copy
+    is current, or an empty response the front proxy fills in."""
+    resp = FileResponse(str(path), filename=filename, media_type=media_type, stat_result=os.stat(path),
+                        content_disposition_type="attachment" if filename else "inline")
+    if cache_control: resp.headers["cache-control"] = cache_control
+    etag = resp.headers["etag"]
+    inm = request.headers.get("if-none-match")
+    if inm and (inm.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in inm.split(",")]):
+        return Response(status_code=304, headers={k: v for k, v in resp.headers.items()
+                                                  if k in ("etag", "last-modified", "cache-control")})
+    if SENDFILE_MODE:
+        headers = {k: v for k, v in resp.headers.items() if k != "content-length"}
+        if SENDFILE_MODE == "x-accel":
+            headers["x-accel-redirect"] = SENDFILE_PREFIX + Path(os.path.relpath(path, BASE_DIR)).as_posix()
+        else:
+            headers["x-sendfile"] = str(Path(path).resolve())
+        return Response(headers=headers)
+    return resp
+
+def output_file(filename):
     fp = OUTPUT_DIR / filename
-    if not fp.exists(): raise HTTPException(404)
-    return FileResponse(str(fp), filename=filename, media_type="video/mp4")
+    if not fp.is_file(): raise HTTPException(404)
+    return fp
+
+@app.get("/api/download/{filename}")
+async def download_video(filename: str, request: Request):
+    return deliver_file(request, output_file(filename), filename, "video/mp4", IMMUTABLE)
+
+@app.get("/static/outputs/{filename}")
+async def stream_output(filename: str, request: Request):
+    """Player URL for an output; shadows the /static mount for top-level outputs."""
+    return deliver_file(request, output_file(filename), cache_control=IMMUTABLE)
+
+# ── Storage GC ────────────────────────────────────────────────────────────────
+# A sweep at startup and every VIBE_GC_INTERVAL seconds removes what nothing
+# points at any more:
+#   scratch  render directories whose process is gone (or a day old, and
+#            for other hosts' workers only by age)
+#   uploads  files no project media or audio track uses, and abandoned
+#            resumable uploads, once older than VIBE_GC_UPLOAD_HOURS
+#   outputs  renders no project shows and no known job returned, once older
+#            than VIBE_GC_OUTPUT_HOURS; least recently used first while the
+#            outputs exceed VIBE_OUTPUT_QUOTA_MB
+#   temp     half-written cache files left by a crash
+# Projects with a queued or running render are left alone.
+GC_INTERVAL = float(os.environ.get("VIBE_GC_INTERVAL", 3600))  # 0 disables the background sweep
+GC_UPLOAD_SECONDS = float(os.environ.get("VIBE_GC_UPLOAD_HOURS", 24)) * 3600
+GC_OUTPUT_SECONDS = float(os.environ.get("VIBE_GC_OUTPUT_HOURS", 168)) * 3600
+OUTPUT_QUOTA_BYTES = int(float(os.environ.get("VIBE_OUTPUT_QUOTA_MB", 0)) * 1024 * 1024)  # 0: no quota
+GC_TEMP_SECONDS = 3600
+GC_SCRATCH_SECONDS = 86400
+GC_MIN_OUTPUT_SECONDS = 600  # a fresh render is never collected, quota or not
+_gc_lock = asyncio.Lock()
+last_gc = None
+
+def _disk_bytes(p):
+    try:
+        if not p.is_dir(): return p.stat().st_size
+        return sum(f.stat().st_size for f in p.rglob("*") if f.is_file())
+    except OSError:
+        return 0
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _sweep(keep_uploads, keep_outputs, busy, live_scratch, dry_run):
+    """Walk the storage areas and remove garbage; returns the GC report."""
+    now = time.time()
+    reclaimed = dict.fromkeys(("scratch", "uploads", "outputs", "temp"), 0)
+    usage = dict.fromkeys(("scratch", "uploads", "outputs"), 0)
+    removed = 0
+
+    def age(p):
+        try: return now - p.stat().st_mtime
+        except OSError: return 0
+
+    def remove(kind, size, *paths):
+        nonlocal removed
+        if not dry_run:
+            for p in paths:
+                try: shutil.rmtree(p) if p.is_dir() else p.unlink()
+                except FileNotFoundError: pass  # another process collected it
+                except OSError as e:
+                    logger.warning(f"GC could not remove {p}: {e}")
+                    return False
+        reclaimed[kind] += size
+        removed += 1
+        return True
+
+    for host in (h for base in scratch_bases() if base.is_dir() for h in base.iterdir() if h.is_dir()):
+        for d in host.iterdir():
+            m = SCRATCH_NAME.fullmatch(d.name)
+            if not m or not d.is_dir(): continue  # not made by new_scratch(): leave it alone
+            size, owner = _disk_bytes(d), int(m.group(1))
+            if host.name != SCRATCH_HOST: keep = age(d) < GC_SCRATCH_SECONDS  # can't see that host's processes
+            elif owner == os.getpid(): keep = d in live_scratch
+            else: keep = _pid_alive(owner)
+            if keep or not remove("scratch", size, d): usage["scratch"] += size
+
+    for pdir in (p for p in UPLOAD_DIR.iterdir() if p.is_dir()):
+        for f in pdir.iterdir():
+            size = _disk_bytes(f)
+            if (pdir.name, f.name) in keep_uploads or pdir.name in busy or age(f) < GC_UPLOAD_SECONDS \
+                    or not remove("uploads", size, f):
+                usage["uploads"] += size
+        if pdir.name not in projects and not any(pdir.iterdir()) and not dry_run:
+            pdir.rmdir()
+    for part in PARTIAL_UPLOAD_DIR.glob("*/*.part"):
+        if age(part) >= GC_UPLOAD_SECONDS:
+            remove("uploads", _disk_bytes(part), part, part.with_suffix(".json"))
+
+    hls = OUTPUT_DIR / "hls"
+    outputs = []  # (last used, size, path, its HLS directory) of collectable renders
+    for f in (p for p in OUTPUT_DIR.iterdir() if p.is_file()):
+        st, d = f.stat(), hls / f.stem
+        size = st.st_size + (_disk_bytes(d) if d.is_dir() else 0)
+        if f.name in keep_outputs or now - st.st_mtime < GC_MIN_OUTPUT_SECONDS:
+            usage["outputs"] += size
+        elif now - st.st_mtime < GC_OUTPUT_SECONDS or not remove("outputs", size, f, d):
+            usage["outputs"] += size
+            outputs.append((max(st.st_atime, st.st_mtime), size, f, d))
+    for d in (hls.iterdir() if hls.is_dir() else []):
+        if not (OUTPUT_DIR / f"{d.name}.mp4").exists() and age(d) >= GC_TEMP_SECONDS:
+            remove("outputs", _disk_bytes(d), d)
+    if OUTPUT_QUOTA_BYTES:
+        for _, size, f, d in sorted(outputs, key=lambda o: o[0]):
+            if usage["outputs"] <= OUTPUT_QUOTA_BYTES: break
+            if remove("outputs", size, f, d): usage["outputs"] -= size
+
+    for c in (segment_cache, still_cache, bed_cache, download_cache):
+        for f in c.root.glob(".*"):  # in-progress writes; renamed into the cache when complete
+            if age(f) >= GC_TEMP_SECONDS: remove("temp", _disk_bytes(f), f)
+
+    return {"reclaimed": reclaimed, "bytes": sum(reclaimed.values()), "removed": removed, "usage": usage}
+
+async def collect_garbage(dry_run=False):
+    """Run one storage sweep; with dry_run, report what it would remove."""
+    global last_gc
+    async with _gc_lock:
+        refresh_jobs()
+        paths, urls = await asyncio.to_thread(projects.referenced_files)
+        keep_uploads = {(Path(p).parent.name, name) for p in paths
+                        for name in (Path(p).name, Path(p).with_suffix(".pcm.wav").name)}
+        keep_outputs = {u.rsplit("/", 1)[-1] for u in urls}
+        busy = set()
+        for j in list(jobs.values()):
+            if j["status"] in JOB_ACTIVE: busy.add(j["project_id"])
+            result = j.get("result") or {}
+            keep_outputs.update(f["filename"] for f in [result, *result.get("renditions", [])] if f.get("filename"))
+        t0 = time.perf_counter()
+        report = await asyncio.to_thread(_sweep, keep_uploads, keep_outputs, busy, set(_live_scratch), dry_run)
+        report.update(finished=datetime.now().isoformat(), seconds=round(time.perf_counter() - t0, 3), dry_run=dry_run)
+        for area, n in report["usage"].items(): STORAGE_BYTES.set(n, area=area)
+        if not dry_run:
+            for kind, n in report["reclaimed"].items(): GC_BYTES.inc(n, kind=kind)
+            last_gc = report
+            logger.info(f"Storage GC: {report['removed']} removed, {report['bytes'] / 1e6:.1f} MB reclaimed "
+                        f"in {report['seconds']}s")
+        return report
+
+async def _gc_loop():
+    while True:
+        try:
+            await collect_garbage()
+        except Exception as e:
+            logger.error(f"Storage GC failed: {e}")
+        await asyncio.sleep(GC_INTERVAL)
+
+@app.get("/api/admin/storage")
+async def storage_status():
+    return {"last_gc": last_gc, "scratch": [str(r) for r in scratch_roots()], "live_scratch": len(_live_scratch),
+            "policy": {"interval_s": GC_INTERVAL, "upload_hours": GC_UPLOAD_SECONDS / 3600,
+                       "output_hours": GC_OUTPUT_SECONDS / 3600, "output_quota_bytes": OUTPUT_QUOTA_BYTES}}
+
+@app.post("/api/admin/gc")
+async def run_gc(request: Request):
+    """Sweep now; {"dry_run": true} only reports what would go."""
+    try: body = await request.json()
+    except: body = {}
+    return await collect_garbage(bool(body.get("dry_run")))
 
 # ── AI Chat API ───────────────────────────────────────────────────────────────
+# One AsyncAnthropic client per event loop (so the loop never blocks on the
+# model), replies optionally streamed as SSE, and an LRU of answers keyed by
+# the normalised prompt plus the project context it was asked in.
+# ANTHROPIC_BASE_URL points the SDK at another endpoint (a proxy, or a stub
+# model in tests and benchmarks).
+CHAT_MODEL = os.environ.get("VIBE_CHAT_MODEL", "claude-sonnet-4-20250514")
+CHAT_CACHE_SIZE = int(os.environ.get("VIBE_CHAT_CACHE_SIZE", 256))
+_chat_replies = OrderedDict()  # sha256 of (model, prompt, context) -> reply
+_chat = None  # (loop, AsyncAnthropic)
+
+def chat_client():
+    global _chat
+    import anthropic
+    loop = asyncio.get_running_loop()
+    if _chat is None or _chat[0] is not loop:
+        _chat = (loop, anthropic.AsyncAnthropic(api_key=os.environ.get("ANTHROPIC_API_KEY", "")))
+    return _chat[1]
+
+async def close_chat_client():
+    global _chat
+    if _chat and _chat[0] is asyncio.get_running_loop():
+        client, _chat = _chat[1], None
+        await client.close()
+
+def chat_request(msg, pid):
+    """(create() kwargs, cache key) for a chat message."""
+    ctx = ""
+    p = projects.get(pid) if pid else None
+    if p:
+        ctx = f"\nProject: category={p['category']}, audio={p['audio_vibe']}, {len(p['media'])} files."
+    kwargs = dict(
+        model=CHAT_MODEL, max_tokens=1000,
+        system=f"You are Vibe Studio AI, a creative video assistant. Categories: {list(VIDEO_CATEGORIES.keys())}. Audio vibes: {list(AUDIO_VIBES.keys())}. Respond with suggestions and optionally a JSON action block in ```json``` fences.{ctx}",
+        messages=[{"role": "user", "content": msg}],
+    )
+    prompt = " ".join(msg.lower().split())
+    return kwargs, hashlib.sha256(json.dumps([CHAT_MODEL, prompt, ctx]).encode()).hexdigest()
+
+def remember_reply(key, reply):
+    _chat_replies[key] = reply
+    _chat_replies.move_to_end(key)
+    while len(_chat_replies) > CHAT_CACHE_SIZE: _chat_replies.popitem(last=False)
+
+def cached_reply(key):
+    reply = _chat_replies.get(key)
+    if reply is not None: _chat_replies.move_to_end(key)
+    return reply
+
 @app.post("/api/chat")
 async def ai_chat(request: Request):
     data = await request.json()
     msg = data.get("message", "")
-    pid = data.get("project_id")
-    api_key = os.environ.get("ANTHROPIC_API_KEY", "")
-    if api_key:
+    if os.environ.get("ANTHROPIC_API_KEY", ""):
+        kwargs, key = chat_request(msg, data.get("project_id"))
+        reply = cached_reply(key)
+        if reply is not None:
+            return {"reply": reply, "source": "cache"}
         try:
-            import anthropic
-            client = anthropic.Anthropic(api_key=api_key)
-            ctx = ""
-            if pid and pid in projects:
-                p = projects[pid]
-                ctx = f"\nProject: category={p['category']}, audio={p['audio_vibe']}, {len(p['media'])} files."
-            resp = client.messages.create(
-                model="claude-sonnet-4-20250514", max_tokens=1000,
-                system=f"You are Vibe Studio AI, a creative video assistant. Categories: {list(VIDEO_CATEGORIES.keys())}. Audio vibes: {list(AUDIO_VIBES.keys())}. Respond with suggestions and optionally a JSON action block in ```json``` fences.{ctx}",
-                messages=[{"role": "user", "content": msg}],
-            )
+            resp = await chat_client().messages.create(**kwargs)
+            remember_reply(key, resp.content[0].text)
             return {"reply": resp.content[0].text, "source": "ai"}
         except Exception as e:
             logger.error(f"AI error: {e}")
     return {"reply": _template_reply(msg), "source": "template"}
 
+@app.post("/api/chat/stream")
+async def ai_chat_stream(request: Request):
+    """Same as /api/chat, as Server-Sent Events: {"type": "delta", "text"}
+    while the model writes, then {"type": "done", "reply", "source"}."""
+    data = await request.json()
+    msg = data.get("message", "")
+
+    async def events():
+        def sse(event): return f"data: {json.dumps(event)}\n\n"
+        reply, source = None, "template"
+        if os.environ.get("ANTHROPIC_API_KEY", ""):
+            kwargs, key = chat_request(msg, data.get("project_id"))
+            reply, source = cached_reply(key), "cache"
+            if reply is None:
+                parts = []
+                try:
+                    async with chat_client().messages.stream(**kwargs) as stream:
+                        async for text in stream.text_stream:
+                            parts.append(text)
+                            yield sse({"type": "delta", "text": text})
+                    reply, source = "".join(parts), "ai"
+                    remember_reply(key, reply)
+                except Exception as e:
+                    logger.error(f"AI error: {e}")
+                    if parts:  # the reader already has part of an answer; finish with what arrived
+                        yield sse({"type": "done", "reply": "".join(parts), "source": "ai", "error": str(e)})
+                        return
+                    reply, source = None, "template"
+        if reply is None:
+            reply = _template_reply(msg)
+        if source != "ai":
+            yield sse({"type": "delta", "text": reply})
+        yield sse({"type": "done", "reply": reply, "source": source})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 def _template_reply(msg):
     ml = msg.lower()
     if any(w in ml for w in ["religious","islamic","spiritual","nasheed","quran","church","devotional","eid","ramadan"]):
@@ -610,7 +3415,15 @@ app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="stat
 
 
 # ══════════════════════════════════════════════════════════════════════════════
+startup["imported"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["worker"]:
+        if JOB_QUEUE != "shared": sys.exit("python app.py worker needs VIBE_JOB_QUEUE=shared")
+        IS_WORKER = True
+        try: asyncio.run(run_worker())
+        except (KeyboardInterrupt, asyncio.CancelledError): pass  # Ctrl-C / SIGTERM
+        sys.exit(0)
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
 
@@ -630,4 +3443,6 @@ if __name__ == "__main__":
 ║   AI Chat:   {'✅ Key set' if os.environ.get('ANTHROPIC_API_KEY') else '⚠️  Set ANTHROPIC_API_KEY for AI chat'}         ║
 ╚══════════════════════════════════════════════════════════════╝
     """)
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Several workers share the project store; render jobs are queued per worker.
+    workers = int(os.environ.get("VIBE_WEB_WORKERS", 1))
+    uvicorn.run("app:app" if workers > 1 else app, host="0.0.0.0", port=port, workers=workers)
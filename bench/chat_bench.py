@@ -0,0 +1,147 @@
+"""
+Chat benchmark: /api/chat and /api/chat/stream against a stub model endpoint.
+
+Run:   python bench/chat_bench.py --requests 5 --latency 1.0
+       python bench/chat_bench.py --stub-only --port 8090   # just serve the stub
+
+A local stand-in for the Messages API (POST /v1/messages, plain and
+stream=true) answers every prompt after --latency seconds, streaming
+--tokens words. The app is started in-process with ANTHROPIC_BASE_URL
+pointing at it, and for each endpoint the bench reports:
+
+  cold       wall time of a first question (one stub call)
+  cached     the same question re-asked with different case/spacing,
+             which must be answered from the reply cache without
+             reaching the stub
+  first      time to the first streamed delta (stream endpoint only)
+  status     worst /api/status latency while --requests questions are
+             in flight; stays in milliseconds when nothing blocks the loop
+"""
+
+import argparse, asyncio, json, logging, os, socket, sys, threading, time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+
+def stub_app(latency, tokens):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+    stub = FastAPI()
+    stub.state.calls = 0
+
+    @stub.post("/v1/messages")
+    async def messages(request: Request):
+        body = await request.json()
+        stub.state.calls += 1
+        words = [f"word{i} " for i in range(tokens)]
+        message = {"id": f"msg_{stub.state.calls}", "type": "message", "role": "assistant", "model": body["model"],
+                   "content": [], "stop_reason": None, "stop_sequence": None,
+                   "usage": {"input_tokens": 1, "output_tokens": 0}}
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return dict(message, content=[{"type": "text", "text": "".join(words)}], stop_reason="end_turn",
+                        usage={"input_tokens": 1, "output_tokens": tokens})
+
+        async def events():
+            def sse(kind, data): return f"event: {kind}\ndata: {json.dumps(dict(data, type=kind))}\n\n"
+            yield sse("message_start", {"message": message})
+            yield sse("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+            for w in words:
+                await asyncio.sleep(latency / tokens)
+                yield sse("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": w}})
+            yield sse("content_block_stop", {"index": 0})
+            yield sse("message_delta", {"delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                        "usage": {"output_tokens": tokens}})
+            yield sse("message_stop", {})
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return stub
+
+
+def serve(asgi, port):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(asgi, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started: time.sleep(0.05)
+    return server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def ask(client, path, message):
+    """(wall seconds, seconds to first delta, final event or JSON reply)."""
+    t0, first = time.perf_counter(), None
+    if not path.endswith("/stream"):
+        r = await client.post(path, json={"message": message})
+        return time.perf_counter() - t0, None, r.json()
+    async with client.stream("POST", path, json={"message": message}) as r:
+        async for line in r.aiter_lines():
+            if not line.startswith("data: "): continue
+            event = json.loads(line[6:])
+            if event["type"] == "delta" and first is None: first = time.perf_counter() - t0
+            if event["type"] == "done": return time.perf_counter() - t0, first, event
+
+
+async def run(base, stub, args):
+    import httpx
+    for name in ("httpx", "httpx2"):  # the SDK logs through its own httpx fork
+        logging.getLogger(name).setLevel(logging.WARNING)
+    async with httpx.AsyncClient(base_url=base, timeout=60) as client:
+        for path in ("/api/chat", "/api/chat/stream"):
+            calls = stub.state.calls
+            cold, first, reply = await ask(client, path, f"Ideas for a {path} reel?")
+            cached, _, again = await ask(client, path, f"  ideas for a {path.upper()}   REEL? ")
+            assert again["source"] == "cache" and again["reply"] == reply["reply"], again
+            assert stub.state.calls == calls + 1, "cached question reached the model"
+
+            async def probe(stop):
+                worst = 0.0
+                while not stop.is_set():
+                    t0 = time.perf_counter()
+                    await client.get("/api/status")
+                    worst = max(worst, time.perf_counter() - t0)
+                    await asyncio.sleep(0.05)
+                return worst
+            stop = asyncio.Event()
+            prober = asyncio.create_task(probe(stop))
+            await asyncio.gather(*(ask(client, path, f"question {i} for {path}") for i in range(args.requests)))
+            stop.set()
+            worst = await prober
+            print(f"  {path:<18} cold={cold * 1000:7.1f}ms  cached={cached * 1000:6.1f}ms  "
+                  f"first={'-' if first is None else f'{first * 1000:.1f}ms':>9}  status<= {worst * 1000:.1f}ms "
+                  f"({args.requests} in flight)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=5, help="concurrent questions while probing /api/status")
+    ap.add_argument("--latency", type=float, default=1.0, help="stub seconds per reply")
+    ap.add_argument("--tokens", type=int, default=20, help="words per stub reply")
+    ap.add_argument("--stub-only", action="store_true", help="only serve the stub model on --port")
+    ap.add_argument("--port", type=int, default=0)
+    args = ap.parse_args()
+
+    stub = stub_app(args.latency, args.tokens)
+    stub_port = args.port or free_port()
+    if args.stub_only:
+        print(f"  stub model on http://127.0.0.1:{stub_port} (ANTHROPIC_BASE_URL)")
+        serve(stub, stub_port)
+        threading.Event().wait()
+    serve(stub, stub_port)
+    os.environ.update(ANTHROPIC_BASE_URL=f"http://127.0.0.1:{stub_port}",
+                      ANTHROPIC_API_KEY=os.environ.get("ANTHROPIC_API_KEY", "stub"))
+    import app
+    app_port = free_port()
+    serve(app.app, app_port)
+    print(f"  stub latency {args.latency}s, {args.tokens} words per reply")
+    asyncio.run(run(f"http://127.0.0.1:{app_port}", stub, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Ken Burns benchmark: ffmpeg's zoompan vs the NumPy frame generator.
+
+Run:   python bench/kenburns_bench.py --segments 4 --seconds 4 --size 1080x1920
+       python bench/kenburns_bench.py --profile draft
+
+For each engine the same prepared still is turned into --segments image
+segments, one after another, exactly as render_segments would encode them.
+Two numbers per engine:
+
+  generate   frames/s of the zoom alone (zoompan into -f null, or
+             KenBurnsFrames.frame() in a loop), i.e. without the encoder
+  segment    frames/s and CPU seconds (this process + ffmpeg children) per
+             encoded segment
+
+The numpy segments are compared to the zoompan ones with ffmpeg's ssim filter.
+"""
+
+import argparse, asyncio, re, resource, shutil, subprocess, sys, tempfile, time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+sys.path.insert(0, str(BENCH_DIR))
+
+
+def cpu_seconds():
+    own, kids = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + kids.ru_utime + kids.ru_stime
+
+
+def timed(fn):
+    t0, c0 = time.perf_counter(), cpu_seconds()
+    fn()
+    return time.perf_counter() - t0, cpu_seconds() - c0
+
+
+def ssim(out, ref):
+    proc = subprocess.run(["ffmpeg", "-hide_banner", "-i", out, "-i", ref, "-lavfi", "ssim", "-f", "null", "-"],
+                          capture_output=True, text=True)
+    m = re.search(r"SSIM .*All:([\d.]+)", proc.stderr)
+    return float(m.group(1)) if m else None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--segments", type=int, default=4)
+    ap.add_argument("--seconds", type=float, default=4.0, help="duration of each segment")
+    ap.add_argument("--size", default="1080x1920", help="output WxH")
+    ap.add_argument("--fps", type=int, default=30)
+    ap.add_argument("--profile", default="final", help="render profile (final, draft)")
+    args = ap.parse_args()
+
+    import app, synth
+    if not app.HAS_NUMPY:
+        sys.exit("numpy and Pillow are required for the numpy engine")
+    profile = app.RENDER_PROFILES[args.profile]
+    w, h = (int(v) for v in args.size.split("x"))
+    if profile["scale"] != 1.0:
+        w, h = int(w * profile["scale"]) // 2 * 2, int(h * profile["scale"]) // 2 * 2
+    fps = min(args.fps, profile["max_fps"] or args.fps)
+    frames = int(args.seconds * fps)
+    cf, threads = "eq=contrast=1.05:saturation=1.1", app.segment_threads(1)
+    tmp = Path(tempfile.mkdtemp(prefix="vibe-kb-"))
+    src = synth.make_image(tmp / "src.jpg", size="3000x2000")
+    still = str(tmp / "still.png")
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-i", src, "-filter_complex",
+                    app.still_filter(w, h, profile), "-frames:v", "1", still], check=True)
+    item = {"type": "image", "path": src}
+    print(f"  {args.segments} x {args.seconds}s segments at {w}x{h}@{fps} ({frames} frames each), profile={args.profile}")
+
+    def gen_zoompan():
+        subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-i", still, "-vf",
+                        app.zoompan_filter(frames, w, h, fps), "-f", "null", "-"], check=True)
+
+    def gen_numpy():
+        kb = app.KenBurnsFrames(still, w, h, frames)
+        for i in range(frames):
+            kb.frame(i)
+
+    def encode(engine):
+        async def run():
+            for s in range(args.segments):
+                seg = str(tmp / f"{engine}{s}.mp4")
+                if engine == "numpy":
+                    cmd = app.build_kenburns_cmd(seg, args.seconds, w, h, fps, cf, threads, profile)
+                    feed = app.kenburns_feed(still, w, h, frames)
+                else:
+                    cmd = app.build_segment_cmd(item, seg, args.seconds, w, h, fps, cf, threads,
+                                                still=still, profile=profile)
+                    feed = None
+                r = await app.run_ffmpeg(cmd, 600, feed=feed)
+                assert r["success"], r.get("error")
+        return lambda: asyncio.run(run())
+
+    results = {}
+    for engine, gen in (("zoompan", gen_zoompan), ("numpy", gen_numpy)):
+        g_wall, _ = timed(gen)
+        s_wall, s_cpu = timed(encode(engine))
+        results[engine] = (frames / g_wall, args.segments * frames / s_wall, s_cpu / args.segments)
+    for engine, (g_fps, s_fps, cpu) in results.items():
+        sim = 1.0 if engine == "zoompan" else ssim(str(tmp / f"{engine}0.mp4"), str(tmp / "zoompan0.mp4"))
+        print(f"  {engine:<8} generate={g_fps:7.1f} fps  segment={s_fps:6.1f} fps  cpu/segment={cpu:6.2f}s  ssim={sim}")
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
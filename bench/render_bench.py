@@ -0,0 +1,104 @@
+"""
+Render benchmark: compare pipeline settings on the same synthetic project.
+
+Run:   python bench/render_bench.py --items 12 --duration 30 --workers 1,4
+       python bench/render_bench.py --engines segments,single_pass
+       python bench/render_bench.py --profiles final,draft
+
+Every combination of --workers, --engines and --profiles runs in a fresh interpreter
+(the render pool is sized from VIBE_RENDER_WORKERS at import) with the
+segment and audio bed caches disabled and a throwaway in-memory project store. Outputs are compared with ffmpeg's ssim/psnr
+filters against the first variant (scaled up to its size when a draft is
+lower resolution), so speed and quality are read together.
+"""
+
+import argparse, asyncio, itertools, json, os, re, shutil, subprocess, sys, time, uuid
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+sys.path.insert(0, str(BENCH_DIR))
+
+
+def build_project(app, n_items, duration):
+    """Create a throwaway project of alternating images and clips."""
+    import synth
+    pid = f"bench{uuid.uuid4().hex[:6]}"
+    pdir = app.UPLOAD_DIR / pid
+    pdir.mkdir(parents=True, exist_ok=True)
+    media = []
+    for i in range(n_items):
+        if i % 2 == 0:
+            path = synth.make_image(pdir / f"img{i}.jpg", seed=i)
+            media.append(synth.media_item(f"i{i}", path, "image", i))
+        else:
+            path = synth.make_clip(pdir / f"clip{i}.mp4", seconds=max(4, duration // n_items + 2), freq=300 + i * 40)
+            media.append(synth.media_item(f"v{i}", path, "video", i))
+    app.projects.create({
+        "id": pid, "category": "travel", "audio_vibe": "energetic",
+        "target_duration": duration, "media": media, "audio_tracks": [],
+        "audio_file": None, "video_volume": 100, "status": "draft", "created": "",
+    })
+    return pid
+
+
+def run_once(args):
+    import app
+    pid = build_project(app, args.items, args.duration)
+    body = dict(json.loads(args.body), duration=args.duration)
+    t0 = time.perf_counter()
+    result = asyncio.run(app.render_project(pid, body))
+    wall = time.perf_counter() - t0
+    shutil.rmtree(app.UPLOAD_DIR / pid, ignore_errors=True)
+    out = app.OUTPUT_DIR / result["filename"]
+    print(json.dumps({"wall_s": round(wall, 2), "output": str(out), "output_bytes": out.stat().st_size}))
+
+
+def compare_quality(ref, out):
+    """(ssim, psnr) of `out` against `ref` using ffmpeg's own filters."""
+    proc = subprocess.run(["ffmpeg", "-hide_banner", "-i", out, "-i", ref, "-lavfi",
+                           "[0:v][1:v]scale2ref[o][r];[o]split[o1][o2];[r]split[r1][r2];[o1][r1]ssim;[o2][r2]psnr",
+                           "-f", "null", "-"],
+                          capture_output=True, text=True)
+    ssim = re.search(r"SSIM .*All:([\d.]+)", proc.stderr)
+    psnr = re.search(r"PSNR .*average:([\d.inf]+)", proc.stderr)
+    return (float(ssim.group(1)) if ssim else None, psnr.group(1) if psnr else None)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--items", type=int, default=12)
+    ap.add_argument("--duration", type=int, default=30)
+    ap.add_argument("--workers", default=str(min(os.cpu_count() or 2, 8)),
+                    help="comma-separated VIBE_RENDER_WORKERS values to compare")
+    ap.add_argument("--engines", default="segments", help="comma-separated render engines to compare")
+    ap.add_argument("--profiles", default="final", help="comma-separated render profiles to compare (final, draft)")
+    ap.add_argument("--once", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--body", default="{}", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.once:
+        return run_once(args)
+
+    rows = []
+    for n, engine, profile in itertools.product(args.workers.split(","), args.engines.split(","),
+                                                args.profiles.split(",")):
+        env = dict(os.environ, VIBE_RENDER_WORKERS=n.strip(), VIBE_SEGMENT_CACHE_MB="0", VIBE_AUDIO_CACHE_MB="0",
+                   VIBE_STORE="sqlite://:memory:")
+        body = {"engine": engine, "profile": profile}
+        out = subprocess.run([sys.executable, __file__, "--once", "--items", str(args.items),
+                              "--duration", str(args.duration), "--body", json.dumps(body)],
+                             env=env, capture_output=True, text=True, check=True)
+        row = json.loads(out.stdout.strip().splitlines()[-1])
+        rows.append(dict(row, workers=n.strip(), engine=engine, profile=profile))
+    base = rows[0]
+    for r in rows:
+        ssim, psnr = compare_quality(base["output"], r["output"]) if r is not base else (1.0, "inf")
+        print(f"  workers={r['workers']:<3} engine={r['engine']:<12} profile={r['profile']:<6} wall={r['wall_s']:7.2f}s  "
+              f"speedup={base['wall_s'] / r['wall_s']:.2f}x  size={r['output_bytes'] / 1e6:.1f}MB  "
+              f"ssim={ssim}  psnr={psnr}")
+    for r in rows:
+        os.remove(r["output"])
+
+
+if __name__ == "__main__":
+    main()
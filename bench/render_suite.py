@@ -0,0 +1,265 @@
+"""
+Render regression suite: a fixed scenario matrix checked against a baseline.
+
+Run:   python bench/render_suite.py --save                  # record bench/baseline.json
+       python bench/render_suite.py                         # compare, exit 1 on a regression
+       python bench/render_suite.py --content mixed --durations 15 --orientations portrait
+       python bench/render_suite.py --profile draft --size 540x960 --baseline bench/draft.json --save
+
+Scenarios are content x duration x orientation:
+
+  images     stills only (Ken Burns segments)
+  videos     clips only (their own audio goes into the bed)
+  mixed      alternating stills and clips plus one music track
+  audio      mixed, with four music tracks to level and mix
+
+one item per three seconds of timeline (at least four). All inputs come from
+synth.py, generated once per run, so every run and every box renders the
+same bytes. Each scenario runs in a fresh interpreter with the segment, still
+and audio-bed caches disabled and records:
+
+  wall_s       render_project wall time
+  cpu_s        user+sys of the interpreter and its ffmpeg children
+  rss_mb       peak RSS of the interpreter
+  ffmpeg_rss_mb  peak RSS of the largest ffmpeg child (Linux carries the
+               high-water mark across exec, so it never reads below rss_mb)
+  temp_mb      peak scratch bytes on disk (project dir, scratch dirs and cache/) while rendering
+  output_mb    size of the finished MP4
+
+Audio tracks are leveled before the clock starts, as upload would have done.
+With --repeat, times are the median of the runs and sizes the maximum.
+Baselines hold the thresholds they were saved with; a metric regresses when
+it grows by more than its threshold. Baselines are per machine, so they
+are not checked in.
+"""
+
+import argparse, asyncio, itertools, json, os, platform, resource, shutil, statistics, subprocess, sys
+import tempfile, threading, time, uuid
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+sys.path.insert(0, str(BENCH_DIR))
+
+CONTENTS = ("images", "videos", "mixed", "audio")
+DURATIONS = (15, 30, 60)
+ORIENTATIONS = ("portrait", "landscape")
+METRICS = ("wall_s", "cpu_s", "rss_mb", "ffmpeg_rss_mb", "temp_mb", "output_mb")
+THRESHOLDS = {"wall_s": 0.15, "cpu_s": 0.15, "rss_mb": 0.25, "ffmpeg_rss_mb": 0.25, "temp_mb": 0.25,
+              "output_mb": 0.10}
+CLIP_SECONDS = 8
+
+
+def scenario_items(content, duration):
+    """[(kind, index)] on the timeline, and the number of music tracks."""
+    n = max(4, duration // 3)
+    if content == "images": kinds = ["image"] * n
+    elif content == "videos": kinds = ["video"] * n
+    else: kinds = ["image" if i % 2 == 0 else "video" for i in range(n)]
+    return list(zip(kinds, range(n))), {"images": 0, "videos": 0, "mixed": 1, "audio": 4}[content]
+
+
+def make_media(media_dir, n_items, n_tracks):
+    """Synthetic inputs, shared by every scenario of a run."""
+    import synth
+    media_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(n_items):
+        synth.make_image(media_dir / f"img{i}.jpg", seed=i)
+        synth.make_clip(media_dir / f"clip{i}.mp4", seconds=CLIP_SECONDS, freq=300 + i * 40)
+    for t in range(n_tracks):
+        synth.make_audio(media_dir / f"music{t}.m4a", seconds=90, freq=180 + t * 70)
+
+
+def dir_bytes(root, skip=()):
+    total = 0
+    for dirpath, _, files in os.walk(root):
+        for f in files:
+            p = os.path.join(dirpath, f)
+            if p in skip: continue
+            try: total += os.path.getsize(p)
+            except OSError: pass  # renamed or removed mid-walk
+    return total
+
+
+class DiskSampler(threading.Thread):
+    """Polls scratch usage: new bytes under the given roots (missing ones count as empty)."""
+
+    def __init__(self, roots, interval=0.05):
+        super().__init__(daemon=True)
+        self.roots, self.interval = roots, interval
+        self.skip = {os.path.join(d, f) for root in roots for d, _, fs in os.walk(root) for f in fs}
+        self.peak, self.stopped = 0, threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, sum(dir_bytes(r, self.skip) for r in self.roots))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, sum(dir_bytes(r, self.skip) for r in self.roots))
+
+
+def cpu_seconds():
+    own, kids = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + kids.ru_utime + kids.ru_stime
+
+
+def run_once(args):
+    """Render one scenario in this interpreter and print its metrics as JSON."""
+    import app
+    content, duration, orientation = args.once.split(":")
+    items, n_tracks = scenario_items(content, int(duration))
+    media_dir = Path(args.media)
+    pid = f"suite{uuid.uuid4().hex[:6]}"
+    pdir = app.UPLOAD_DIR / pid
+    pdir.mkdir(parents=True, exist_ok=True)
+    media = []
+    for kind, i in items:
+        src = media_dir / (f"img{i}.jpg" if kind == "image" else f"clip{i}.mp4")
+        path = str(shutil.copy(src, pdir / src.name))
+        media.append({"id": f"m{i}", "type": kind, "filename": src.name, "path": str(path), "url": "",
+                      "order": i, "trim_start": 0, "trim_end": None, "caption": "", "custom_duration": None})
+    tracks = [{"id": f"a{t}", "type": "audio", "filename": f"music{t}.m4a", "url": "", "role": f"Audio {t + 1}",
+               "path": str(shutil.copy(media_dir / f"music{t}.m4a", pdir / f"music{t}.m4a")), "volume": 50}
+              for t in range(n_tracks)]
+    app.projects.create({
+        "id": pid, "category": "travel", "audio_vibe": "energetic", "target_duration": int(duration),
+        "media": media, "audio_tracks": tracks, "audio_file": None, "video_volume": 100,
+        "status": "draft", "created": "",
+    })
+    w, h = (int(v) for v in args.size.split("x"))
+    if orientation == "landscape": w, h = max(w, h), min(w, h)
+    else: w, h = min(w, h), max(w, h)
+    body = {"duration": int(duration), "width": w, "height": h, "profile": args.profile,
+            "engine": args.engine or app.RENDER_ENGINE}
+
+    async def render():
+        for t in tracks:  # upload-time work, not part of the render
+            await app.prepare_audio(pid, t)
+        sampler = DiskSampler([str(pdir), str(app.CACHE_DIR), *map(str, app.scratch_roots())])
+        sampler.start()
+        t0, c0 = time.perf_counter(), cpu_seconds()
+        result = await app.render_project(pid, body)
+        wall, cpu = time.perf_counter() - t0, cpu_seconds() - c0
+        sampler.stop()
+        return result, wall, cpu, sampler.peak
+
+    result, wall, cpu, temp = asyncio.run(render())
+    out = app.OUTPUT_DIR / result["filename"]
+    row = {"wall_s": round(wall, 3), "cpu_s": round(cpu, 3),
+           "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+           "ffmpeg_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+           "temp_mb": round(temp / 1e6, 2), "output_mb": round(out.stat().st_size / 1e6, 3)}
+    out.unlink()
+    shutil.rmtree(pdir, ignore_errors=True)
+    print(json.dumps(row))
+
+
+def run_scenario(name, args, media_dir, scratch):
+    """Metrics for one scenario: median times / max sizes over --repeat fresh interpreters."""
+    env = dict(os.environ, VIBE_SEGMENT_CACHE_MB="0", VIBE_STILL_CACHE_MB="0", VIBE_AUDIO_CACHE_MB="0",
+               VIBE_STORE=f"sqlite:///{scratch}/suite.db")
+    runs = []
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, __file__, "--once", name, "--media", str(media_dir),
+                              "--size", args.size, "--profile", args.profile, "--engine", args.engine],
+                             env=env, capture_output=True, text=True)
+        if out.returncode:
+            sys.exit(f"{name} failed:\n{out.stderr[-2000:]}")
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {m: (statistics.median if m in ("wall_s", "cpu_s") else max)(r[m] for r in runs) for m in METRICS}
+
+
+def compare(rows, baseline):
+    """Print each scenario against the baseline; returns the regressions."""
+    base, limits = baseline.get("scenarios", {}), dict(THRESHOLDS, **baseline.get("thresholds", {}))
+    regressions = []
+    for name, row in rows.items():
+        ref = base.get(name)
+        cells = []
+        for m in METRICS:
+            if not ref or not ref.get(m):
+                cells.append(f"{m}={row[m]}")
+                continue
+            delta = row[m] / ref[m] - 1
+            flag = "!" if delta > limits[m] else ""
+            if flag: regressions.append((name, m, ref[m], row[m]))
+            cells.append(f"{m}={row[m]} ({delta:+.0%}){flag}")
+        print(f"  {name:<22} " + "  ".join(cells) + ("" if ref else "  (not in baseline)"))
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--content", default=",".join(CONTENTS), help="comma-separated: " + ", ".join(CONTENTS))
+    ap.add_argument("--durations", default=",".join(map(str, DURATIONS)), help="comma-separated seconds")
+    ap.add_argument("--orientations", default=",".join(ORIENTATIONS))
+    ap.add_argument("--size", default="1080x1920", help="output size; landscape swaps it")
+    ap.add_argument("--profile", default="final", help="render profile (final, draft)")
+    ap.add_argument("--engine", default="", help="render engine (default: VIBE_RENDER_ENGINE)")
+    ap.add_argument("--repeat", type=int, default=1, help="runs per scenario")
+    ap.add_argument("--baseline", default=str(BENCH_DIR / "baseline.json"))
+    ap.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    ap.add_argument("--threshold", action="append", default=[], metavar="METRIC=FRACTION",
+                    help="override a regression threshold when saving, e.g. wall_s=0.2")
+    ap.add_argument("--once", help=argparse.SUPPRESS)
+    ap.add_argument("--media", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.once:
+        return run_once(args)
+
+    names = [f"{c}:{d}:{o}" for c, d, o in itertools.product(
+        args.content.split(","), args.durations.split(","), args.orientations.split(","))]
+    for name in names:
+        c, d, o = name.split(":")
+        if c not in CONTENTS or o not in ORIENTATIONS or not d.isdigit():
+            sys.exit(f"Unknown scenario {name}")
+    n_items = max(len(scenario_items(c, int(d))[0]) for c, d, _ in (n.split(":") for n in names))
+    n_tracks = max(scenario_items(n.split(":")[0], 15)[1] for n in names)
+
+    scratch = Path(tempfile.mkdtemp(prefix="vibe-suite-"))
+    try:
+        t0 = time.perf_counter()
+        make_media(scratch / "media", n_items, n_tracks)
+        print(f"  inputs: {n_items} stills/clips, {n_tracks} tracks ({time.perf_counter() - t0:.1f}s)")
+        rows = {}
+        for name in names:
+            rows[name] = run_scenario(name, args, scratch / "media", scratch)
+            print(f"  {name:<22} " + "  ".join(f"{m}={rows[name][m]}" for m in METRICS), flush=True)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    baseline_path = Path(args.baseline)
+    if args.save:
+        thresholds = dict(THRESHOLDS)
+        for t in args.threshold:
+            m, v = t.split("=")
+            if m not in THRESHOLDS: sys.exit(f"Unknown metric {m}")
+            thresholds[m] = float(v)
+        old = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+        baseline = {"machine": {"host": platform.node(), "cpus": os.cpu_count(), "python": platform.python_version(),
+                                "ffmpeg": subprocess.run(["ffmpeg", "-version"], capture_output=True,
+                                                         text=True).stdout.split("\n")[0]},
+                    "settings": {"size": args.size, "profile": args.profile, "engine": args.engine,
+                                 "repeat": args.repeat},
+                    "thresholds": thresholds,
+                    "scenarios": dict(old.get("scenarios", {}), **rows)}
+        baseline_path.write_text(json.dumps(baseline, indent=2) + "\n")
+        print(f"  saved {len(rows)} scenarios to {baseline_path}")
+        return
+    if not baseline_path.exists():
+        sys.exit(f"No baseline at {baseline_path}; run with --save first")
+    baseline = json.loads(baseline_path.read_text())
+    if baseline.get("settings", {}).get("size", args.size) != args.size or \
+            baseline.get("settings", {}).get("profile", args.profile) != args.profile:
+        print(f"  note: baseline was saved with {baseline['settings']}")
+    print(f"  against {baseline_path}:")
+    regressions = compare(rows, baseline)
+    for name, m, ref, now in regressions:
+        print(f"  REGRESSION {name} {m}: {ref} -> {now}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Startup benchmark: cold start to first request, with and without warm-up.
+
+Run:   python bench/startup_bench.py --runs 3 --delay 1.5
+
+Each run starts a fresh `python app.py` and reports:
+
+  ready      spawn until /api/status first answers
+  first      latency of the first /api/chat, sent --delay seconds after
+             ready (a stub model answers instantly, so this is mostly the
+             cost of importing and setting up the SDK on that request)
+  status     worst /api/status latency between ready and the first chat
+
+for three setups: the ffmpeg capability cache warm (the usual restart),
+the cache removed (first start after installing or upgrading ffmpeg),
+and warm-up turned off (VIBE_WARMUP=""), where the first chat imports
+the SDK itself. Medians over --runs.
+"""
+
+import argparse, os, statistics, subprocess, sys, time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+sys.path.insert(0, str(BENCH_DIR))
+
+
+def start_once(env, delay):
+    import httpx
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, str(ROOT / "app.py")], env=env, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{env['PORT']}"
+    try:
+        with httpx.Client(base_url=base, timeout=30) as client:
+            while True:
+                try:
+                    client.get("/api/status"); break
+                except httpx.TransportError:
+                    if proc.poll() is not None: sys.exit("app.py exited during startup")
+                    time.sleep(0.01)
+            ready = time.perf_counter() - t0
+            worst, until = 0.0, time.perf_counter() + delay
+            while time.perf_counter() < until:
+                t = time.perf_counter()
+                client.get("/api/status")
+                worst = max(worst, time.perf_counter() - t)
+                time.sleep(0.05)
+            t = time.perf_counter()
+            reply = client.post("/api/chat", json={"message": f"ideas {t}"}).json()
+            first = time.perf_counter() - t
+            assert reply["source"] == "ai", reply
+            return ready, first, worst
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--delay", type=float, default=1.5, help="seconds between ready and the first chat")
+    args = ap.parse_args()
+
+    import chat_bench
+    stub_port = chat_bench.free_port()
+    chat_bench.serve(chat_bench.stub_app(0.0, 5), stub_port)
+    env = dict(os.environ, ANTHROPIC_BASE_URL=f"http://127.0.0.1:{stub_port}",
+               ANTHROPIC_API_KEY=os.environ.get("ANTHROPIC_API_KEY", "stub"), VIBE_GC_INTERVAL="0")
+    caps_file = ROOT / "cache" / "ffmpeg-capabilities.json"
+    setups = [("caps cached", {}, False), ("caps probed", {}, True), ("no warm-up", {"VIBE_WARMUP": ""}, False)]
+    print(f"  {args.runs} runs each, first chat {args.delay}s after ready")
+    for name, extra, cold in setups:
+        results = []
+        for _ in range(args.runs):
+            if cold: caps_file.unlink(missing_ok=True)
+            results.append(start_once(dict(env, PORT=str(chat_bench.free_port()), **extra), args.delay))
+        ready, first, worst = (statistics.median(r[i] for r in results) for i in range(3))
+        print(f"  {name:<12} ready={ready * 1000:7.1f}ms  first chat={first * 1000:7.1f}ms  "
+              f"status<= {worst * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
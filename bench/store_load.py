@@ -0,0 +1,79 @@
+"""
+Project store load test: per-request latency as the store grows.
+
+Run:   python bench/store_load.py --projects 50000 --checkpoints 100,1000,10000,50000
+
+Projects (each with a handful of media items and an audio track) are bulk
+inserted into a fresh SQLite store, and at every checkpoint the API handlers
+that hit the store are driven through the ASGI app in-process: project reads,
+media edits, audio track edits and volume changes. p50/p99 should stay
+flat from the first checkpoint to the last.
+"""
+
+import argparse, logging, os, random, statistics, sys, tempfile, time, uuid
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+
+def make_project(pid, n_media):
+    media = [{"id": f"m{i}", "type": "image", "filename": f"{i}.jpg", "path": f"/nonexistent/{i}.jpg",
+              "url": "", "order": i, "trim_start": 0, "trim_end": None, "caption": "", "custom_duration": None}
+             for i in range(n_media)]
+    return {"id": pid, "category": "travel", "audio_vibe": "energetic", "target_duration": 30,
+            "media": media, "audio_tracks": [{"id": "a0", "type": "audio", "path": "", "role": "Audio 1", "volume": 50}],
+            "audio_file": None, "video_volume": 100, "status": "draft", "created": ""}
+
+
+def measure(client, pids, requests):
+    ops = {
+        "get project": lambda pid: client.get(f"/api/project/{pid}"),
+        "update media": lambda pid: client.put(f"/api/project/{pid}/media/m2", json={"caption": uuid.uuid4().hex[:6]}),
+        "update audio": lambda pid: client.put(f"/api/project/{pid}/audio/a0", json={"volume": random.randint(0, 100)}),
+        "set volume": lambda pid: client.put(f"/api/project/{pid}/video-volume", json={"volume": 80}),
+    }
+    out = {}
+    for name, op in ops.items():
+        lat = []
+        for _ in range(requests):
+            t0 = time.perf_counter()
+            r = op(random.choice(pids))
+            lat.append((time.perf_counter() - t0) * 1000)
+            assert r.status_code == 200, r.text
+        lat.sort()
+        out[name] = (statistics.median(lat), lat[int(len(lat) * 0.99) - 1])
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--projects", type=int, default=20000)
+    ap.add_argument("--checkpoints", default="100,1000,10000,20000")
+    ap.add_argument("--media", type=int, default=8, help="media items per project")
+    ap.add_argument("--requests", type=int, default=300, help="requests per operation per checkpoint")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="vibe-store-")
+    os.environ["VIBE_STORE"] = f"sqlite:///{tmp}/bench.db"
+    import app
+    from fastapi.testclient import TestClient
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    client = TestClient(app.app)
+
+    pids = []
+    for cp in sorted(int(c) for c in args.checkpoints.split(",")):
+        t0 = time.perf_counter()
+        while len(pids) < min(cp, args.projects):
+            pid = f"p{len(pids):07d}"
+            app.projects.create(make_project(pid, args.media))
+            pids.append(pid)
+        fill = time.perf_counter() - t0
+        print(f"  {len(pids):>7} projects (filled in {fill:5.1f}s)")
+        for name, (p50, p99) in measure(client, pids, args.requests).items():
+            print(f"      {name:<14} p50={p50:6.2f}ms  p99={p99:6.2f}ms")
+    print(f"  db size: {os.path.getsize(f'{tmp}/bench.db') / 1e6:.1f}MB ({tmp})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Deterministic synthetic media for the render benchmarks.
+Everything is generated locally with ffmpeg's lavfi sources (testsrc2/sine),
+so two runs on the same box see byte-identical inputs.
+"""
+
+import subprocess
+from pathlib import Path
+
+
+def _ffmpeg(args):
+    subprocess.run(["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"] + args, check=True)
+
+
+def make_image(path, size="1600x1200", seed=0):
+    """A single still frame from testsrc2, offset by `seed` seconds."""
+    _ffmpeg(["-f", "lavfi", "-i", f"testsrc2=size={size}:rate=1", "-ss", str(seed),
+             "-frames:v", "1", str(path)])
+    return str(path)
+
+
+def make_clip(path, seconds=8, size="1280x720", fps=30, audio=True, freq=440):
+    """An H.264 clip with an optional sine-wave AAC track."""
+    args = ["-f", "lavfi", "-i", f"testsrc2=size={size}:rate={fps}"]
+    if audio:
+        args += ["-f", "lavfi", "-i", f"sine=frequency={freq}:sample_rate=44100"]
+    args += ["-t", str(seconds), "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p"]
+    args += ["-c:a", "aac"] if audio else ["-an"]
+    _ffmpeg(args + [str(path)])
+    return str(path)
+
+
+def make_audio(path, seconds=30, freq=220):
+    """A stereo AAC music stand-in."""
+    _ffmpeg(["-f", "lavfi", "-i", f"sine=frequency={freq}:sample_rate=44100", "-ac", "2",
+             "-t", str(seconds), "-c:a", "aac", str(path)])
+    return str(path)
+
+
+def media_item(fid, path, mtype, order):
+    """A project media dict shaped like the ones upload_media creates."""
+    return {"id": fid, "type": mtype, "filename": Path(path).name, "path": str(path),
+            "url": "", "order": order, "trim_start": 0, "trim_end": None,
+            "caption": "", "custom_duration": None}
@@ -0,0 +1,82 @@
+"""
+Worker scaling benchmark: shared-queue throughput against worker count.
+
+Run:   python bench/worker_bench.py --workers 1,2,4 --jobs 8
+       python bench/worker_bench.py --workers 1,2,4,8 --threads 2 --duration 15
+
+A throwaway store gets --jobs synthetic projects (render_bench's mix of
+stills and clips). For each worker count, that many `python app.py worker`
+processes are started against it (one job slot and --threads ffmpeg threads
+each, caches off), every project is queued at once, and the wall time until
+the last job finishes gives jobs/minute. On a box with enough cores for
+workers x threads, the speedup should track the worker count.
+"""
+
+import argparse, asyncio, os, shutil, subprocess, sys, tempfile, time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+sys.path.insert(0, str(BENCH_DIR))
+
+
+async def drain(app, pids, body):
+    """Queue a render for every project and wait until all have finished."""
+    jids = [app.submit_render_job(pid, dict(body))[0]["id"] for pid in pids]
+    while True:
+        app.poll_jobs()
+        states = [app.jobs[j]["status"] for j in jids]
+        if all(s not in app.JOB_ACTIVE for s in states):
+            failed = [app.jobs[j]["error"] for j in jids if app.jobs[j]["status"] != "complete"]
+            if failed: sys.exit(f"{len(failed)} jobs failed: {failed[0]}")
+            return [app.jobs[j]["result"]["filename"] for j in jids]
+        await asyncio.sleep(0.2)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    ap.add_argument("--jobs", type=int, default=8, help="projects rendered per round")
+    ap.add_argument("--items", type=int, default=4)
+    ap.add_argument("--duration", type=int, default=10)
+    ap.add_argument("--threads", type=int, default=1, help="ffmpeg threads per worker")
+    ap.add_argument("--size", default="540x960")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="vibe-workers-")
+    env = dict(os.environ, VIBE_JOB_QUEUE="shared", VIBE_STORE=f"sqlite:///{tmp}/bench.db",
+               VIBE_SEGMENT_CACHE_MB="0", VIBE_STILL_CACHE_MB="0", VIBE_AUDIO_CACHE_MB="0",
+               VIBE_JOB_CONCURRENCY="1", VIBE_RENDER_WORKERS="1", VIBE_FFMPEG_THREADS=str(args.threads))
+    os.environ.update(env)
+    import app, render_bench
+    pids = [render_bench.build_project(app, args.items, args.duration) for _ in range(args.jobs)]
+    w, h = (int(v) for v in args.size.split("x"))
+    body = {"duration": args.duration, "width": w, "height": h}
+    print(f"  {args.jobs} jobs of {args.items} items / {args.duration}s at {args.size}, "
+          f"{args.threads} ffmpeg thread(s) per worker, {os.cpu_count()} cpus")
+
+    base = None
+    try:
+        for n in (int(v) for v in args.workers.split(",")):
+            procs = [subprocess.Popen([sys.executable, str(BENCH_DIR.parent / "app.py"), "worker"], env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for _ in range(n)]
+            try:
+                while len(app.job_queue.workers()) < n: time.sleep(0.1)  # all heartbeating
+                t0 = time.perf_counter()
+                outputs = asyncio.run(drain(app, pids, body))
+                wall = time.perf_counter() - t0
+            finally:
+                for p in procs: p.terminate()
+                for p in procs: p.wait()
+            for fn in outputs: (app.OUTPUT_DIR / fn).unlink(missing_ok=True)
+            rate = args.jobs / wall * 60
+            base = base or rate
+            print(f"  workers={n:<3} wall={wall:7.2f}s  {rate:6.1f} jobs/min  speedup={rate / base:.2f}x  "
+                  f"efficiency={rate / base / n:.0%}")
+    finally:
+        for pid in pids: shutil.rmtree(app.UPLOAD_DIR / pid, ignore_errors=True)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
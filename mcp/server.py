@@ -24,11 +24,16 @@ import json
 import sys
 import os
 import asyncio
+import threading
 
 # Add parent dir to path so we can reference the app
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 VIBE_STUDIO_URL = os.environ.get("VIBE_STUDIO_URL", "http://localhost:8000")
+# How long vibe_generate_video keeps polling its render job before handing
+# back the job ID for the client to check later with vibe_job_status.
+RENDER_WAIT_SECONDS = int(os.environ.get("VIBE_MCP_RENDER_WAIT", 1800))
+POLL_INTERVAL = 2
 
 try:
     import httpx
@@ -38,19 +43,27 @@ except ImportError:
 
 
 # ── MCP Protocol (simplified stdio-based) ─────────────────────────────────────
-# This implements the MCP protocol over stdio for Claude Desktop
-
-def send_response(id, result):
+# This implements the MCP protocol over stdio for Claude Desktop. One event
+# loop runs for the life of the server: messages are read asynchronously,
+# every tools/call runs as its own task on a shared keep-alive HTTP client,
+# and each response goes out whole, tagged with its request id, as soon as
+# it is ready. A long vibe_generate_video doesn't hold up other calls.
+
+_out = None  # stdout as a write()/drain() stream, set up by serve()
+
+async def _write(payload):
+    body = json.dumps(payload).encode()
+    # One write() per message, so concurrent responses never interleave on
+    # stdout; drain() then waits for the pipe without blocking the loop.
+    _out.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    await _out.drain()
+
+async def send_response(id, result):
     """Send a JSON-RPC response to stdout."""
-    msg = json.dumps({"jsonrpc": "2.0", "id": id, "result": result})
-    sys.stdout.write(f"Content-Length: {len(msg)}\r\n\r\n{msg}")
-    sys.stdout.flush()
-
-def send_error(id, code, message):
-    msg = json.dumps({"jsonrpc": "2.0", "id": id, "error": {"code": code, "message": message}})
-    sys.stdout.write(f"Content-Length: {len(msg)}\r\n\r\n{msg}")
-    sys.stdout.flush()
+    await _write({"jsonrpc": "2.0", "id": id, "result": result})
 
+async def send_error(id, code, message):
+    await _write({"jsonrpc": "2.0", "id": id, "error": {"code": code, "message": message}})
 
 TOOLS = [
     {
@@ -105,7 +118,7 @@ TOOLS = [
     },
     {
         "name": "vibe_generate_video",
-        "description": "Generate the final MP4 video from the project's media files using FFmpeg. Returns a download URL.",
+        "description": "Generate the final MP4 video from the project's media files using FFmpeg. Queues a render job and waits for it; returns a download URL, or the job ID if the render is still running.",
         "inputSchema": {
             "type": "object",
             "properties": {
@@ -113,10 +126,41 @@ TOOLS = [
                 "duration": {"type": "integer", "description": "Duration in seconds"},
                 "width": {"type": "integer", "default": 1080},
                 "height": {"type": "integer", "default": 1920},
+                "priority": {"type": "string", "enum": ["high", "normal", "low"], "default": "normal"},
+                "engine": {"type": "string", "enum": ["segments", "single_pass"],
+                           "description": "Render engine: per-clip segments + concat, or one single-pass ffmpeg graph"},
+                "renditions": {"type": "array", "items": {"type": "string", "enum": ["portrait", "landscape", "square"]},
+                               "description": "Render several aspect ratios in one pass instead of width/height"},
+                "draft": {"type": "boolean", "default": False,
+                          "description": "Fast low-resolution preview for checking order and timing; render again without it for the final video"},
+                "hls": {"type": "boolean", "default": False,
+                        "description": "Also package the video as HLS (fMP4 segments + .m3u8 playlist) for streaming"},
             },
             "required": ["project_id"]
         }
     },
+    {
+        "name": "vibe_job_status",
+        "description": "Check a render job started by vibe_generate_video.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "job_id": {"type": "string", "description": "Job ID"}
+            },
+            "required": ["job_id"]
+        }
+    },
+    {
+        "name": "vibe_cancel_job",
+        "description": "Cancel a queued or running render job.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "job_id": {"type": "string", "description": "Job ID"}
+            },
+            "required": ["job_id"]
+        }
+    },
     {
         "name": "vibe_list_categories",
         "description": "List all available video categories and audio vibes.",
@@ -129,7 +173,7 @@ TOOLS = [
     },
     {
         "name": "vibe_trim_video",
-        "description": "Trim a video clip in a project.",
+        "description": "Trim a video clip in a project (non-destructive: the original is kept and the trim applies at render time).",
         "inputSchema": {
             "type": "object",
             "properties": {
@@ -169,144 +213,249 @@ TOOLS = [
 ]
 
 
-async def handle_tool_call(name, arguments):
+def job_result(job):
+    """Flatten a finished render job into the tool result."""
+    data = job.get("result") or {k: job.get(k) for k in ("status", "error")}
+    data = dict(data, job_id=job["id"])
+    for d in [data] + data.get("renditions", []):
+        if "download_url" in d: d["full_download_url"] = f"{VIBE_STUDIO_URL}{d['download_url']}"
+        if "hls_url" in d: d["full_hls_url"] = f"{VIBE_STUDIO_URL}{d['hls_url']}"
+    return data
+
+
+async def wait_for_job(client, job):
+    """Poll a render job until it finishes or RENDER_WAIT_SECONDS pass."""
+    deadline = asyncio.get_running_loop().time() + RENDER_WAIT_SECONDS
+    while job["status"] in ("queued", "running"):
+        if asyncio.get_running_loop().time() > deadline:
+            return {"job_id": job["id"], "status": job["status"],
+                    "note": "Render still in progress. Check it with vibe_job_status."}
+        await asyncio.sleep(POLL_INTERVAL)
+        job = (await client.get(f"/api/jobs/{job['id']}")).json()
+    return job_result(job)
+
+
+async def handle_tool_call(client, name, arguments):
     """Execute a tool call against the Vibe Studio API."""
-    async with httpx.AsyncClient(base_url=VIBE_STUDIO_URL, timeout=120) as client:
-        try:
-            if name == "vibe_create_project":
-                r = await client.post("/api/project/create", data={
-                    "category": arguments.get("category", "motivational"),
-                    "audio_vibe": arguments.get("audio_vibe", "energetic"),
-                    "duration": arguments.get("duration", 30),
-                })
-                return r.json()
-
-            elif name == "vibe_get_project":
-                r = await client.get(f"/api/project/{arguments['project_id']}")
-                return r.json()
-
-            elif name == "vibe_update_project":
-                pid = arguments.pop("project_id")
-                r = await client.put(f"/api/project/{pid}", json=arguments)
-                return r.json()
-
-            elif name == "vibe_generate_video":
-                pid = arguments.pop("project_id")
-                r = await client.post(f"/api/project/{pid}/generate", json=arguments)
-                data = r.json()
-                if "download_url" in data:
-                    data["full_download_url"] = f"{VIBE_STUDIO_URL}{data['download_url']}"
-                return data
-
-            elif name == "vibe_list_categories":
-                cats = (await client.get("/api/categories")).json()
-                vibes = (await client.get("/api/audio-vibes")).json()
-                return {"categories": cats, "audio_vibes": vibes}
-
-            elif name == "vibe_status":
-                r = await client.get("/api/status")
-                return r.json()
-
-            elif name == "vibe_trim_video":
-                pid = arguments["project_id"]
-                mid = arguments["media_id"]
-                r = await client.post(f"/api/project/{pid}/trim/{mid}", json={
-                    "start": arguments.get("start", 0),
-                    "end": arguments.get("end"),
-                })
-                return r.json()
-
-            elif name == "vibe_update_caption":
-                pid = arguments["project_id"]
-                mid = arguments["media_id"]
-                r = await client.put(f"/api/project/{pid}/media/{mid}", json={
-                    "caption": arguments["caption"]
-                })
-                return r.json()
-
-            elif name == "vibe_reorder_media":
-                pid = arguments["project_id"]
-                r = await client.put(f"/api/project/{pid}/reorder", json={
-                    "order": arguments["order"]
-                })
-                return r.json()
-
-            else:
-                return {"error": f"Unknown tool: {name}"}
-
-        except httpx.ConnectError:
-            return {"error": "Cannot connect to Vibe Studio. Make sure it's running: python app.py"}
-        except Exception as e:
-            return {"error": str(e)}
-
-
-def read_message():
-    """Read a JSON-RPC message from stdin."""
+    try:
+        if name == "vibe_create_project":
+            r = await client.post("/api/project/create", data={
+                "category": arguments.get("category", "motivational"),
+                "audio_vibe": arguments.get("audio_vibe", "energetic"),
+                "duration": arguments.get("duration", 30),
+            })
+            return r.json()
+
+        elif name == "vibe_get_project":
+            r = await client.get(f"/api/project/{arguments['project_id']}")
+            return r.json()
+
+        elif name == "vibe_update_project":
+            pid = arguments.pop("project_id")
+            r = await client.put(f"/api/project/{pid}", json=arguments)
+            return r.json()
+
+        elif name == "vibe_generate_video":
+            pid = arguments.pop("project_id")
+            r = await client.post(f"/api/project/{pid}/generate", json=arguments)
+            if r.status_code != 202:  # 429/503 say when to try again
+                retry = r.headers.get("retry-after")
+                return {**r.json(), **({"retry_after_s": int(retry)} if retry else {})}
+            return await wait_for_job(client, r.json())
+
+        elif name == "vibe_job_status":
+            r = await client.get(f"/api/jobs/{arguments['job_id']}")
+            job = r.json()
+            if r.status_code != 200 or job["status"] in ("queued", "running"):
+                return job
+            return job_result(job)
+
+        elif name == "vibe_cancel_job":
+            r = await client.post(f"/api/jobs/{arguments['job_id']}/cancel")
+            return r.json()
+
+        elif name == "vibe_list_categories":
+            cats = (await client.get("/api/categories")).json()
+            vibes = (await client.get("/api/audio-vibes")).json()
+            return {"categories": cats, "audio_vibes": vibes}
+
+        elif name == "vibe_status":
+            r = await client.get("/api/status")
+            return r.json()
+
+        elif name == "vibe_trim_video":
+            pid = arguments["project_id"]
+            mid = arguments["media_id"]
+            r = await client.post(f"/api/project/{pid}/trim/{mid}", json={
+                "start": arguments.get("start", 0),
+                "end": arguments.get("end"),
+            })
+            return r.json()
+
+        elif name == "vibe_update_caption":
+            pid = arguments["project_id"]
+            mid = arguments["media_id"]
+            r = await client.put(f"/api/project/{pid}/media/{mid}", json={
+                "caption": arguments["caption"]
+            })
+            return r.json()
+
+        elif name == "vibe_reorder_media":
+            pid = arguments["project_id"]
+            r = await client.put(f"/api/project/{pid}/reorder", json={
+                "order": arguments["order"]
+            })
+            return r.json()
+
+        else:
+            return {"error": f"Unknown tool: {name}"}
+
+    except httpx.ConnectError:
+        return {"error": "Cannot connect to Vibe Studio. Make sure it's running: python app.py"}
+    except Exception as e:
+        return {"error": str(e)}
+
+
+async def open_stdin():
+    """An asyncio StreamReader over stdin; a reader thread feeds it where
+    the loop can't watch a pipe (Windows)."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin.buffer)
+    except (NotImplementedError, ValueError, OSError):
+        def pump():
+            for chunk in iter(lambda: sys.stdin.buffer.read1(65536), b""):
+                loop.call_soon_threadsafe(reader.feed_data, chunk)
+            loop.call_soon_threadsafe(reader.feed_eof)
+        threading.Thread(target=pump, daemon=True).start()
+    return reader
+
+
+class ThreadWriter:
+    """write()/drain() over stdout on a worker thread, for where the loop
+    can't watch a pipe (Windows, or stdout redirected to a file)."""
+
+    def __init__(self, stream):
+        self.stream, self.pending, self.lock = stream, [], asyncio.Lock()
+
+    def write(self, data):
+        self.pending.append(data)
+
+    async def drain(self):
+        async with self.lock:
+            data, self.pending = b"".join(self.pending), []
+            if data: await asyncio.to_thread(self._put, data)
+
+    def _put(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+
+
+async def open_stdout():
+    """An asyncio StreamWriter over stdout, or a ThreadWriter where that
+    isn't possible."""
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout.buffer)
+    except (NotImplementedError, ValueError, OSError):
+        return ThreadWriter(sys.stdout.buffer)
+    return asyncio.StreamWriter(transport, protocol, None, loop)
+
+
+async def read_message(reader):
+    """Read a JSON-RPC message; None at end of input."""
     headers = {}
     while True:
-        line = sys.stdin.readline()
-        if not line or line.strip() == "":
-            break
+        line = await reader.readline()
+        if not line:
+            return None
+        line = line.decode().strip()
+        if not line:
+            if headers: break
+            continue
         if ":" in line:
             k, v = line.split(":", 1)
-            headers[k.strip()] = v.strip()
-
-    length = int(headers.get("Content-Length", 0))
+            headers[k.strip().lower()] = v.strip()
+    length = int(headers.get("content-length", 0))
     if length == 0:
-        return None
-    body = sys.stdin.read(length)
-    return json.loads(body)
+        return {}
+    return json.loads(await reader.readexactly(length))
+
+
+async def call_tool(client, id, params):
+    try:
+        result = await handle_tool_call(client, params.get("name"), params.get("arguments") or {})
+    except asyncio.CancelledError:
+        return  # cancelled by the client, which expects no response
+    await send_response(id, {"content": [{"type": "text", "text": json.dumps(result, indent=2)}]})
+
+
+async def serve():
+    global _out
+    reader = await open_stdin()
+    _out = await open_stdout()
+    in_flight = {}  # request id -> task
+    limits = httpx.Limits(max_connections=20, max_keepalive_connections=10)
+    async with httpx.AsyncClient(base_url=VIBE_STUDIO_URL, timeout=120, limits=limits) as client:
+        while True:
+            id = None
+            try:
+                msg = await read_message(reader)
+                if msg is None:
+                    break
+
+                method = msg.get("method")
+                id = msg.get("id")
+                params = msg.get("params", {})
+
+                if method == "initialize":
+                    await send_response(id, {
+                        "protocolVersion": "2024-11-05",
+                        "capabilities": {"tools": {"listChanged": False}},
+                        "serverInfo": {"name": "vibe-studio", "version": "2.0.0"}
+                    })
+
+                elif method == "notifications/initialized":
+                    pass  # No response needed
+
+                elif method == "notifications/cancelled":
+                    task = in_flight.get(params.get("requestId"))
+                    if task: task.cancel()
+
+                elif method == "tools/list":
+                    await send_response(id, {"tools": TOOLS})
+
+                elif method == "tools/call":
+                    task = in_flight[id] = asyncio.create_task(call_tool(client, id, params))
+                    task.add_done_callback(lambda _, id=id: in_flight.pop(id, None))
+
+                elif method == "shutdown":
+                    await asyncio.gather(*in_flight.values(), return_exceptions=True)
+                    await send_response(id, None)
+                    break
+
+                else:
+                    if id:
+                        await send_error(id, -32601, f"Method not found: {method}")
+
+            except Exception as e:
+                sys.stderr.write(f"Error: {e}\n")
+                sys.stderr.flush()
+                if id:
+                    await send_error(id, -32603, str(e))
+        # stdin closed: let calls already running finish and answer
+        await asyncio.gather(*in_flight.values(), return_exceptions=True)
 
 
 def main():
     """Main MCP server loop (stdio transport)."""
     sys.stderr.write("Vibe Studio MCP Server starting...\n")
     sys.stderr.flush()
-
-    while True:
-        try:
-            msg = read_message()
-            if msg is None:
-                break
-
-            method = msg.get("method")
-            id = msg.get("id")
-            params = msg.get("params", {})
-
-            if method == "initialize":
-                send_response(id, {
-                    "protocolVersion": "2024-11-05",
-                    "capabilities": {"tools": {"listChanged": False}},
-                    "serverInfo": {"name": "vibe-studio", "version": "2.0.0"}
-                })
-
-            elif method == "notifications/initialized":
-                pass  # No response needed
-
-            elif method == "tools/list":
-                send_response(id, {"tools": TOOLS})
-
-            elif method == "tools/call":
-                tool_name = params.get("name")
-                arguments = params.get("arguments", {})
-                result = asyncio.run(handle_tool_call(tool_name, arguments))
-                send_response(id, {
-                    "content": [{"type": "text", "text": json.dumps(result, indent=2)}]
-                })
-
-            elif method == "shutdown":
-                send_response(id, None)
-                break
-
-            else:
-                if id:
-                    send_error(id, -32601, f"Method not found: {method}")
-
-        except Exception as e:
-            sys.stderr.write(f"Error: {e}\n")
-            sys.stderr.flush()
-            if 'id' in dir() and id:
-                send_error(id, -32603, str(e))
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
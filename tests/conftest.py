@@ -0,0 +1,94 @@
+"""
+Shared fixtures. Run with `python -m pytest tests`.
+
+The app is imported once for the whole session, on a throwaway SQLite
+store and with the background GC and warm-up off. There is one TestClient
+(one app lifespan and event loop) per session, as under uvicorn: the
+app's queues and locks belong to the loop that first uses them.
+"""
+
+import asyncio, os, shutil, subprocess, sys, tempfile, threading, time, uuid
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("VIBE_STORE", f"sqlite:///{tempfile.mkdtemp(prefix='vibe-test-')}/test.db")
+os.environ.update(VIBE_GC_INTERVAL="0", VIBE_WARMUP="")
+
+import app as vibe
+
+needs_ffmpeg = pytest.mark.skipif(not shutil.which("ffmpeg"), reason="ffmpeg is not installed")
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    with TestClient(vibe.app) as c:
+        yield c
+
+
+def wait_for_job(client, jid, *statuses):
+    """Poll a job until it reaches one of `statuses`; returns it."""
+    for _ in range(500):
+        job = client.get(f"/api/jobs/{jid}").json()
+        if job["status"] in statuses: return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {jid} stuck in {job['status']}")
+
+
+def _ffmpeg(*args):
+    subprocess.run(["ffmpeg", "-y", "-v", "error", *args], check=True)
+
+
+@pytest.fixture
+def make_project():
+    """make_project(images, clips, real=False) -> pid. Without `real` the
+    media items are placeholders: enough for the API, not for a render."""
+    made = []
+
+    def make(images=1, clips=0, real=False):
+        pid = f"test{uuid.uuid4().hex[:6]}"
+        pdir = vibe.UPLOAD_DIR / pid
+        pdir.mkdir(parents=True, exist_ok=True)
+        made.append(pid)
+        media = []
+        for i in range(images + clips):
+            kind = "image" if i < images else "video"
+            path = pdir / (f"img{i}.jpg" if kind == "image" else f"clip{i}.mp4")
+            if not real:
+                path.write_bytes(b"")
+            elif kind == "image":
+                _ffmpeg("-f", "lavfi", "-i", "testsrc2=size=640x480:rate=1", "-ss", str(i), "-frames:v", "1", str(path))
+            else:
+                _ffmpeg("-f", "lavfi", "-i", "testsrc2=size=640x360:rate=30",
+                        "-f", "lavfi", "-i", f"sine=frequency={300 + 40 * i}:sample_rate=44100",
+                        "-t", "4", "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", str(path))
+            media.append({"id": f"m{i}", "type": kind, "filename": path.name, "path": str(path), "url": "",
+                          "order": i, "trim_start": 0, "trim_end": None, "caption": "", "custom_duration": None})
+        vibe.projects.create({
+            "id": pid, "category": "travel", "audio_vibe": "energetic", "target_duration": 4,
+            "media": media, "audio_tracks": [], "audio_file": None, "video_volume": 100,
+            "status": "draft", "created": "",
+        })
+        return pid
+
+    yield make
+    for pid in made:
+        shutil.rmtree(vibe.UPLOAD_DIR / pid, ignore_errors=True)
+
+
+@pytest.fixture
+def stub_render(monkeypatch):
+    """render_project replaced by one that runs until `release` is set."""
+    release, started = threading.Event(), []
+
+    async def render(pid, body):
+        started.append(pid)
+        while not release.is_set(): await asyncio.sleep(0.01)
+        return {"filename": f"{pid}.mp4"}
+
+    monkeypatch.setattr(vibe, "render_project", render)
+    monkeypatch.setattr(vibe, "HAS_FFMPEG", True)
+    yield release, started
+    release.set()
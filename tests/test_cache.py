@@ -0,0 +1,41 @@
+"""
+DiskCache shared between processes. Two caches on one directory stand in
+for two processes: flock locks of separate open files conflict either way.
+"""
+
+import os
+
+import pytest
+
+from app import DiskCache
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="pins are per process without flock")
+
+
+def put(cache, tmp_path, key, size=100):
+    src = tmp_path / f"src-{key}"
+    src.write_bytes(b"x" * size)
+    return cache.put(key, src)
+
+
+def test_eviction_skips_entries_pinned_by_another_process(tmp_path):
+    root = tmp_path / "cache"
+    a, b = DiskCache("t", root, 250), DiskCache("t", root, 250)
+    a.pin("k1")
+    put(a, tmp_path, "k1")
+    assert b.get("k1")  # b sees a's entry
+    put(b, tmp_path, "k2")
+    put(b, tmp_path, "k3")  # over the limit: k1 is the oldest, but a holds it
+    assert (root / "k1").exists() and not (root / "k2").exists()
+    assert b.total <= 250
+    a.unpin("k1")
+    put(b, tmp_path, "k4")
+    assert not (root / "k1").exists()
+
+
+def test_limit_counts_every_process(tmp_path):
+    root = tmp_path / "cache"
+    caches = [DiskCache("t", root, 250) for _ in range(3)]
+    for i, c in enumerate(caches * 2):
+        put(c, tmp_path, f"k{i}")
+    assert sum(f.stat().st_size for f in root.iterdir()) <= 250
@@ -0,0 +1,24 @@
+"""
+run_ffmpeg. Needs ffmpeg on PATH.
+"""
+
+from functools import partial
+
+from conftest import needs_ffmpeg, vibe
+
+
+@needs_ffmpeg
+def test_failing_feed_stops_ffmpeg_and_is_counted(client):
+    async def feed(stdin):
+        stdin.write(bytes(64 * 64 * 3 // 2))  # one frame, then the frame source breaks
+        await stdin.drain()
+        raise ValueError("bad frame")
+
+    cmd = ["ffmpeg", "-y", "-f", "rawvideo", "-pix_fmt", "yuv420p", "-s", "64x64", "-r", "25",
+           "-i", "pipe:0", "-f", "null", "-"]
+    runs = dict(vibe.FFMPEG_RUNS.values)
+    result = client.portal.call(partial(vibe.run_ffmpeg, cmd, timeout=30, stage="segment", feed=feed))
+    assert result["success"] is False and "bad frame" in result["error"]
+    assert vibe.FFMPEG_IN_FLIGHT.values.get((), 0) == 0
+    key = ("segment", "feed_error")
+    assert vibe.FFMPEG_RUNS.values.get(key, 0) == runs.get(key, 0) + 1
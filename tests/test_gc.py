@@ -0,0 +1,67 @@
+"""
+Storage GC: retention windows and files that something still references.
+Every storage area is pointed at a temporary directory first.
+"""
+
+import os, time
+
+import pytest
+
+from conftest import vibe
+
+DAY = 86400
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    for name in ("UPLOAD_DIR", "OUTPUT_DIR", "PARTIAL_UPLOAD_DIR", "SCRATCH_DIR"):
+        monkeypatch.setattr(vibe, name, tmp_path / name.lower())
+        (tmp_path / name.lower()).mkdir()
+    monkeypatch.setattr(vibe, "SCRATCH_TMPFS", None)
+    return tmp_path
+
+
+def aged(path, seconds, data=b"x" * 1000):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if not path.exists(): path.write_bytes(data)
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+    return path
+
+
+def test_uploads_go_once_unreferenced_and_old(client, storage, make_project):
+    pid = make_project(images=1)
+    used = aged(vibe.UPLOAD_DIR / pid / "img0.jpg", 30 * DAY)
+    stale = aged(vibe.UPLOAD_DIR / pid / "removed.jpg", vibe.GC_UPLOAD_SECONDS + 60)
+    fresh = aged(vibe.UPLOAD_DIR / pid / "just-uploaded.jpg", 60)
+    report = client.post("/api/admin/gc", json={}).json()
+    assert used.exists() and fresh.exists() and not stale.exists()
+    assert report["reclaimed"]["uploads"] == 1000
+
+
+def test_outputs_kept_while_a_project_or_job_points_at_them(client, storage, make_project):
+    pid = make_project()
+    old = vibe.GC_OUTPUT_SECONDS + 60
+    shown = aged(vibe.OUTPUT_DIR / "vibe_shown.mp4", old)
+    vibe.projects.update(pid, output="/static/outputs/vibe_shown.mp4")
+    orphan = aged(vibe.OUTPUT_DIR / "vibe_orphan.mp4", old)
+    recent = aged(vibe.OUTPUT_DIR / "vibe_recent.mp4", vibe.GC_MIN_OUTPUT_SECONDS - 60)
+
+    dry = client.post("/api/admin/gc", json={"dry_run": True}).json()
+    assert dry["reclaimed"]["outputs"] == 1000 and orphan.exists()
+    client.post("/api/admin/gc", json={})
+    assert shown.exists() and recent.exists() and not orphan.exists()
+
+
+def test_scratch_of_dead_processes_only(client, storage):
+    host = vibe.SCRATCH_DIR / "vibe-scratch" / vibe.SCRATCH_HOST
+    live = vibe.new_scratch("test")
+    dead = host / "999999999-render-abcdef"  # beyond any pid_max
+    dead.mkdir(parents=True)
+    foreign = host / "not-ours"
+    foreign.mkdir()
+    try:
+        client.post("/api/admin/gc", json={})
+        assert live.exists() and foreign.exists() and not dead.exists()
+    finally:
+        vibe.drop_scratch(live)
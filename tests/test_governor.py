@@ -0,0 +1,40 @@
+"""
+Admission control: 429/503 with Retry-After instead of queueing work the
+server can't get to. Renders are stubbed, so none of this needs ffmpeg.
+"""
+
+from conftest import vibe, wait_for_job
+
+
+def test_full_render_queue_answers_429(client, make_project, stub_render, monkeypatch):
+    release, _ = stub_render
+    monkeypatch.setattr(vibe, "MAX_QUEUED_JOBS", 1)
+    pids = [make_project() for _ in range(vibe.JOB_CONCURRENCY + 2)]
+    ids = [client.post(f"/api/project/{pid}/generate", json={}).json()["id"] for pid in pids[:-1]]
+    wait_for_job(client, ids[0], "running")
+
+    r = client.post(f"/api/project/{pids[-1]}/generate", json={})
+    assert r.status_code == 429 and 1 <= int(r.headers["Retry-After"]) <= 600
+    r = client.post(f"/api/project/{pids[-2]}/generate", json={})  # joining its own queued job still works
+    assert r.status_code == 202 and r.json()["deduplicated"]
+    release.set()
+    for jid in ids: wait_for_job(client, jid, "complete")
+    assert client.post(f"/api/project/{pids[-1]}/generate", json={}).status_code == 202
+
+
+def test_busy_trims_answer_503(client, make_project, monkeypatch):
+    monkeypatch.setattr(vibe, "HAS_FFMPEG", True)
+    pid = make_project(images=0, clips=1)
+    with vibe.projects.edit(pid) as project:
+        project["media"][0]["trim_start"] = 1.0
+    limit = vibe.governor.limits["trim"]
+    monkeypatch.setitem(vibe.governor.admitted, "trim", (1 + vibe.GOVERNOR_QUEUE) * limit)
+    r = client.get(f"/api/project/{pid}/media/m0/clip")
+    assert r.status_code == 503 and int(r.headers["Retry-After"]) >= 1
+
+
+def test_overloaded_host_answers_503(client, make_project, stub_render, monkeypatch):
+    monkeypatch.setattr(vibe, "MAX_LOAD", 1.0)
+    monkeypatch.setattr(vibe.governor, "load", lambda: 4.0)
+    r = client.post(f"/api/project/{make_project()}/generate", json={})
+    assert r.status_code == 503 and r.headers["Retry-After"] == "15"
@@ -0,0 +1,81 @@
+"""
+Render jobs: deduplication, cancelling and the shared queue's leases. The
+renders are stubbed, so none of this needs ffmpeg.
+"""
+
+import json
+
+import pytest
+
+from conftest import vibe, wait_for_job
+
+
+def test_generating_twice_joins_the_running_job(client, make_project, stub_render):
+    release, _ = stub_render
+    pid = make_project()
+    first = client.post(f"/api/project/{pid}/generate", json={}).json()
+    second = client.post(f"/api/project/{pid}/generate", json={}).json()
+    assert second["id"] == first["id"] and second["deduplicated"] and not first["deduplicated"]
+    release.set()
+    assert wait_for_job(client, first["id"], "complete")["result"] == {"filename": f"{pid}.mp4"}
+    third = client.post(f"/api/project/{pid}/generate", json={}).json()
+    assert third["id"] != first["id"]  # a finished job isn't joined
+    wait_for_job(client, third["id"], "complete")
+
+
+def test_cancel_queued_and_running_jobs(client, make_project, stub_render):
+    release, started = stub_render
+    pids = [make_project() for _ in range(vibe.JOB_CONCURRENCY + 1)]
+    ids = [client.post(f"/api/project/{pid}/generate", json={}).json()["id"] for pid in pids]
+    running, queued = ids[0], ids[-1]
+    wait_for_job(client, running, "running")
+    assert client.get(f"/api/jobs/{queued}").json()["status"] == "queued"
+
+    assert client.post(f"/api/jobs/{queued}/cancel").json()["status"] == "cancelled"
+    client.post(f"/api/jobs/{running}/cancel")
+    assert wait_for_job(client, running, "cancelled")["status"] == "cancelled"
+    assert client.get(f"/api/project/{pids[0]}").json()["status"] == "draft"
+    release.set()
+    for jid in ids[1:-1]: wait_for_job(client, jid, "complete")
+    assert pids[-1] not in started  # the cancelled job never ran
+
+
+def shared_queue(tmp_path):
+    return vibe.SQLiteJobQueue(vibe.SQLiteProjectStore(str(tmp_path / "store.db")))
+
+
+def queued_job(jid, pid):
+    return {"id": jid, "project_id": pid, "status": "queued", "priority": 5, "params": {}, "worker": None,
+            "started": None, "finished": None, "result": None, "error": None}
+
+
+def row(queue, jid):
+    return next(json.loads(data) for _, _, data in reversed(queue.changes(0)) if json.loads(data)["id"] == jid)
+
+
+def test_shared_queue_joins_a_project_s_active_job(tmp_path):
+    queue = shared_queue(tmp_path)
+    assert queue.submit(queued_job("j1", "p1"))[2] is False
+    _, job, joined = queue.submit(queued_job("j2", "p1"))
+    assert joined and job["id"] == "j1"
+
+
+def test_shared_queue_requeues_a_lost_worker_job_then_fails_it(tmp_path):
+    queue = shared_queue(tmp_path)
+    queue.submit(queued_job("j1", "p1"))
+    for attempt in range(1, vibe.JOB_MAX_ATTEMPTS + 1):
+        _, job = queue.claim(f"w{attempt}")
+        assert job["id"] == "j1" and queue.owns("j1", f"w{attempt}")
+        assert queue.reclaim(60) == []  # heartbeat still fresh
+        failed = queue.reclaim(-1)  # lease expired
+        assert queue.heartbeat(f"w{attempt}", 1, ["j1"], []) == ([], ["j1"])  # the worker has lost it
+        if attempt < vibe.JOB_MAX_ATTEMPTS:
+            assert failed == [] and row(queue, "j1")["status"] == "queued"
+    assert [j["id"] for j in failed] == ["j1"] and row(queue, "j1")["status"] == "failed"
+    assert queue.claim("w9") is None
+
+
+def test_shared_queue_refuses_a_network_filesystem(tmp_path, monkeypatch):
+    monkeypatch.setattr(vibe, "filesystem_type", lambda path: "nfs4")
+    with pytest.raises(ValueError, match="local disk"):
+        shared_queue(tmp_path)
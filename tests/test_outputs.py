@@ -0,0 +1,34 @@
+"""
+Render output naming. Needs ffmpeg on PATH.
+"""
+
+import time
+
+import pytest
+
+from conftest import needs_ffmpeg, vibe
+
+
+def wait(client, job):
+    while job["status"] in ("queued", "running"):
+        time.sleep(0.2)
+        job = client.get(f"/api/jobs/{job['id']}").json()
+    assert job["status"] == "complete", job["error"]
+    return job["result"]["filename"]
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("engine", ["segments", "single_pass"])
+def test_back_to_back_renders_get_distinct_names(client, make_project, engine):
+    pid = make_project(images=1, clips=1, real=True)
+    body = {"duration": 4, "width": 160, "height": 284, "engine": engine}
+    names = []
+    try:
+        for _ in range(2):  # the second is a cache hit and lands in the same second
+            r = client.post(f"/api/project/{pid}/generate", json=body)
+            assert r.status_code == 202, r.text
+            names.append(wait(client, r.json()))
+        assert names[0] != names[1]
+        assert all((vibe.OUTPUT_DIR / n).is_file() for n in names)
+    finally:
+        for n in names: (vibe.OUTPUT_DIR / n).unlink(missing_ok=True)
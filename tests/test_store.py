@@ -0,0 +1,21 @@
+"""
+SQLiteProjectStore.
+"""
+
+import pytest
+
+from app import SQLiteProjectStore
+
+
+def test_failed_edit_leaves_no_trace_in_the_cache():
+    store = SQLiteProjectStore(":memory:")
+    store.create({"id": "p1", "category": "travel", "media": [{"id": "m1", "order": 0}], "audio_tracks": []})
+    store["p1"]  # cached
+    with pytest.raises(RuntimeError):
+        with store.edit("p1") as project:
+            project["category"] = "food"
+            project["media"].append({"id": "m2", "order": 1})
+            raise RuntimeError("abandon the edit")
+    assert store["p1"]["category"] == "travel"
+    assert [m["id"] for m in store["p1"]["media"]] == ["m1"]
+    assert store.get_media("p1", "m2") is None
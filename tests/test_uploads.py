@@ -0,0 +1,73 @@
+"""
+Resumable uploads: Content-Range handling, resuming, and the file hash.
+"""
+
+import hashlib, os, time
+
+import pytest
+
+from conftest import vibe
+
+DATA = os.urandom(3000)
+
+
+@pytest.fixture
+def upload(client, make_project):
+    pid = make_project(images=0)
+    r = client.post(f"/api/project/{pid}/uploads", json={"filename": "photo.jpg", "size": len(DATA)})
+    assert r.status_code == 200, r.text
+    yield pid, r.json()["upload_id"]
+    while vibe._probe_tasks: time.sleep(0.01)  # let the upload's background probe finish
+
+
+def put(client, pid, uid, start, end, body=None, total=len(DATA)):
+    return client.put(f"/api/project/{pid}/uploads/{uid}", content=DATA[start:end + 1] if body is None else body,
+                      headers={"Content-Range": f"bytes {start}-{end}/{total}"})
+
+
+def offset(client, pid, uid):
+    return client.get(f"/api/project/{pid}/uploads/{uid}").json()["offset"]
+
+
+def test_ranges_in_order_complete_the_upload(client, upload):
+    pid, uid = upload
+    assert put(client, pid, uid, 0, 999).json()["offset"] == 1000
+    assert offset(client, pid, uid) == 1000
+    assert put(client, pid, uid, 1000, 1999).json()["offset"] == 2000
+    done = put(client, pid, uid, 2000, 2999).json()
+    assert done["complete"]
+    item = vibe.projects.get_media(pid, uid)
+    assert open(item["path"], "rb").read() == DATA
+    assert item["sha256"] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_out_of_order_and_overlapping_ranges_are_refused(client, upload):
+    pid, uid = upload
+    put(client, pid, uid, 0, 999)
+    ahead = put(client, pid, uid, 2000, 2999)
+    assert ahead.status_code == 409 and ahead.json()["offset"] == 1000
+    overlap = put(client, pid, uid, 500, 1499)
+    assert overlap.status_code == 409 and overlap.json()["offset"] == 1000
+    assert offset(client, pid, uid) == 1000  # nothing was written
+    put(client, pid, uid, 1000, 2999)
+    item = vibe.projects.get_media(pid, uid)
+    assert item["sha256"] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_bad_ranges(client, upload):
+    pid, uid = upload
+    assert client.put(f"/api/project/{pid}/uploads/{uid}", content=DATA).status_code == 400
+    assert put(client, pid, uid, 0, 999, total=len(DATA) + 1).status_code == 416
+    assert put(client, pid, uid, 0, len(DATA)).status_code == 416
+    assert put(client, pid, uid, 10, 9, body=b"").status_code == 416
+
+
+def test_body_longer_than_its_range_is_dropped_and_resumable(client, upload):
+    pid, uid = upload
+    put(client, pid, uid, 0, 999)
+    assert put(client, pid, uid, 1000, 1999, body=DATA[1000:2500]).status_code == 413
+    assert offset(client, pid, uid) == 1000  # truncated back
+    put(client, pid, uid, 1000, 2999)
+    item = vibe.projects.get_media(pid, uid)
+    assert open(item["path"], "rb").read() == DATA
+    assert item["sha256"] == hashlib.sha256(DATA).hexdigest()